@@ -6,6 +6,7 @@ root_path = os.getcwd()
 args = {
     "embed_model_path": root_path + "/models/baai/bge-large-zh-v1.5",
     "reranker_model_path": root_path + "/models/baai/bge-reranker-large",
+    "embedding_cache_dir": root_path + "/storage/memory/embedding_cache",
 }
 
 role_package_manage = RolePackageManage()
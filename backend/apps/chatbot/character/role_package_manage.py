@@ -1,22 +1,27 @@
 import json
 import os
 import shutil
+import threading
 import zipfile
-from typing import Optional
-import faiss
+from typing import List, Optional
 import numpy as np
 from FlagEmbedding import FlagModel, FlagReranker
 
+from ..memory.embedding_cache import EmbeddingCache
+from ..memory.faiss.index_store import read_index_file
+
 
 class FlagModelFactory:
     config: Optional[dict]
     embed_model: FlagModel
     reranker: FlagReranker
+    embedding_cache: EmbeddingCache
 
     def __init__(self, config: Optional[dict]):
         self.config = config
         self.embed_model = None
         self.reranker = None
+        self.embedding_cache = None
         # embed_model_path = self.config["embed_model_path"]
         # # 向量检索模型
         # self.embed_model = FlagModel(embed_model_path,
@@ -35,6 +40,18 @@ class FlagModelFactory:
                                          use_fp16=False)
         return self.embed_model
 
+    def get_embedding_cache(self) -> EmbeddingCache:
+        if self.embedding_cache is None:
+            # 以模型路径区分不同嵌入模型的向量缓存
+            self.embedding_cache = EmbeddingCache(self.config.get("embedding_cache_dir"),
+                                                  model_id=self.config["embed_model_path"])
+        return self.embedding_cache
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """获取文本向量，优先读取向量缓存，未命中时才加载并调用嵌入模型"""
+        return self.get_embedding_cache().get_or_compute(
+            texts, lambda missing: self.get_embed_model().encode(missing))
+
     def get_reranker(self):
         # with lock:
         if self.reranker is None:
@@ -48,14 +65,17 @@ class RagSearch:
 
     def __init__(self, flag_model_factory: FlagModelFactory):
         self.flag_model_factory = flag_model_factory
+        # 已打开的角色包索引和问答数据，按文件路径缓存，文件修改后重新加载
+        self._index_cache = {}
+        self._dataset_cache = {}
+        self._cache_lock = threading.Lock()
 
     def search(self, user_name: str, role_name: str, query: str, rerank_k: int, recall_k: int, dataset_json_path: str,
                embed_index_idx_path: str):
-        embed_index = faiss.read_index(embed_index_idx_path)  # build the index
-        with open(dataset_json_path, "r") as f:
-            index_source_json = json.load(f)
+        embed_index = self.__load_index(embed_index_idx_path)
+        index_source_json = self.__load_dataset(dataset_json_path)
 
-        recall_sim_examples = self.__search_examples(self.flag_model_factory.get_embed_model(), index_source_json,
+        recall_sim_examples = self.__search_examples(index_source_json,
                                                      embed_index,
                                                      query,
                                                      top_k=recall_k)
@@ -64,6 +84,27 @@ class RagSearch:
         print(examples)
         return examples
 
+    def __load_index(self, embed_index_idx_path: str):
+        """以内存映射只读方式打开角色包索引并缓存，避免每次查询都完整读取索引文件"""
+        mtime = os.path.getmtime(embed_index_idx_path)
+        with self._cache_lock:
+            cached = self._index_cache.get(embed_index_idx_path)
+            if cached is None or cached[0] != mtime:
+                embed_index, _ = read_index_file(embed_index_idx_path)
+                cached = (mtime, embed_index)
+                self._index_cache[embed_index_idx_path] = cached
+            return cached[1]
+
+    def __load_dataset(self, dataset_json_path: str):
+        mtime = os.path.getmtime(dataset_json_path)
+        with self._cache_lock:
+            cached = self._dataset_cache.get(dataset_json_path)
+            if cached is None or cached[0] != mtime:
+                with open(dataset_json_path, "r") as f:
+                    cached = (mtime, json.load(f))
+                self._dataset_cache[dataset_json_path] = cached
+            return cached[1]
+
     def __format_examples(self, user_name: str, role_name: str, sim_examples, ):
         examples = ""
         for sim_example in sim_examples:
@@ -78,8 +119,8 @@ class RagSearch:
         val_a = item["answer"]
         return val_q, val_a
 
-    def __search_examples(self, embed_model, source_json_array, embed_index, q, top_k=2):
-        xq = np.array([embed_model.encode(q)])
+    def __search_examples(self, source_json_array, embed_index, q, top_k=2):
+        xq = self.flag_model_factory.encode([q])
         D, I = embed_index.search(xq, top_k)  # actual search
         ret_array = []
         for idx in I[0]:
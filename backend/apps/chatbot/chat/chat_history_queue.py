@@ -2,6 +2,7 @@ import json
 import logging
 import queue
 import threading
+import time
 import traceback
 # 避免循环导入，不直接导入singleton_sys_config
 from ..config import get_sys_config
@@ -13,6 +14,10 @@ logger = logging.getLogger(__name__)
 # 创建一个线程安全的优先级队列
 chat_history_queue = queue.SimpleQueue()
 
+# 后台线程每批最多写入的消息数，以及收到第一条消息后最多等待的秒数
+CHAT_HISTORY_BATCH_SIZE = 32
+CHAT_HISTORY_BATCH_WAIT = 0.5
+
 
 class ChatHistoryMessage():
     '''定义聊天历史消息队列'''
@@ -40,32 +45,61 @@ def put_message(message: ChatHistoryMessage):
     global chat_history_queue
     chat_history_queue.put(message)
 
-def send_message():
+def drain_messages(batch_size: int = CHAT_HISTORY_BATCH_SIZE,
+                   max_wait: float = CHAT_HISTORY_BATCH_WAIT) -> list[ChatHistoryMessage]:
+    """
+    阻塞等待第一条消息，随后在max_wait秒内继续收集，最多batch_size条
+    队列中已积压的消息会被立即取出，一次批量写入
+    """
     global chat_history_queue
-    
+    messages = []
+    message = chat_history_queue.get()
+    deadline = time.monotonic() + max_wait
+    while True:
+        if message is not None and message != '':
+            messages.append(message)
+        if len(messages) >= batch_size:
+            break
+        remaining = deadline - time.monotonic()
+        try:
+            message = chat_history_queue.get(timeout=remaining) if remaining > 0 else chat_history_queue.get_nowait()
+        except queue.Empty:
+            break
+    return messages
+
+
+def send_message():
     while True:
         try:
-            message = chat_history_queue.get()
-            if (message != None and message != ''):
-                try:
-                    logger.info(f"处理聊天历史消息: {message.you_name} -> {message.role_name}")
-                    
-                    # 获取系统配置
-                    sys_config = get_sys_config()
-                    
-                    # 检查记忆驱动是否已初始化
-                    if sys_config.memory_storage_driver is None:
-                        logger.warning("记忆驱动未初始化，无法保存聊天历史")
-                        continue
-                    
-                    # 保存到记忆系统
-                    sys_config.memory_storage_driver.save(
-                        message.you_name, message.you_message, message.role_name, message.role_message)
-                    
-                    logger.info(f"聊天历史已成功保存到记忆系统")
-                except Exception as e:
-                    logger.error(f"保存聊天历史到记忆系统失败: {str(e)}")
-                    traceback.print_exc()
+            messages = drain_messages()
+            if not messages:
+                continue
+            try:
+                logger.info(f"处理聊天历史消息: {len(messages)} 条")
+                
+                # 获取系统配置
+                sys_config = get_sys_config()
+                
+                # 检查记忆驱动是否已初始化
+                if sys_config.memory_storage_driver is None:
+                    logger.warning("记忆驱动未初始化，无法保存聊天历史")
+                    continue
+                
+                # 批量保存到记忆系统
+                sys_config.memory_storage_driver.save_many([
+                    {
+                        "you_name": message.you_name,
+                        "query_text": message.you_message,
+                        "role_name": message.role_name,
+                        "answer_text": message.role_message
+                    }
+                    for message in messages
+                ])
+                
+                logger.info(f"聊天历史已成功保存到记忆系统")
+            except Exception as e:
+                logger.error(f"保存聊天历史到记忆系统失败: {str(e)}")
+                traceback.print_exc()
         except Exception as e:
             logger.error(f"处理聊天历史队列消息时出错: {str(e)}")
             traceback.print_exc()
@@ -71,6 +71,35 @@ class ConversationConfig(BaseModel):
 class FaissMemoryConfig(BaseModel):
     """FAISS记忆配置"""
     dataDir: str = Field(default="storage/memory", description="FAISS数据存储目录")
+    idWorkerId: int = Field(default=-1, description="记忆ID生成器的机器编号（0-31），-1表示自动占用空闲编号")
+    indexMmap: bool = Field(default=True, description="是否以内存映射只读方式打开索引文件")
+    indexPrefetch: bool = Field(default=False, description="启动时是否在后台预读索引文件")
+    ivfThreshold: int = Field(default=20000, description="记忆数量达到该值后由平坦索引升级为IVF索引")
+    compressedIndexType: str = Field(default="none", description="大规模时使用的压缩索引类型：none/sq8/pq")
+    compressedThreshold: int = Field(default=200000, description="记忆数量达到该值后升级为压缩索引")
+    nprobe: int = Field(default=16, description="IVF索引检索时探查的聚类数量")
+    candidatePoolSize: int = Field(default=100, description="向量与关键词检索各自召回的候选数量上限")
+    vectorSearchWeight: float = Field(default=0.3, description="融合向量检索与关键词检索时向量相似度的权重")
+    keywordSearchWeight: float = Field(default=0.7, description="融合向量检索与关键词检索时BM25分数的权重")
+    relevanceWeight: float = Field(default=0.4, description="检索排序中相关性的权重")
+    keywordWeight: float = Field(default=0.25, description="检索排序中关键词匹配度的权重")
+    recencyWeight: float = Field(default=0.2, description="检索排序中时效性的权重")
+    importanceWeight: float = Field(default=0.15, description="检索排序中重要性的权重")
+    consolidationEnabled: bool = Field(default=True, description="是否在后台合并近似重复的记忆")
+    consolidationThreshold: float = Field(default=0.95, description="同一角色下余弦相似度达到该值的记忆视为重复")
+    consolidationInterval: float = Field(default=60, description="后台记忆整理的间隔（秒）")
+    maxMemoriesPerOwner: int = Field(default=50000, description="每个角色最多保留的记忆条数，0表示不限制")
+    retentionHalfLifeDays: float = Field(default=7.0, description="淘汰评分中时效性的半衰期（天）")
+    retentionInterval: float = Field(default=300, description="后台记忆淘汰的间隔（秒）")
+    evictionBatchSize: int = Field(default=1000, description="每个角色每轮最多淘汰的记忆条数")
+    snapshotRestorePath: str = Field(default="", description="启动时记忆为空则从该快照目录恢复，为空表示不恢复")
+    tokenizerProcesses: int = Field(default=0, description="批量分词使用的进程数，0表示不使用进程池")
+    summaryBatchSize: int = Field(default=8, description="开启摘要时每次LLM调用合并的对话轮数")
+    summaryMaxWait: float = Field(default=30, description="对话等待批量摘要的最长时间（秒）")
+    summaryDeadline: float = Field(default=20, description="单次摘要调用的截止时间（秒），超时以原文保存")
+    walFsync: str = Field(default="group", description="向量日志落盘方式：group为组提交，always为每次写入都fsync")
+    walGroupCommitRecords: int = Field(default=256, description="组提交时累计多少条向量后fsync")
+    walGroupCommitMs: float = Field(default=100, description="组提交时最早一条未落盘写入最多等待的毫秒数")
 
 
 class MemoryStorageConfig(BaseModel):
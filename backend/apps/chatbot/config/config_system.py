@@ -19,6 +19,7 @@ logging.getLogger().setLevel(logging.INFO)
 from ..llms.llm_model_strategy import LlmModelDriver
 from ..reflection.reflection import ImportanceRating, PortraitAnalysis
 from .config_manager import get_config_manager, SystemConfig
+from ..utils.snowflake_utils import WorkerIdConflictError
 from .interfaces import MemoryStorageDriverFactory, SysConfigInterface
 
 logger = logging.getLogger(__name__)
@@ -243,6 +244,11 @@ class SysConfig(SysConfigInterface):
     
     def _init_memory_storage(self) -> None:
         """初始化记忆存储，使用工厂方法"""
+        # 关闭旧的记忆模块，待写入的对话先落盘
+        if getattr(self, "memory_storage_driver", None) is not None:
+            self.memory_storage_driver.close()
+            self.memory_storage_driver = None
+
         if not self.enable_longMemory and not self.enable_summary and not self.enable_reflection:
             logger.info("记忆功能未启用，跳过记忆模块初始化")
             self.memory_storage_driver = None
@@ -258,8 +264,38 @@ class SysConfig(SysConfigInterface):
             os.makedirs(data_dir, exist_ok=True)
             logger.info(f"使用数据目录: {data_dir}")
             
+            faiss_memory_config = config.memoryStorageConfig.faissMemory
             memory_storage_config = {
                 "data_dir": data_dir,
+                "id_worker_id": faiss_memory_config.idWorkerId,
+                "index_mmap": faiss_memory_config.indexMmap,
+                "index_prefetch": faiss_memory_config.indexPrefetch,
+                "ivf_threshold": faiss_memory_config.ivfThreshold,
+                "compressed_index_type": faiss_memory_config.compressedIndexType,
+                "compressed_threshold": faiss_memory_config.compressedThreshold,
+                "nprobe": faiss_memory_config.nprobe,
+                "candidate_pool_size": faiss_memory_config.candidatePoolSize,
+                "vector_search_weight": faiss_memory_config.vectorSearchWeight,
+                "keyword_search_weight": faiss_memory_config.keywordSearchWeight,
+                "relevance_weight": faiss_memory_config.relevanceWeight,
+                "keyword_weight": faiss_memory_config.keywordWeight,
+                "recency_weight": faiss_memory_config.recencyWeight,
+                "importance_weight": faiss_memory_config.importanceWeight,
+                "consolidation_enabled": faiss_memory_config.consolidationEnabled,
+                "consolidation_threshold": faiss_memory_config.consolidationThreshold,
+                "consolidation_interval": faiss_memory_config.consolidationInterval,
+                "max_memories_per_owner": faiss_memory_config.maxMemoriesPerOwner,
+                "retention_half_life_days": faiss_memory_config.retentionHalfLifeDays,
+                "retention_interval": faiss_memory_config.retentionInterval,
+                "eviction_batch_size": faiss_memory_config.evictionBatchSize,
+                "snapshot_restore_path": faiss_memory_config.snapshotRestorePath,
+                "tokenizer_processes": faiss_memory_config.tokenizerProcesses,
+                "summary_batch_size": faiss_memory_config.summaryBatchSize,
+                "summary_max_wait": faiss_memory_config.summaryMaxWait,
+                "summary_deadline": faiss_memory_config.summaryDeadline,
+                "wal_fsync": faiss_memory_config.walFsync,
+                "wal_group_commit_records": faiss_memory_config.walGroupCommitRecords,
+                "wal_group_commit_ms": faiss_memory_config.walGroupCommitMs,
             }
             
             # 使用工厂方法获取MemoryStorageDriver类并创建实例
@@ -290,6 +326,9 @@ class SysConfig(SysConfigInterface):
                         logger.error("长期记忆功能已启用但初始化失败，这可能导致后续问题")
                 
                 logger.info("记忆模块初始化成功")
+            except WorkerIdConflictError:
+                # 机器编号冲突时继续运行会生成重复的记忆ID，拒绝启动
+                raise
             except Exception as inner_e:
                 logger.error(f"MemoryStorageDriver实例化失败: {str(inner_e)}")
                 import traceback
@@ -303,6 +342,8 @@ class SysConfig(SysConfigInterface):
                 self.memory_storage_driver = None
                 raise inner_e
                 
+        except WorkerIdConflictError:
+            raise
         except ImportError as ie:
             logger.error(f"导入记忆模块失败: {str(ie)}")
             import traceback
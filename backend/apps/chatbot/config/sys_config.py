@@ -3,6 +3,7 @@ import logging
 import os
 
 from ..llms.llm_model_strategy import LlmModelDriver
+from ..utils.snowflake_utils import WorkerIdConflictError
 from ..models import CustomRoleModel, SysConfigModel
 from ..character.sys.aili_zh import aili_zh
 from ..reflection.reflection import ImportanceRating, PortraitAnalysis
@@ -23,12 +24,45 @@ def lazy_memory_storage(sys_config_json: any, sys_cofnig: any):
             return None
             
         # 加载记忆模块配置
+        faiss_memory_config = sys_config_json.get("memoryStorageConfig", {}).get("faissMemory", {})
         memory_storage_config = {
-            "data_dir": sys_config_json.get("memoryStorageConfig", {}).get("faissMemory", {}).get("dataDir", "storage/memory"),
+            "data_dir": faiss_memory_config.get("dataDir", "storage/memory"),
+            "id_worker_id": faiss_memory_config.get("idWorkerId", -1),
+            "index_mmap": faiss_memory_config.get("indexMmap", True),
+            "index_prefetch": faiss_memory_config.get("indexPrefetch", False),
+            "ivf_threshold": faiss_memory_config.get("ivfThreshold", 20000),
+            "compressed_index_type": faiss_memory_config.get("compressedIndexType", "none"),
+            "compressed_threshold": faiss_memory_config.get("compressedThreshold", 200000),
+            "nprobe": faiss_memory_config.get("nprobe", 16),
+            "candidate_pool_size": faiss_memory_config.get("candidatePoolSize", 100),
+            "vector_search_weight": faiss_memory_config.get("vectorSearchWeight", 0.3),
+            "keyword_search_weight": faiss_memory_config.get("keywordSearchWeight", 0.7),
+            "relevance_weight": faiss_memory_config.get("relevanceWeight", 0.4),
+            "keyword_weight": faiss_memory_config.get("keywordWeight", 0.25),
+            "recency_weight": faiss_memory_config.get("recencyWeight", 0.2),
+            "importance_weight": faiss_memory_config.get("importanceWeight", 0.15),
+            "consolidation_enabled": faiss_memory_config.get("consolidationEnabled", True),
+            "consolidation_threshold": faiss_memory_config.get("consolidationThreshold", 0.95),
+            "consolidation_interval": faiss_memory_config.get("consolidationInterval", 60),
+            "max_memories_per_owner": faiss_memory_config.get("maxMemoriesPerOwner", 50000),
+            "retention_half_life_days": faiss_memory_config.get("retentionHalfLifeDays", 7.0),
+            "retention_interval": faiss_memory_config.get("retentionInterval", 300),
+            "eviction_batch_size": faiss_memory_config.get("evictionBatchSize", 1000),
+            "snapshot_restore_path": faiss_memory_config.get("snapshotRestorePath", ""),
+            "tokenizer_processes": faiss_memory_config.get("tokenizerProcesses", 0),
+            "summary_batch_size": faiss_memory_config.get("summaryBatchSize", 8),
+            "summary_max_wait": faiss_memory_config.get("summaryMaxWait", 30),
+            "summary_deadline": faiss_memory_config.get("summaryDeadline", 20),
+            "wal_fsync": faiss_memory_config.get("walFsync", "group"),
+            "wal_group_commit_records": faiss_memory_config.get("walGroupCommitRecords", 256),
+            "wal_group_commit_ms": faiss_memory_config.get("walGroupCommitMs", 100),
         }
         logger.debug(f"=> memory_storage_config:{memory_storage_config}")
         # 加载记忆模块驱动
         return MemoryStorageDriver(memory_storage_config=memory_storage_config, sys_config=sys_cofnig)
+    except WorkerIdConflictError:
+        # 机器编号冲突时继续运行会生成重复的记忆ID，拒绝启动
+        raise
     except KeyError as e:
         logger.error(f"记忆模块配置不完整: {str(e)}")
         # 使用默认配置
@@ -153,7 +187,36 @@ class SysConfig:
             },
             "memoryStorageConfig": {
                 "faissMemory": {
-                    "dataDir": "storage/memory"
+                    "dataDir": "storage/memory",
+                    "idWorkerId": -1,
+                    "indexMmap": True,
+                    "indexPrefetch": False,
+                    "ivfThreshold": 20000,
+                    "compressedIndexType": "none",
+                    "compressedThreshold": 200000,
+                    "nprobe": 16,
+                    "candidatePoolSize": 100,
+                    "vectorSearchWeight": 0.3,
+                    "keywordSearchWeight": 0.7,
+                    "relevanceWeight": 0.4,
+                    "keywordWeight": 0.25,
+                    "recencyWeight": 0.2,
+                    "importanceWeight": 0.15,
+                    "consolidationEnabled": True,
+                    "consolidationThreshold": 0.95,
+                    "consolidationInterval": 60,
+                    "maxMemoriesPerOwner": 50000,
+                    "retentionHalfLifeDays": 7.0,
+                    "retentionInterval": 300,
+                    "evictionBatchSize": 1000,
+                    "snapshotRestorePath": "",
+                    "tokenizerProcesses": 0,
+                    "summaryBatchSize": 8,
+                    "summaryMaxWait": 30,
+                    "summaryDeadline": 20,
+                    "walFsync": "group",
+                    "walGroupCommitRecords": 256,
+                    "walGroupCommitMs": 100
                 },
                 "enableLongMemory": False,
                 "enableSummary": False,
@@ -551,10 +614,15 @@ class SysConfig:
             self.enable_longMemory = False
             self.enable_reflection = False
 
-        # 懒加载记忆模块
+        # 懒加载记忆模块，先关闭旧的记忆模块，待写入的对话先落盘
+        if getattr(self, "memory_storage_driver", None) is not None:
+            self.memory_storage_driver.close()
+            self.memory_storage_driver = None
         try:
             self.memory_storage_driver = lazy_memory_storage(
                 sys_config_json=sys_config_json, sys_cofnig=self)
+        except WorkerIdConflictError:
+            raise
         except Exception as e:
             logger.error(f"init memory_storage error: {str(e)}")
             # 如果初始化失败，设置为None
@@ -265,7 +265,8 @@ class IntentActionParser():
                 you_name="",
                 query="",
                 short_history=[],
-                long_history=""
+                long_history="",
+                cache="intent"
             )
             
             # 解析JSON结果
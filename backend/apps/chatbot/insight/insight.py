@@ -91,7 +91,7 @@ class PortraitObservation:
         logger.info(f"=> prompt:{prompt}")
         result = self.llm_model_driver.chat(
             prompt=prompt, type=self.llm_model_driver_type, role_name="", you_name="", query="",
-            short_history=[], long_history="")
+            short_history=[], long_history="", cache="portrait_observation")
         logger.info(f"=> entitys:{result}")
         entitys = []
         try:
@@ -137,7 +137,7 @@ class TopicBot:
         prompt = input_prompt + self.output_prompt
         result = self.llm_model_driver.chat(
             prompt=prompt, type=self.llm_model_driver_type, role_name="", you_name="", query="",
-            short_history=[], long_history="")
+            short_history=[], long_history="", cache="topic")
         logger.info(f"topic prompt:{prompt}")
         logger.info(f"=> suggestion:{result}")
         suggestion = ""
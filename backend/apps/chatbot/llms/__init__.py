@@ -1,5 +1,8 @@
 from .base import BaseLlmGeneration, LlmResponse, LlmMetrics
-from .llm_model_strategy import LlmModelStrategy, LlmLoadBalancer, LlmMonitor, LlmModelDriver
+from .load_balancer import LlmLoadBalancer
+from .rate_limiter import TokenBucketLimiter
+from .response_cache import LlmResponseCache
+from .llm_model_strategy import LlmModelStrategy, LlmMonitor, LlmModelDriver
 
 __all__ = [
     'BaseLlmGeneration',
@@ -7,6 +10,8 @@ __all__ = [
     'LlmMetrics',
     'LlmModelStrategy',
     'LlmLoadBalancer',
+    'TokenBucketLimiter',
+    'LlmResponseCache',
     'LlmMonitor',
     'LlmModelDriver'
 ]
@@ -1,13 +1,26 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 import asyncio
-from typing import Optional
+from typing import AsyncIterator, Iterable, Optional
 import logging
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
+
+from ..utils.chat_message_utils import format_chat_text
+from ..utils.str_utils import remove_spaces_and_tabs
 
 logger = logging.getLogger(__name__)
 
+ERROR_REPLY = "抱歉，发生了错误，请稍后重试。"
+
+
+@lru_cache(maxsize=1)
+def load_provider_env() -> None:
+    """加载.env中的模型配置，进程内只执行一次，各模型实例共享"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
 @dataclass
 class LlmResponse:
     content: str
@@ -30,19 +43,7 @@ class BaseLlmGeneration(ABC):
     """大语言模型生成的基类，提供共享功能和错误处理"""
     
     def __init__(self):
-        self._rate_limit_semaphore = asyncio.Semaphore(10)  # 限制并发请求数
-        self._last_request_time = datetime.min
-        self._min_request_interval = 0.1  # 最小请求间隔（秒）
         self.max_tokens = 2048  # 默认最大token数
-        
-    async def _rate_limit(self):
-        """实现请求限流"""
-        async with self._rate_limit_semaphore:
-            now = datetime.now()
-            time_since_last = (now - self._last_request_time).total_seconds()
-            if time_since_last < self._min_request_interval:
-                await asyncio.sleep(self._min_request_interval - time_since_last)
-            self._last_request_time = datetime.now()
             
     def _validate_response(self, response: LlmResponse) -> bool:
         """验证模型响应"""
@@ -63,4 +64,114 @@ class BaseLlmGeneration(ABC):
             model=self.__class__.__name__,
             timestamp=datetime.now(),
             error=error_msg
-        ) 
\ No newline at end of file
+        )
+
+    @abstractmethod
+    def complete(self, prompt: str, role_name: str, you_name: str, query: str, short_history: list,
+                 long_history: str) -> str:
+        """生成回答，出错时抛出异常（负载均衡器据此统计端点失败）"""
+
+    def chat(self, prompt: str, role_name: str, you_name: str, query: str, short_history: list,
+             long_history: str) -> str:
+        try:
+            return self.complete(prompt, role_name, you_name, query, short_history, long_history)
+        except Exception as e:
+            logger.error(f"{self.__class__.__name__} chat error: {str(e)}")
+            return ERROR_REPLY
+
+    def _stream_messages(self, prompt: str, you_name: str, query: str, history: list) -> list:
+        """构造流式对话的消息列表：系统提示、短期记忆中的历史对话和当前输入"""
+        messages = [{'role': 'system', 'content': prompt}]
+        for item in history:
+            messages.append({'role': 'user', 'content': item["human"]})
+            messages.append({'role': 'assistant', 'content': item["ai"]})
+        messages.append({'role': 'user', 'content': you_name + "说" + query})
+        return messages
+
+    @staticmethod
+    def _delta_content(event) -> str:
+        """从流式事件中取出清理后的增量文本，没有内容时返回空字符串"""
+        if not isinstance(event, dict):
+            event = event.model_dump()
+        choices = event.get('choices', [])
+        if not isinstance(choices, list) or len(choices) == 0:
+            return ""
+        event_text = (choices[0].get('delta') or {}).get('content', '')
+        if not isinstance(event_text, str) or event_text == "":
+            return ""
+        return remove_spaces_and_tabs(event_text)
+
+    @abstractmethod
+    def stream(self, prompt: str, role_name: str, you_name: str, query: str,
+               history: list) -> AsyncIterator[str]:
+        """流式生成回答，以异步迭代器返回清理后的token增量，出错时抛出异常"""
+
+    async def chatStream(self,
+                         prompt: str,
+                         role_name: str,
+                         you_name: str,
+                         query: str,
+                         history: list,
+                         realtime_callback=None,
+                         conversation_end_callback=None):
+        callbacks = StreamCallbacks(role_name, you_name, query, realtime_callback, conversation_end_callback)
+        try:
+            await stream_to_callbacks(self.stream(prompt, role_name, you_name, query, history), callbacks)
+        except Exception as e:
+            logger.error(f"{self.__class__.__name__} Stream chat error: {str(e)}")
+            await asyncio.get_running_loop().run_in_executor(None, callbacks.on_error)
+
+
+class StreamCallbacks:
+    """
+    流式对话的回调：每个增量调用一次实时回调，结束后格式化完整回答并调用对话结束回调
+    回调可能阻塞（如意图解析请求模型），只在调用线程或线程池中执行，不在事件循环线程中执行
+    """
+
+    def __init__(self, role_name: str, you_name: str, query: str,
+                 realtime_callback=None, conversation_end_callback=None) -> None:
+        self.role_name = role_name
+        self.you_name = you_name
+        self.query = query
+        self.realtime_callback = realtime_callback
+        self.conversation_end_callback = conversation_end_callback
+        self.answer = ''
+
+    def on_delta(self, content: str) -> None:
+        self.answer += content
+        if self.realtime_callback:
+            self.realtime_callback(self.role_name, self.you_name, content, False)
+
+    def on_end(self) -> str:
+        """:return: 格式化后的完整回答"""
+        answer = format_chat_text(self.role_name, self.you_name, self.answer)
+        if self.conversation_end_callback:
+            if self.realtime_callback:
+                self.realtime_callback(self.role_name, self.you_name, "", True)
+            self.conversation_end_callback(self.role_name, answer, self.you_name, self.query)
+        return answer
+
+    def on_error(self) -> None:
+        if self.realtime_callback:
+            self.realtime_callback(self.role_name, self.you_name, ERROR_REPLY, True)
+        if self.conversation_end_callback:
+            self.conversation_end_callback(self.role_name, ERROR_REPLY, self.you_name, self.query)
+
+
+async def stream_to_callbacks(deltas: AsyncIterator[str], callbacks: StreamCallbacks, executor=None) -> str:
+    """
+    消费token增量流，回调在线程池中依次执行，事件循环在回调阻塞时仍可调度其他流式对话
+    :param executor: 执行回调的线程池，None表示使用当前事件循环的默认执行器
+    :return: 格式化后的完整回答
+    """
+    loop = asyncio.get_running_loop()
+    async for content in deltas:
+        await loop.run_in_executor(executor, callbacks.on_delta, content)
+    return await loop.run_in_executor(executor, callbacks.on_end)
+
+
+def iterate_to_callbacks(deltas: Iterable[str], callbacks: StreamCallbacks) -> str:
+    """在调用线程中消费token增量并执行回调，:return: 格式化后的完整回答"""
+    for content in deltas:
+        callbacks.on_delta(content)
+    return callbacks.on_end()
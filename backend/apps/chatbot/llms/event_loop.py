@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# 阻塞调用（同步SDK的流式迭代等）使用的线程数上限
+LLM_BLOCKING_WORKERS = 16
+# 在驱动事件循环中发起的流式对话执行回调使用的线程数上限
+LLM_CALLBACK_WORKERS = 16
+
+_SENTINEL = object()
+
+
+class _StreamError:
+    """跨线程传递的异步迭代异常"""
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+class DriverEventLoop:
+    """
+    模型驱动的常驻事件循环
+    事件循环运行在独立的守护线程中，所有流式对话作为协程在同一个循环中并发执行，不再每次请求创建和销毁事件循环；
+    只提供阻塞接口的SDK通过有界线程池迭代，循环的默认执行器也是该线程池
+    """
+
+    def __init__(self, name: str = "llm-event-loop", blocking_workers: int = LLM_BLOCKING_WORKERS) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.blocking_executor = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix="llm-blocking")
+        self.loop.set_default_executor(self.blocking_executor)
+        # 回调可能阻塞（如意图解析请求模型），不能在事件循环线程中执行，也不占用阻塞调用的线程
+        self.callback_executor = ThreadPoolExecutor(max_workers=LLM_CALLBACK_WORKERS,
+                                                    thread_name_prefix="llm-callback")
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self) -> bool:
+        """当前是否运行在驱动事件循环中"""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def submit(self, coro: Coroutine) -> Future:
+        """从任意线程提交协程，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """从同步代码中执行协程并等待结果"""
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("不能在驱动事件循环中同步等待协程")
+        return self.submit(coro).result(timeout=timeout)
+
+    async def run_async(self, coro: Coroutine) -> Any:
+        """从其他事件循环（如ASGI）中等待在驱动事件循环上执行的协程"""
+        if self.in_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def _pump(self, iterator: AsyncIterator, put: Callable[[Any], None]) -> None:
+        """在驱动事件循环中迭代异步迭代器，逐项交给put，结束时放入结束标记，出错时放入异常"""
+        try:
+            async for item in iterator:
+                put(item)
+            put(_SENTINEL)
+        except asyncio.CancelledError:
+            # 调用方已提前结束迭代
+            raise
+        except Exception as e:
+            put(_StreamError(e))
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def iterate(self, iterator: AsyncIterator) -> Iterator:
+        """
+        在驱动事件循环中迭代异步迭代器，结果通过队列交回调用线程，调用方提前结束时取消迭代
+        调用方对每一项的处理（如实时回调）在调用线程中执行，不占用事件循环
+        """
+        if self.in_loop():
+            raise RuntimeError("不能在驱动事件循环中同步迭代")
+        items: queue.Queue = queue.Queue()
+        future = self.submit(self._pump(iterator, items.put))
+        try:
+            while True:
+                item = items.get()
+                if item is _SENTINEL:
+                    return
+                if isinstance(item, _StreamError):
+                    raise item.error
+                yield item
+        finally:
+            future.cancel()
+
+    async def aiterate(self, iterator: AsyncIterator) -> AsyncIterator:
+        """从其他事件循环中迭代在驱动事件循环上执行的异步迭代器"""
+        if self.in_loop():
+            async for item in iterator:
+                yield item
+            return
+        caller_loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        future = self.submit(self._pump(iterator, lambda item: caller_loop.call_soon_threadsafe(items.put_nowait, item)))
+        try:
+            while True:
+                item = await items.get()
+                if item is _SENTINEL:
+                    return
+                if isinstance(item, _StreamError):
+                    raise item.error
+                yield item
+        finally:
+            future.cancel()
+
+
+async def iterate_blocking(factory: Callable[[], Iterable], executor=None) -> AsyncIterator:
+    """
+    在线程池中迭代阻塞的可迭代对象，以异步迭代器返回，事件循环不被阻塞
+    :param factory: 创建可迭代对象的阻塞调用（如同步SDK的流式请求）
+    :param executor: 线程池，None表示使用事件循环的默认执行器
+    """
+    loop = asyncio.get_running_loop()
+    iterable = await loop.run_in_executor(executor, factory)
+    iterator = iter(iterable)
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, next, iterator, _SENTINEL)
+            if item is _SENTINEL:
+                break
+            yield item
+    finally:
+        # 提前结束时关闭底层的流式响应，释放HTTP连接
+        await loop.run_in_executor(executor, _close_quietly, iterable, iterator)
+
+
+def _close_quietly(iterable, iterator) -> None:
+    """先关闭SDK返回的流式响应，再关闭由它得到的迭代器（二者相同时只关闭一次）"""
+    for obj in (iterable, iterator) if iterator is not iterable else (iterable,):
+        close = getattr(obj, "close", None)
+        if close is None:
+            continue
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"关闭流式迭代器失败: {str(e)}")
+
+
+@lru_cache(maxsize=1)
+def get_driver_loop() -> DriverEventLoop:
+    """获取进程内共享的驱动事件循环"""
+    return DriverEventLoop()
@@ -1,16 +1,20 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-import threading
 import asyncio
-from typing import List, Dict, Optional
+import threading
+from typing import AsyncIterator, List, Dict, Optional
 import logging
 from datetime import datetime
+from functools import lru_cache
 
-from .base import BaseLlmGeneration, LlmResponse, LlmMetrics
-from .ollama.ollama_chat_robot import OllamaGeneration
-from .openai.openai_chat_robot import OpenAIGeneration
-from .zhipuai.zhipuai_chat_robot import ZhipuAIGeneration
+from .base import ERROR_REPLY, BaseLlmGeneration, LlmResponse, LlmMetrics, StreamCallbacks, iterate_to_callbacks, \
+    load_provider_env, stream_to_callbacks
+from .event_loop import get_driver_loop
+from .load_balancer import LlmEndpoint, LlmLoadBalancer, NoAvailableEndpointError
+from .rate_limiter import estimate_tokens
+from .response_cache import LlmResponseCache, response_cache_key
 from ..memory.chat_history import ChatHistroy
+from ..utils.http_utils import get_async_http_client, get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +26,11 @@ class LlmModelStrategy(ABC):
              long_history: str) -> str:
         pass
 
+    @abstractmethod
+    def stream(self, prompt: str, role_name: str, you_name: str, query: str,
+               history: list[ChatHistroy]) -> AsyncIterator[str]:
+        pass
+
     @abstractmethod
     async def chatStream(self,
                          prompt: str,
@@ -33,35 +42,6 @@ class LlmModelStrategy(ABC):
                          conversation_end_callback=None):
         pass
 
-class LlmLoadBalancer:
-    """负载均衡器，用于管理多个模型实例"""
-    
-    def __init__(self, model_type: str, num_instances: int = 3):
-        self.model_type = model_type
-        self.instances = []
-        self.current_index = 0
-        self.lock = threading.Lock()
-        
-        # 创建多个模型实例
-        for _ in range(num_instances):
-            if model_type == "openai":
-                self.instances.append(OpenAIGeneration())
-            elif model_type == "ollama":
-                self.instances.append(OllamaGeneration())
-            elif model_type == "zhipuai":
-                self.instances.append(ZhipuAIGeneration())
-                
-    def get_instance(self) -> BaseLlmGeneration:
-        """获取下一个可用的模型实例"""
-        with self.lock:
-            instance = self.instances[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.instances)
-            return instance
-            
-    def get_all_instances(self) -> List[BaseLlmGeneration]:
-        """获取所有模型实例"""
-        return self.instances
-
 class LlmMonitor:
     """监控和统计类，用于收集和分析模型使用情况"""
     
@@ -100,35 +80,153 @@ class LlmMonitor:
         """获取所有模型的统计信息"""
         return self.metrics
 
+def patch_litellm() -> bool:
+    """
+    修补litellm库，防止truncate错误
+    """
+    try:
+        import litellm
+
+        def no_truncate(self, *args, **kwargs):
+            """防止truncate的补丁函数"""
+            return kwargs.get('messages', [])[-1]['content']
+
+        # 尝试不同的方式来修补litellm
+        if hasattr(litellm, 'model_info'):
+            litellm.model_info.get_model_info = no_truncate
+        elif hasattr(litellm, 'utils'):
+            if hasattr(litellm.utils, 'get_model_info'):
+                litellm.utils.get_model_info = no_truncate
+
+        logger.info("成功修补litellm库，禁用truncate功能")
+        return True
+    except Exception as e:
+        logger.warning(f"修补litellm库失败: {str(e)}")
+        return False
+
+
+@lru_cache(maxsize=1)
+def setup_litellm() -> None:
+    """
+    进程内只执行一次的litellm初始化：修补truncate、设置模型上下文长度，
+    并让litellm使用共享的HTTP连接池（同步与异步各一个客户端）
+    """
+    # 先全局修补litellm库以避免truncate错误
+    try:
+        import litellm
+        if patch_litellm():
+            # 设置模型上下文长度
+            litellm.model_cost = {}
+            litellm.model_info = {}
+            litellm.max_tokens = {}
+
+            # 设置所有已知模型的上下文长度
+            max_model_context_lengths = {
+                "gpt-3.5-turbo": 4096,
+                "gpt-4": 8192,
+                "gpt-4-32k": 32768,
+                "glm-4": 8192,
+                "glm-3-turbo": 4096,
+                "claude-instant-1": 100000,
+                "claude-2": 100000,
+                "claude-3-opus-20240229": 200000,
+                "claude-3-sonnet-20240229": 180000,
+                "gemini-pro": 30720,
+                "ollama/qwen:7b": 8192,
+                "ollama/qwen:14b": 8192,
+                "ollama/llama2": 4096,
+                "ollama/mistral": 8192,
+                "ollama/openhermes": 8192,
+                "default": 8192,  # 通用默认值
+            }
+
+            # 为所有模型设置上下文长度
+            for model, ctx_length in max_model_context_lengths.items():
+                litellm.model_info[model] = litellm.model_info.get(model, {})
+                litellm.model_info[model]["max_input_tokens"] = ctx_length
+                litellm.max_tokens[model] = ctx_length
+
+            logger.info("成功修补litellm库以避免truncate错误")
+
+        # 禁用truncate检查，避免LiteLLM中的truncate错误
+        litellm.set_max_tokens = False
+        # 复用共享的keep-alive连接池，异步客户端只在驱动事件循环中使用
+        litellm.client_session = get_http_client()
+        litellm.aclient_session = get_async_http_client()
+    except ImportError:
+        logger.warning("无法导入litellm库")
+    except Exception as patch_e:
+        logger.warning(f"修补litellm库失败: {str(patch_e)}")
+
+
 class LlmModelDriver:
     """模型驱动类，使用负载均衡器管理模型实例"""
 
-    def __init__(self):
+    def __init__(self, response_cache: Optional[LlmResponseCache] = None):
+        """
+        :param response_cache: 辅助调用的回答缓存，None表示按环境变量创建默认缓存
+        """
+        load_provider_env()
         self.load_balancers = {
             "openai": LlmLoadBalancer("openai"),
             "ollama": LlmLoadBalancer("ollama"),
             "zhipuai": LlmLoadBalancer("zhipuai")
         }
         self.monitor = LlmMonitor()
-        self.chat_stream_lock = threading.Lock()
+        # litellm修补和连接池设置只在启动时执行一次，不再在每次对话时重复
+        setup_litellm()
+        # 常驻事件循环，所有流式对话在同一循环中并发执行
+        self.event_loop = get_driver_loop()
+        self.response_cache = response_cache if response_cache is not None else LlmResponseCache()
 
     def chat(self, prompt: str, type: str, role_name: str, you_name: str, query: str,
-             short_history: list[ChatHistroy], long_history: str) -> str:
+             short_history: list[ChatHistroy], long_history: str, cache: Optional[str] = None) -> str:
+        """
+        :param cache: 调用点名称，指定时按(模型, 温度, 完整提示词)缓存回答，只用于结果由输入决定的辅助调用
+        """
+        load_balancer = self.load_balancers.get(type)
+        endpoint = None
+        if cache and load_balancer and self.response_cache.enabled:
+            try:
+                endpoint = load_balancer.select()
+            except NoAvailableEndpointError:
+                # 没有可用端点时不查缓存，由_complete记录失败
+                endpoint = None
+        if endpoint is not None:
+            # 缓存键取自实际使用的端点的模型和温度，端点不可用时只换用模型相同的端点
+            key = response_cache_key(endpoint.model_name, endpoint.temperature, prompt, query)
+            result = self.response_cache.get_or_call(cache, key, lambda: self._complete(
+                prompt, type, role_name, you_name, query, short_history, long_history, endpoint=endpoint))
+        else:
+            result = self._complete(prompt, type, role_name, you_name, query, short_history, long_history)
+        return ERROR_REPLY if result is None else result
+
+    def _complete(self, prompt: str, type: str, role_name: str, you_name: str, query: str,
+                  short_history: list[ChatHistroy], long_history: str,
+                  endpoint: Optional[LlmEndpoint] = None) -> Optional[str]:
+        """
+        请求模型生成回答，出错时记录统计信息并返回None
+        :param endpoint: 优先使用的端点，None表示选择负载最低、最快的端点
+        """
         start_time = datetime.now()
         try:
             load_balancer = self.load_balancers.get(type)
             if not load_balancer:
                 raise ValueError(f"Unknown model type: {type}")
                 
-            instance = load_balancer.get_instance()
-            result = instance.chat(
-                prompt=prompt,
-                role_name=role_name,
-                you_name=you_name,
-                query=query,
-                short_history=short_history,
-                long_history=long_history
-            )
+            # 先选择端点，再在该端点的限流器中排队，排队时间不计入端点延迟
+            with load_balancer.acquire(endpoint) as lease, \
+                    lease.rate_limiter.acquire(tokens=estimate_tokens(prompt + query)) as slot:
+                lease.start()
+                result = lease.instance.complete(
+                    prompt=prompt,
+                    role_name=role_name,
+                    you_name=you_name,
+                    query=query,
+                    short_history=short_history,
+                    long_history=long_history
+                )
+                slot.add_tokens(estimate_tokens(result))
             
             response_time = (datetime.now() - start_time).total_seconds()
             self.monitor.record_request(
@@ -145,7 +243,7 @@ class LlmModelDriver:
                 error=error_msg
             )
             logger.error(f"Chat error: {error_msg}")
-            return "抱歉，发生了错误，请稍后重试。"
+            return None
 
     def chatStream(self,
                    prompt: str,
@@ -156,67 +254,62 @@ class LlmModelDriver:
                    history: list[ChatHistroy],
                    realtime_callback=None,
                    conversation_end_callback=None):
+        callbacks = StreamCallbacks(role_name, you_name, query, realtime_callback, conversation_end_callback)
+        try:
+            # token在常驻事件循环中生成，经队列交回当前线程，回调在当前线程中执行，阻塞的回调不影响其他流式对话
+            deltas = self.event_loop.iterate(self.astream(prompt, type, role_name, you_name, query, history))
+            iterate_to_callbacks(deltas, callbacks)
+        except Exception as e:
+            logger.error(f"Stream chat error: {str(e)}")
+            callbacks.on_error()
+
+    async def achatStream(self,
+                          prompt: str,
+                          type: str,
+                          role_name: str,
+                          you_name: str,
+                          query: str,
+                          history: list[ChatHistroy],
+                          realtime_callback=None,
+                          conversation_end_callback=None):
+        """
+        流式对话的协程版本，可在ASGI等其他事件循环中直接await
+        token在驱动事件循环中生成，回调在线程池中执行，不阻塞任何事件循环
+        """
+        # 在驱动事件循环中调用时使用专用的回调线程池，在其他事件循环中调用时使用该循环的默认执行器
+        executor = self.event_loop.callback_executor if self.event_loop.in_loop() else None
+        callbacks = StreamCallbacks(role_name, you_name, query, realtime_callback, conversation_end_callback)
+        try:
+            deltas = self.event_loop.aiterate(self.astream(prompt, type, role_name, you_name, query, history))
+            await stream_to_callbacks(deltas, callbacks, executor=executor)
+        except Exception as e:
+            logger.error(f"Stream chat error: {str(e)}")
+            await asyncio.get_running_loop().run_in_executor(executor, callbacks.on_error)
+
+    async def astream(self, prompt: str, type: str, role_name: str, you_name: str, query: str,
+                      history: list[ChatHistroy]) -> AsyncIterator[str]:
+        """
+        流式生成回答，以异步迭代器返回token增量，需在驱动事件循环中迭代
+        出错时记录统计信息并抛出异常
+        """
         start_time = datetime.now()
         try:
-            # 先全局修补litellm库以避免truncate错误
-            try:
-                import litellm
-                if self.patch_litellm():
-                    # 设置模型上下文长度
-                    litellm.model_cost = {}
-                    litellm.model_info = {}
-                    litellm.max_tokens = {}
-                    
-                    # 设置所有已知模型的上下文长度
-                    max_model_context_lengths = {
-                        "gpt-3.5-turbo": 4096,
-                        "gpt-4": 8192,
-                        "gpt-4-32k": 32768,
-                        "glm-4": 8192,
-                        "glm-3-turbo": 4096,
-                        "claude-instant-1": 100000,
-                        "claude-2": 100000,
-                        "claude-3-opus-20240229": 200000,
-                        "claude-3-sonnet-20240229": 180000,
-                        "gemini-pro": 30720,
-                        "ollama/qwen:7b": 8192,
-                        "ollama/qwen:14b": 8192,
-                        "ollama/llama2": 4096,
-                        "ollama/mistral": 8192,
-                        "ollama/openhermes": 8192,
-                        "default": 8192,  # 通用默认值
-                    }
-                    
-                    # 为所有模型设置上下文长度
-                    for model, ctx_length in max_model_context_lengths.items():
-                        litellm.model_info[model] = litellm.model_info.get(model, {})
-                        litellm.model_info[model]["max_input_tokens"] = ctx_length
-                        litellm.max_tokens[model] = ctx_length
-                    
-                    logger.info("成功修补litellm库以避免truncate错误")
-            except ImportError:
-                logger.warning("无法导入litellm库")
-            except Exception as patch_e:
-                logger.warning(f"修补litellm库失败: {str(patch_e)}")
-
-            # 继续正常的聊天流程
             load_balancer = self.load_balancers.get(type)
             if not load_balancer:
                 raise ValueError(f"Unknown model type: {type}")
-                
-            instance = load_balancer.get_instance()
-            
-            # 继续正常调用
-            asyncio.run(instance.chatStream(
-                prompt=prompt,
-                role_name=role_name,
-                you_name=you_name,
-                query=query,
-                history=history,
-                realtime_callback=realtime_callback,
-                conversation_end_callback=conversation_end_callback
-            ))
-            
+
+            # 排队时只挂起当前协程，流式对话结束前一直占用一个并发名额
+            prompt_tokens = estimate_tokens(self._stream_text(prompt, query, history))
+            with load_balancer.acquire() as lease:
+                slot = await lease.rate_limiter.aacquire(tokens=prompt_tokens)
+                # 端点延迟按首个token的时间计算，不含排队时间
+                lease.start()
+                with slot:
+                    async for content in lease.instance.stream(prompt, role_name, you_name, query, history):
+                        lease.mark_latency()
+                        slot.add_tokens(estimate_tokens(content))
+                        yield content
+
             response_time = (datetime.now() - start_time).total_seconds()
             self.monitor.record_request(
                 type,
@@ -224,17 +317,17 @@ class LlmModelDriver:
                 response_time=response_time
             )
         except Exception as e:
-            error_msg = str(e)
             self.monitor.record_request(
                 type,
                 success=False,
-                error=error_msg
+                error=str(e)
             )
-            logger.error(f"Stream chat error: {error_msg}")
-            if realtime_callback:
-                realtime_callback(role_name, you_name, "抱歉，发生了错误，请稍后重试。", True)
-            if conversation_end_callback:
-                conversation_end_callback(role_name, "抱歉，发生了错误，请稍后重试。", you_name, query)
+            raise
+
+    @staticmethod
+    def _stream_text(prompt: str, query: str, history: list) -> str:
+        """流式对话发送的文本，用于估计提示词的token数"""
+        return prompt + query + "".join(item["human"] + item["ai"] for item in history)
 
     def get_strategy(self, type: str) -> LlmModelStrategy:
         load_balancer = self.load_balancers.get(type)
@@ -250,26 +343,19 @@ class LlmModelDriver:
         """获取所有模型的统计信息"""
         return self.monitor.get_all_metrics()
 
+    def get_endpoint_stats(self) -> Dict[str, List[dict]]:
+        """获取各模型类型下每个端点的熔断状态、进行中请求数和EWMA延迟"""
+        return {model_type: load_balancer.stats() for model_type, load_balancer in self.load_balancers.items()}
+
+    def get_rate_limit_stats(self) -> Dict[str, Dict[str, dict]]:
+        """获取各模型类型下每个端点限流器的排队数、进行中请求数和排队等待时间"""
+        return {model_type: {endpoint.name: endpoint.rate_limiter.stats() for endpoint in load_balancer.endpoints}
+                for model_type, load_balancer in self.load_balancers.items()}
+
+    def get_response_cache_stats(self) -> Dict[str, dict]:
+        """获取回答缓存各调用点的命中率"""
+        return self.response_cache.stats()
+
     def patch_litellm(self):
-        """
-        修补litellm库，防止truncate错误
-        """
-        try:
-            import litellm
-            
-            def no_truncate(self, *args, **kwargs):
-                """防止truncate的补丁函数"""
-                return kwargs.get('messages', [])[-1]['content']
-            
-            # 尝试不同的方式来修补litellm
-            if hasattr(litellm, 'model_info'):
-                litellm.model_info.get_model_info = no_truncate
-            elif hasattr(litellm, 'utils'):
-                if hasattr(litellm.utils, 'get_model_info'):
-                    litellm.utils.get_model_info = no_truncate
-            
-            logger.info("成功修补litellm库，禁用truncate功能")
-            return True
-        except Exception as e:
-            logger.warning(f"修补litellm库失败: {str(e)}")
-            return False
+        """修补litellm库，防止truncate错误"""
+        return patch_litellm()
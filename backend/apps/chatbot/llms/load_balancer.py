@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from .base import BaseLlmGeneration
+from .rate_limiter import RateLimitTimeoutError, TokenBucketLimiter, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# EWMA平滑系数，越大越偏向最近的延迟
+EWMA_ALPHA = 0.3
+# 连续失败达到该次数后熔断
+FAILURE_THRESHOLD = 3
+# 熔断后等待的秒数，之后进入半开状态放行一个探测请求；连续熔断时翻倍，不超过上限
+OPEN_COOLDOWN = 30.0
+MAX_OPEN_COOLDOWN = 300.0
+# 尚无延迟样本的端点在有进行中请求时按该延迟（秒）估计，避免请求集中到一直没有返回的端点
+UNKNOWN_LATENCY = 1.0
+# 各模型类型逗号分隔的多端点地址环境变量
+ENDPOINT_URL_ENVS = {
+    "openai": "OPENAI_BASE_URL",
+    "ollama": "OLLAMA_API_BASE",
+    "zhipuai": "ZHIPUAI_BASE_URL"
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class NoAvailableEndpointError(RuntimeError):
+    """所有端点均处于熔断状态"""
+
+
+@dataclass(frozen=True)
+class EndpointConfig:
+    """一个端点的配置，未指定的项使用该模型类型的默认值"""
+    url: Optional[str] = None
+    model: Optional[str] = None
+    # 保存API密钥的环境变量名，不同端点可使用不同的账号
+    api_key_env: Optional[str] = None
+
+
+def split_endpoints(value: Optional[str]) -> List[str]:
+    """解析逗号分隔的端点地址列表，例如OLLAMA_API_BASE=http://a:11434,http://b:11434"""
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def load_endpoint_configs(model_type: str) -> List[EndpointConfig]:
+    """
+    从环境变量读取模型类型的端点配置
+    {MODEL_TYPE}_ENDPOINTS为JSON数组，每项可包含url、model、api_key_env，例如
+    ZHIPUAI_ENDPOINTS=[{"model": "glm-4", "api_key_env": "ZHIPUAI_API_KEY"}, {"model": "glm-4-flash", "api_key_env": "ZHIPUAI_API_KEY_2"}]；
+    未配置时按逗号分隔的地址列表（OPENAI_BASE_URL、OLLAMA_API_BASE、ZHIPUAI_BASE_URL）各建一个端点
+    """
+    value = os.environ.get(f"{model_type.upper()}_ENDPOINTS")
+    if value:
+        try:
+            items = json.loads(value)
+            configs = [EndpointConfig(url=item.get("url"), model=item.get("model"),
+                                      api_key_env=item.get("api_key_env")) for item in items]
+            if configs:
+                return configs
+        except (json.JSONDecodeError, TypeError, AttributeError) as e:
+            logger.error(f"{model_type.upper()}_ENDPOINTS格式错误，使用默认端点: {str(e)}")
+    urls = split_endpoints(os.environ.get(ENDPOINT_URL_ENVS.get(model_type, "")))
+    return [EndpointConfig(url=url) for url in urls] or [EndpointConfig()]
+
+
+class LlmEndpoint:
+    """
+    一个后端端点（同一模型类型的某个服务地址和模型）的状态
+    记录进行中的请求数、EWMA延迟和熔断状态；每个端点使用自己的限流器，回答缓存按端点的模型和温度区分
+    """
+
+    def __init__(self, name: str, instance: BaseLlmGeneration, model_type: str) -> None:
+        self.name = name
+        self.instance = instance
+        self.model_name: str = getattr(instance, "model_name", None) or model_type
+        self.temperature = getattr(instance, "temperature", None)
+        self.rate_limiter: TokenBucketLimiter = get_rate_limiter(model_type, name)
+        self.in_flight = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = OPEN_COOLDOWN
+        self.probing = False
+        self.total_requests = 0
+        self.failed_requests = 0
+
+    def available(self, now: float) -> bool:
+        """端点当前能否接收请求，熔断冷却结束时转为半开状态"""
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def score(self) -> float:
+        """选择评分，越小越优先：EWMA延迟乘以（进行中请求数 + 1），空闲且尚无延迟样本的端点优先"""
+        latency = self.ewma_latency
+        if latency is None:
+            latency = UNKNOWN_LATENCY if self.in_flight else 0.0
+        return latency * (self.in_flight + 1)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model_name,
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "ewma_latency": self.ewma_latency,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "failed_requests": self.failed_requests
+        }
+
+
+class EndpointLease:
+    """
+    一次请求对端点的占用，作为上下文管理器使用
+    退出时记录成功或失败（抛出异常视为失败，限流排队超时除外），延迟默认从start()开始的请求耗时，
+    流式请求可用mark_latency记录首个token的时间
+    """
+
+    def __init__(self, balancer: "LlmLoadBalancer", endpoint: LlmEndpoint) -> None:
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.instance = endpoint.instance
+        self.rate_limiter = endpoint.rate_limiter
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def start(self) -> None:
+        """限流排队结束、开始请求端点时调用，排队时间不计入端点延迟"""
+        self.started = time.monotonic()
+
+    def mark_latency(self) -> None:
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def __enter__(self) -> "EndpointLease":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        latency = self.latency if self.latency is not None else time.monotonic() - self.started
+        # 调用方提前结束流式迭代、在限流器中排队超时不算端点失败
+        success = exc_type is None or issubclass(
+            exc_type, (GeneratorExit, asyncio.CancelledError, RateLimitTimeoutError))
+        self.balancer.release(self.endpoint, success=success, latency=latency)
+        return False
+
+
+class LlmLoadBalancer:
+    """
+    负载均衡器，管理同一模型类型的多个端点
+    按EWMA延迟和进行中的请求数选择负载最低、最快的端点；连续失败的端点被熔断，
+    冷却后进入半开状态放行一个探测请求，成功则恢复，失败则继续熔断，请求不再排队等待慢或不可用的后端
+    """
+
+    def __init__(self, model_type: str, endpoints: Optional[List[Union[str, EndpointConfig]]] = None):
+        """
+        :param endpoints: 端点地址或端点配置列表，None表示从环境变量读取（见load_endpoint_configs）
+        """
+        self.model_type = model_type
+        self.endpoints: List[LlmEndpoint] = []
+        self.current_index = 0
+        self.lock = threading.Lock()
+
+        for config in self._endpoint_configs(endpoints):
+            name = config.url or model_type
+            if config.model:
+                name = f"{name}/{config.model}"
+            try:
+                self.endpoints.append(LlmEndpoint(name, self._create_instance(config), model_type))
+            except Exception as e:
+                logger.error(f"创建{model_type}端点{name}失败: {str(e)}")
+
+    def _endpoint_configs(self, endpoints: Optional[List[Union[str, EndpointConfig]]]) -> List[EndpointConfig]:
+        if endpoints is None:
+            return load_endpoint_configs(self.model_type)
+        configs = [item if isinstance(item, EndpointConfig) else EndpointConfig(url=item) for item in endpoints]
+        return configs or [EndpointConfig()]
+
+    def _create_instance(self, config: EndpointConfig) -> BaseLlmGeneration:
+        if self.model_type == "openai":
+            from .openai.openai_chat_robot import OpenAIGeneration
+            return OpenAIGeneration(base_url=config.url, model_name=config.model, api_key_env=config.api_key_env)
+        if self.model_type == "ollama":
+            from .ollama.ollama_chat_robot import OllamaGeneration
+            return OllamaGeneration(api_base=config.url, model_name=config.model)
+        if self.model_type == "zhipuai":
+            from .zhipuai.zhipuai_chat_robot import ZhipuAIGeneration
+            return ZhipuAIGeneration(base_url=config.url, model_name=config.model, api_key_env=config.api_key_env)
+        raise ValueError(f"Unknown model type: {self.model_type}")
+
+    def _select(self, preferred: Optional[LlmEndpoint] = None) -> LlmEndpoint:
+        """
+        选择评分最低的可用端点，调用方需持有锁
+        :param preferred: 优先使用的端点，不可用时只在模型和温度相同的端点中选择（回答缓存的键保持有效）
+        """
+        if not self.endpoints:
+            raise NoAvailableEndpointError(f"{self.model_type}没有可用的端点")
+        now = time.monotonic()
+        if preferred is not None and preferred.available(now):
+            return preferred
+        count = len(self.endpoints)
+        # 从轮询位置开始比较，评分相同的端点轮流使用
+        candidates = [self.endpoints[(self.current_index + offset) % count] for offset in range(count)]
+        if preferred is not None:
+            candidates = [endpoint for endpoint in candidates if endpoint.model_name == preferred.model_name
+                          and endpoint.temperature == preferred.temperature]
+        candidates = [endpoint for endpoint in candidates if endpoint.available(now)]
+        if not candidates:
+            raise NoAvailableEndpointError(f"{self.model_type}的所有端点均已熔断")
+        self.current_index = (self.current_index + 1) % count
+        return min(candidates, key=LlmEndpoint.score)
+
+    def select(self) -> LlmEndpoint:
+        """选择当前最优的端点（不登记进行中的请求），用于在请求前确定回答缓存的键"""
+        with self.lock:
+            return self._select()
+
+    def acquire(self, preferred: Optional[LlmEndpoint] = None) -> EndpointLease:
+        """
+        选择端点并登记一个进行中的请求，调用方需以上下文管理器使用返回的租约
+        在端点的限流器中排队的请求也计入进行中的请求数，排队结束后调用lease.start()
+        :param preferred: 优先使用的端点（见_select）
+        """
+        with self.lock:
+            endpoint = self._select(preferred)
+            if endpoint.state == HALF_OPEN:
+                endpoint.probing = True
+            endpoint.in_flight += 1
+            endpoint.total_requests += 1
+            return EndpointLease(self, endpoint)
+
+    def release(self, endpoint: LlmEndpoint, success: bool, latency: float) -> None:
+        """请求结束，更新延迟和熔断状态"""
+        with self.lock:
+            endpoint.in_flight -= 1
+            if success:
+                endpoint.ewma_latency = latency if endpoint.ewma_latency is None else \
+                    EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * endpoint.ewma_latency
+                endpoint.consecutive_failures = 0
+                if endpoint.state != CLOSED:
+                    logger.info(f"{self.model_type}端点{endpoint.name}探测成功，恢复使用")
+                endpoint.state = CLOSED
+                endpoint.probing = False
+                endpoint.cooldown = OPEN_COOLDOWN
+                return
+            endpoint.failed_requests += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.state == HALF_OPEN:
+                # 探测失败，延长熔断时间
+                endpoint.cooldown = min(endpoint.cooldown * 2, MAX_OPEN_COOLDOWN)
+                self._open(endpoint)
+            elif endpoint.state == CLOSED and endpoint.consecutive_failures >= FAILURE_THRESHOLD:
+                self._open(endpoint)
+
+    def _open(self, endpoint: LlmEndpoint) -> None:
+        endpoint.state = OPEN
+        endpoint.opened_at = time.monotonic()
+        endpoint.probing = False
+        logger.warning(f"{self.model_type}端点{endpoint.name}连续失败{endpoint.consecutive_failures}次，"
+                       f"熔断{endpoint.cooldown:.0f}s")
+
+    def get_instance(self) -> BaseLlmGeneration:
+        """获取当前最优端点的模型实例（不登记进行中的请求，也不计入延迟统计）"""
+        return self.select().instance
+
+    def get_all_instances(self) -> List[BaseLlmGeneration]:
+        """获取所有模型实例"""
+        return [endpoint.instance for endpoint in self.endpoints]
+
+    def stats(self) -> List[Dict]:
+        """各端点的状态、进行中请求数和EWMA延迟"""
+        with self.lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
@@ -1,14 +1,12 @@
 import logging
 import os
-from typing import List
+from typing import AsyncIterator, Optional
 from datetime import datetime
 
-from litellm import completion
+from litellm import acompletion, completion
 
-from ...utils.chat_message_utils import format_chat_text
-from ...utils.str_utils import remove_spaces_and_tabs
 from ...memory.chat_history import ChatHistroy
-from ..base import BaseLlmGeneration, LlmResponse
+from ..base import BaseLlmGeneration, LlmResponse, load_provider_env
 
 logger = logging.getLogger(__name__)
 
@@ -19,113 +17,74 @@ class OpenAIGeneration(BaseLlmGeneration):
     openai_api_key: str
     openai_base_url: str
 
-    def __init__(self) -> None:
+    def __init__(self, base_url: Optional[str] = None, model_name: Optional[str] = None,
+                 api_key_env: Optional[str] = None) -> None:
+        """
+        :param base_url: 服务地址，None表示使用环境变量OPENAI_BASE_URL
+        :param model_name: 模型名称，None表示使用默认模型
+        :param api_key_env: 保存API密钥的环境变量名，None表示OPENAI_API_KEY
+        """
         super().__init__()
-        from dotenv import load_dotenv
-        load_dotenv()
-        self.openai_api_key = os.environ['OPENAI_API_KEY']
-        self.openai_base_url = os.environ['OPENAI_BASE_URL']
+        load_provider_env()
+        self.openai_api_key = os.environ[api_key_env or 'OPENAI_API_KEY']
+        self.openai_base_url = base_url if base_url is not None else os.environ['OPENAI_BASE_URL']
+        if model_name:
+            self.model_name = model_name
 
-    def chat(self, prompt: str, role_name: str, you_name: str, query: str, short_history: list[ChatHistroy],
-             long_history: str) -> str:
-        try:
-            prompt = prompt + query
-            messages = [{"content": prompt, "role": "user"}]
+    def complete(self, prompt: str, role_name: str, you_name: str, query: str, short_history: list[ChatHistroy],
+                 long_history: str) -> str:
+        prompt = prompt + query
+        messages = [{"content": prompt, "role": "user"}]
+        
+        completion_params = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": self.temperature,
+            # 不设置max_tokens，避免truncate错误
+            # "max_tokens": self.max_tokens,
+        }
+        
+        if self.openai_base_url:
+            completion_params["api_base"] = self.openai_base_url
+        completion_params["api_key"] = self.openai_api_key
             
-            completion_params = {
-                "model": self.model_name,
-                "messages": messages,
-                "temperature": self.temperature,
-                # 不设置max_tokens，避免truncate错误
-                # "max_tokens": self.max_tokens,
-            }
+        response = completion(**completion_params)
+        
+        llm_result_text = response.choices[0].message.content if response.choices else ""
+        
+        response_obj = LlmResponse(
+            content=llm_result_text,
+            model=self.model_name,
+            timestamp=datetime.now(),
+            tokens_used=response.usage.total_tokens if hasattr(response, 'usage') else None
+        )
+        
+        if not self._validate_response(response_obj):
+            return ""
             
-            if self.openai_base_url:
-                completion_params["api_base"] = self.openai_base_url
-                
-            response = completion(**completion_params)
-            
-            llm_result_text = response.choices[0].message.content if response.choices else ""
-            
-            response_obj = LlmResponse(
-                content=llm_result_text,
-                model=self.model_name,
-                timestamp=datetime.now(),
-                tokens_used=response.usage.total_tokens if hasattr(response, 'usage') else None
-            )
-            
-            if not self._validate_response(response_obj):
-                return ""
-                
-            return response_obj.content
-            
-        except Exception as e:
-            response_obj = self._handle_error(e)
-            return response_obj.content
-
-    async def chatStream(self,
-                         prompt: str,
-                         role_name: str,
-                         you_name: str,
-                         query: str,
-                         history: list[str, str],
-                         realtime_callback=None,
-                         conversation_end_callback=None):
-        try:
-            await self._rate_limit()
-            
-            messages = []
-            messages.append({'role': 'system', 'content': prompt})
-            for item in history:
-                message = {"role": "user", "content": item["human"]}
-                messages.append(message)
-                message = {"role": "assistant", "content": item["ai"]}
-                messages.append(message)
-            messages.append({'role': 'user', 'content': you_name + "说" + query})
-
-            # 准备参数，移除可能导致truncate错误的参数
-            completion_params = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": True,
-                "temperature": self.temperature,
-                # 不设置max_tokens，避免truncate错误
-                # "max_tokens": self.max_tokens,
-            }
-            
-            if self.openai_base_url:
-                completion_params["api_base"] = self.openai_base_url
+        return response_obj.content
 
-            # 添加设置，禁用truncate检查
-            # 避免LiteLLM中的truncate错误
-            import litellm
-            litellm.set_max_tokens = False
+    async def stream(self, prompt: str, role_name: str, you_name: str, query: str,
+                     history: list[dict[str, str]]) -> AsyncIterator[str]:
+        messages = self._stream_messages(prompt, you_name, query, history)
 
-            response = completion(**completion_params)
+        # 准备参数，移除可能导致truncate错误的参数
+        completion_params = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": True,
+            "temperature": self.temperature,
+            # 不设置max_tokens，避免truncate错误
+            # "max_tokens": self.max_tokens,
+        }
 
-            answer = ''
-            for event in response:
-                if not isinstance(event, dict):
-                    event = event.model_dump()
-                if isinstance(event.get('choices', []), List) and len(event['choices']) > 0:
-                    delta = event["choices"][0].get('delta', {})
-                    event_text = delta.get('content', '')
-                    if isinstance(event_text, str) and event_text != "":
-                        content = remove_spaces_and_tabs(event_text)
-                        if content == "":
-                            continue
-                        answer += content
-                        if realtime_callback:
-                            realtime_callback(role_name, you_name, content, False)
+        if self.openai_base_url:
+            completion_params["api_base"] = self.openai_base_url
+        completion_params["api_key"] = self.openai_api_key
 
-            answer = format_chat_text(role_name, you_name, answer)
-            if conversation_end_callback:
-                realtime_callback(role_name, you_name, "", True)
-                conversation_end_callback(role_name, answer, you_name, query)
-                
-        except Exception as e:
-            logger.error(f"OpenAI Stream chat error: {str(e)}")
-            if realtime_callback:
-                realtime_callback(role_name, you_name, "抱歉，发生了错误，请稍后重试。", True)
-            if conversation_end_callback:
-                conversation_end_callback(role_name, "抱歉，发生了错误，请稍后重试。", you_name, query)
+        # 异步流式调用，等待网络时不占用线程
+        response = await acompletion(**completion_params)
+        async for event in response:
+            content = self._delta_content(event)
+            if content:
+                yield content
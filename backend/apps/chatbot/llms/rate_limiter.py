@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认限流参数，可通过环境变量按模型类型覆盖，例如OPENAI_REQUESTS_PER_SECOND、OLLAMA_MAX_CONCURRENT
+# 每秒请求数，令牌桶容量同为该值（最多允许1秒的突发）
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+# 同时进行的请求数（含流式对话）
+DEFAULT_MAX_CONCURRENT = 10
+# 每分钟token数，0表示不限制
+DEFAULT_TOKENS_PER_MINUTE = 0
+# 排队等待的最长秒数，超过后放弃请求
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("LLM_RATE_LIMIT_MAX_WAIT", 30))
+
+
+class RateLimitTimeoutError(RuntimeError):
+    """排队等待超过最长等待时间"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数：中日韩字符按1个token，其他字符按4个字符1个token"""
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if "⺀" <= char <= "鿿" or "豈" <= char <= "￯")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class _Waiter:
+    """排队中的一个请求，同步调用方等待线程事件，异步调用方等待所在事件循环的future"""
+
+    def __init__(self, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.tokens = tokens
+        self.loop = loop
+        self.event = threading.Event()
+        self.future: Optional[asyncio.Future] = None
+
+    def reset(self) -> None:
+        if self.loop is None:
+            self.event.clear()
+        else:
+            self.future = self.loop.create_future()
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        elif self.future is not None:
+            self.loop.call_soon_threadsafe(self._set, self.future)
+
+    @staticmethod
+    def _set(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+
+class RateLimitSlot:
+    """
+    一次请求占用的限流名额，作为上下文管理器使用，退出时释放并发名额
+    请求前按提示词估计的token已扣除，回答的token通过add_tokens在结束时补扣
+    """
+
+    def __init__(self, limiter: "TokenBucketLimiter", wait_time: float) -> None:
+        self.limiter = limiter
+        self.wait_time = wait_time
+        self.extra_tokens = 0
+        self._released = False
+
+    def add_tokens(self, tokens: int) -> None:
+        self.extra_tokens += tokens
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.limiter.release(self.extra_tokens)
+
+    def __enter__(self) -> "RateLimitSlot":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.release()
+        return False
+
+
+class TokenBucketLimiter:
+    """
+    进程内共享的令牌桶限流器，按模型类型和模型名称各一个
+    同时限制每秒请求数、并发请求数和每分钟token数，超出时按先来先到的顺序排队而不是直接请求后收到429；
+    状态由线程锁保护，同步线程和任意事件循环中的协程都可以使用，并记录排队等待时间
+    """
+
+    def __init__(self, name: str, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+                 max_concurrent: int = DEFAULT_MAX_CONCURRENT, tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+                 max_wait: float = RATE_LIMIT_MAX_WAIT) -> None:
+        self.name = name
+        self.requests_per_second = float(requests_per_second)
+        self.max_concurrent = int(max_concurrent)
+        self.tokens_per_minute = int(tokens_per_minute)
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._queue: Deque[_Waiter] = deque()
+        self._request_bucket = max(1.0, self.requests_per_second)
+        self._token_bucket = float(self.tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+
+        self._acquired = 0
+        self._throttled = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_second > 0:
+            self._request_bucket = min(max(1.0, self.requests_per_second),
+                                       self._request_bucket + elapsed * self.requests_per_second)
+        if self.tokens_per_minute > 0:
+            self._token_bucket = min(float(self.tokens_per_minute),
+                                     self._token_bucket + elapsed * self.tokens_per_minute / 60)
+
+    def _try_acquire(self, waiter: _Waiter) -> Optional[float]:
+        """
+        尝试为队首的请求取得名额，调用方需持有锁
+        :return: None表示已取得；否则为预计需要等待的秒数，inf表示等待被唤醒（不在队首或并发已满）
+        """
+        if self._queue[0] is not waiter:
+            return math.inf
+        if self.max_concurrent > 0 and self._in_flight >= self.max_concurrent:
+            return math.inf
+        self._refill(time.monotonic())
+        delay = 0.0
+        if self.requests_per_second > 0 and self._request_bucket < 1:
+            delay = (1 - self._request_bucket) / self.requests_per_second
+        if self.tokens_per_minute > 0:
+            # 单个请求超过桶容量时按桶容量计，避免永远无法满足
+            tokens = min(waiter.tokens, self.tokens_per_minute)
+            if self._token_bucket < tokens:
+                delay = max(delay, (tokens - self._token_bucket) * 60 / self.tokens_per_minute)
+        if delay > 0:
+            return delay
+
+        if self.requests_per_second > 0:
+            self._request_bucket -= 1
+        if self.tokens_per_minute > 0:
+            self._token_bucket -= min(waiter.tokens, self.tokens_per_minute)
+        self._in_flight += 1
+        self._queue.popleft()
+        if self._queue:
+            self._queue[0].wake()
+        return None
+
+    def _leave(self, waiter: _Waiter) -> None:
+        """等待超时或被取消时离开队列，调用方需持有锁"""
+        was_head = self._queue and self._queue[0] is waiter
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            return
+        if was_head and self._queue:
+            self._queue[0].wake()
+
+    def _granted(self, started: float) -> RateLimitSlot:
+        wait_time = time.monotonic() - started
+        with self._lock:
+            self._acquired += 1
+            if wait_time > 0.001:
+                self._throttled += 1
+            self._total_wait += wait_time
+            self._max_wait_seen = max(self._max_wait_seen, wait_time)
+        return RateLimitSlot(self, wait_time)
+
+    def acquire(self, tokens: int = 0, timeout: Optional[float] = None) -> RateLimitSlot:
+        """
+        同步取得名额，必要时阻塞排队
+        :param tokens: 请求前估计的token数（提示词），不限制token时忽略
+        :param timeout: 最长等待秒数，None表示使用max_wait，超时抛出RateLimitTimeoutError
+        """
+        started = time.monotonic()
+        deadline = started + (self.max_wait if timeout is None else timeout)
+        waiter = _Waiter(tokens)
+        with self._lock:
+            self._queue.append(waiter)
+        while True:
+            with self._lock:
+                delay = self._try_acquire(waiter)
+                if delay is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._leave(waiter)
+                    self._timeouts += 1
+                    raise RateLimitTimeoutError(f"{self.name}限流排队超过{deadline - started:.1f}s")
+                waiter.reset()
+            waiter.event.wait(min(delay, remaining))
+        return self._granted(started)
+
+    async def aacquire(self, tokens: int = 0, timeout: Optional[float] = None) -> RateLimitSlot:
+        """异步取得名额，排队时只挂起当前协程，不阻塞事件循环，参数同acquire"""
+        started = time.monotonic()
+        deadline = started + (self.max_wait if timeout is None else timeout)
+        waiter = _Waiter(tokens, asyncio.get_running_loop())
+        with self._lock:
+            self._queue.append(waiter)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._try_acquire(waiter)
+                    if delay is None:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._leave(waiter)
+                        self._timeouts += 1
+                        raise RateLimitTimeoutError(f"{self.name}限流排队超过{deadline - started:.1f}s")
+                    waiter.reset()
+                    future = waiter.future
+                await asyncio.wait({future}, timeout=min(delay, remaining))
+        except asyncio.CancelledError:
+            with self._lock:
+                self._leave(waiter)
+            raise
+        return self._granted(started)
+
+    def release(self, extra_tokens: int = 0) -> None:
+        """释放并发名额，补扣回答使用的token（允许透支，透支部分由后续请求等待偿还）"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if self.tokens_per_minute > 0 and extra_tokens:
+                self._refill(time.monotonic())
+                self._token_bucket = max(-float(self.tokens_per_minute), self._token_bucket - extra_tokens)
+            if self._queue:
+                self._queue[0].wake()
+
+    def stats(self) -> dict:
+        """排队数、进行中请求数、排队次数和排队等待时间"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "name": self.name,
+                "requests_per_second": self.requests_per_second,
+                "max_concurrent": self.max_concurrent,
+                "tokens_per_minute": self.tokens_per_minute,
+                "waiting": len(self._queue),
+                "in_flight": self._in_flight,
+                "acquired": self._acquired,
+                "throttled": self._throttled,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": self._total_wait / self._acquired * 1000 if self._acquired else 0.0,
+                "max_wait_ms": self._max_wait_seen * 1000,
+                "available_tokens": self._token_bucket if self.tokens_per_minute > 0 else None
+            }
+
+
+_limiters: Dict[Tuple[str, str], TokenBucketLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_limit(model_type: str, key: str, default):
+    value = os.environ.get(f"{model_type.upper()}_{key}")
+    return type(default)(value) if value else default
+
+
+def get_rate_limiter(model_type: str, model_name: Optional[str] = None) -> TokenBucketLimiter:
+    """
+    获取模型类型和名称对应的进程内共享限流器，负载均衡器按端点名称（服务地址/模型）获取，每个端点一个
+    限流参数读取环境变量{MODEL_TYPE}_REQUESTS_PER_SECOND、{MODEL_TYPE}_MAX_CONCURRENT、{MODEL_TYPE}_TOKENS_PER_MINUTE
+    """
+    key = (model_type, model_name or model_type)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = TokenBucketLimiter(
+                    name=f"{model_type}/{key[1]}",
+                    requests_per_second=_env_limit(model_type, "REQUESTS_PER_SECOND", DEFAULT_REQUESTS_PER_SECOND),
+                    max_concurrent=_env_limit(model_type, "MAX_CONCURRENT", DEFAULT_MAX_CONCURRENT),
+                    tokens_per_minute=_env_limit(model_type, "TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)
+                )
+                _limiters[key] = limiter
+    return limiter
+
+
+def get_all_rate_limiters() -> Dict[str, TokenBucketLimiter]:
+    with _limiters_lock:
+        return {limiter.name: limiter for limiter in _limiters.values()}
@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from ..utils.cache_utils import LruTtlCache
+
+logger = logging.getLogger(__name__)
+
+# 内存缓存的最大条目数，0表示不缓存
+RESPONSE_CACHE_SIZE = int(os.environ.get("LLM_RESPONSE_CACHE_SIZE", 2048))
+# 磁盘缓存的SQLite文件路径，为空表示只使用内存缓存
+RESPONSE_CACHE_PATH = os.environ.get("LLM_RESPONSE_CACHE_PATH", "")
+# 磁盘缓存的最大条目数，超出时删除最早写入的条目
+RESPONSE_CACHE_DISK_SIZE = int(os.environ.get("LLM_RESPONSE_CACHE_DISK_SIZE", 100000))
+# 磁盘缓存每写入多少条清理一次过期和超出容量的条目（不超过容量的十分之一）
+DISK_PURGE_EVERY = 1000
+# 各调用点的缓存过期时间（秒），结果只由输入决定的调用缓存较久，话题建议等需要变化的调用缓存较短
+RESPONSE_CACHE_TTLS = {
+    "intent": 3600,
+    "portrait_observation": 3600,
+    "importance_rating": 86400,
+    "memory_summary": 86400,
+    "portrait_analysis": 600,
+    "topic": 300,
+}
+DEFAULT_RESPONSE_CACHE_TTL = 600
+# 等待相同请求结果的最长秒数，超时后自行请求
+INFLIGHT_WAIT = 60
+
+
+def response_cache_key(model: str, temperature, prompt: str, query: str) -> str:
+    """缓存键：模型、温度和完整提示词的哈希"""
+    content = "\x00".join([model, str(temperature), prompt, query])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class DiskResponseCache:
+    """
+    磁盘缓存，使用SQLite保存，进程重启后仍然有效
+    过期时间按系统时间记录，读取时忽略已过期的条目；打开时和每写入一定条数后删除过期条目，
+    并在超出max_size时删除最早写入的条目
+    """
+
+    def __init__(self, path: str, max_size: int = RESPONSE_CACHE_DISK_SIZE) -> None:
+        self.path = path
+        self.max_size = max(1, int(max_size))
+        self.purge_every = max(1, min(DISK_PURGE_EVERY, self.max_size // 10))
+        self._puts = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                key TEXT PRIMARY KEY,
+                site TEXT,
+                value TEXT,
+                expire_at REAL,
+                created_at REAL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_expire ON llm_response_cache (expire_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_created "
+                           "ON llm_response_cache (created_at)")
+        self.purge_expired()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expire_at FROM llm_response_cache WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def put(self, key: str, site: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_response_cache (key, site, value, expire_at, created_at) "
+                               "VALUES (?, ?, ?, ?, ?)", (key, site, value, now + ttl, now))
+            self._puts += 1
+            purge = self._puts >= self.purge_every
+            if purge:
+                self._puts = 0
+        if purge:
+            try:
+                self.purge_expired()
+            except sqlite3.Error as e:
+                logger.warning(f"清理LLM回答磁盘缓存失败: {str(e)}")
+
+    def purge_expired(self) -> int:
+        """删除过期条目，超过容量时删除最早写入的条目，返回删除条数"""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM llm_response_cache WHERE expire_at < ?",
+                                         (time.time(),)).rowcount
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+            if count > self.max_size:
+                deleted += self._conn.execute(
+                    "DELETE FROM llm_response_cache WHERE key IN "
+                    "(SELECT key FROM llm_response_cache ORDER BY created_at, rowid LIMIT ?)",
+                    (count - self.max_size,)).rowcount
+            return deleted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_response_cache")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class LlmResponseCache:
+    """
+    辅助LLM调用（意图解析、实体识别、重要性评分、摘要等）的回答缓存
+    内存LRU缓存在前，可选的磁盘缓存在后，磁盘命中时回填内存；各调用点使用各自的过期时间，
+    相同的请求同时未命中时只请求一次，其余调用等待结果；按调用点统计命中率
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, path: Optional[str] = RESPONSE_CACHE_PATH,
+                 ttls: Optional[Dict[str, float]] = None, disk_max_size: int = RESPONSE_CACHE_DISK_SIZE) -> None:
+        """
+        :param path: 磁盘缓存的SQLite文件路径，为空表示只使用内存缓存
+        :param disk_max_size: 磁盘缓存的最大条目数
+        :param ttls: 覆盖各调用点的过期时间
+        """
+        self.ttls = dict(RESPONSE_CACHE_TTLS, **(ttls or {}))
+        self.memory = LruTtlCache(max_size=max_size) if max_size > 0 else None
+        self.disk: Optional[DiskResponseCache] = None
+        if path:
+            try:
+                self.disk = DiskResponseCache(path, max_size=disk_max_size)
+            except Exception as e:
+                logger.error(f"打开LLM回答磁盘缓存{path}失败，只使用内存缓存: {str(e)}")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory is not None or self.disk is not None
+
+    def _record(self, site: str, event: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(site, {"memory_hits": 0, "disk_hits": 0, "shared": 0, "misses": 0})
+            stats[event] += 1
+
+    def get(self, site: str, key: str) -> Optional[str]:
+        """依次查找内存缓存和磁盘缓存，未命中返回None"""
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                self._record(site, "memory_hits")
+                return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except Exception as e:
+                logger.error(f"读取LLM回答磁盘缓存失败: {str(e)}")
+                value = None
+            if value is not None:
+                if self.memory is not None:
+                    self.memory.put(key, value, ttl=self.ttls.get(site, DEFAULT_RESPONSE_CACHE_TTL))
+                self._record(site, "disk_hits")
+                return value
+        return None
+
+    def put(self, site: str, key: str, value: str) -> None:
+        ttl = self.ttls.get(site, DEFAULT_RESPONSE_CACHE_TTL)
+        if self.memory is not None:
+            self.memory.put(key, value, ttl=ttl)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, site, value, ttl)
+            except Exception as e:
+                logger.error(f"写入LLM回答磁盘缓存失败: {str(e)}")
+
+    def get_or_call(self, site: str, key: str, call: Callable[[], Optional[str]]) -> Optional[str]:
+        """
+        命中时直接返回缓存的回答，未命中时调用call并缓存结果
+        call返回None表示请求失败，失败和空回答都不缓存
+        """
+        value = self.get(site, key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            # 相同的请求正在进行，等待其结果
+            try:
+                value = future.result(timeout=INFLIGHT_WAIT)
+            except Exception:
+                value = None
+            if value is not None:
+                self._record(site, "shared")
+                return value
+            self._record(site, "misses")
+            return call()
+
+        self._record(site, "misses")
+        value = None
+        try:
+            value = call()
+            if value:
+                self.put(site, key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result(value)
+
+    def clear(self) -> None:
+        if self.memory is not None:
+            self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, dict]:
+        """各调用点的内存命中、磁盘命中、等待相同请求、未命中次数和命中率"""
+        with self._lock:
+            sites = {}
+            for site, stats in self._stats.items():
+                hits = stats["memory_hits"] + stats["disk_hits"] + stats["shared"]
+                total = hits + stats["misses"]
+                sites[site] = dict(stats, hit_rate=hits / total if total else 0.0,
+                                   ttl=self.ttls.get(site, DEFAULT_RESPONSE_CACHE_TTL))
+        return {
+            "sites": sites,
+            "memory": self.memory.stats() if self.memory is not None else None,
+            "disk": self.disk.path if self.disk is not None else None
+        }
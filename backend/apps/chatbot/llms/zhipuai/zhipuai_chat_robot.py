@@ -1,86 +1,78 @@
 import logging
 import os
+from functools import lru_cache
+from typing import AsyncIterator, Optional
 
 from zhipuai import ZhipuAI
 
-from ...utils.chat_message_utils import format_chat_text
 from ...utils.str_utils import remove_spaces_and_tabs
 from ...memory.chat_history import ChatHistroy
+from ..base import BaseLlmGeneration, load_provider_env
+from ..event_loop import iterate_blocking
+from ...utils.http_utils import get_http_client
 
 logger = logging.getLogger(__name__)
 
 
-class ZhipuAIGeneration:
+@lru_cache(maxsize=None)
+def get_zhipuai_client(api_key: str, base_url: Optional[str] = None) -> ZhipuAI:
+    """同一API密钥和服务地址的模型实例共享一个客户端，复用共享的连接池"""
+    return ZhipuAI(api_key=api_key, base_url=base_url, http_client=get_http_client())
+
+
+class ZhipuAIGeneration(BaseLlmGeneration):
     model_name: str = "glm-4"
     temperature: float = 0.7
     zhipuai_api_key: str
 
-    def __init__(self) -> None:
-        from dotenv import load_dotenv
-        load_dotenv()
-        self.zhipuai_api_key = os.environ['ZHIPUAI_API_KEY']
-        self.client = ZhipuAI(api_key=self.zhipuai_api_key)
+    def __init__(self, base_url: Optional[str] = None, model_name: Optional[str] = None,
+                 api_key_env: Optional[str] = None) -> None:
+        """
+        :param base_url: 服务地址，None表示使用SDK默认地址
+        :param model_name: 模型名称，None表示使用默认模型
+        :param api_key_env: 保存API密钥的环境变量名，None表示ZHIPUAI_API_KEY
+        """
+        super().__init__()
+        load_provider_env()
+        self.zhipuai_api_key = os.environ[api_key_env or 'ZHIPUAI_API_KEY']
+        self.client = get_zhipuai_client(self.zhipuai_api_key, base_url)
+        if model_name:
+            self.model_name = model_name
         self.max_tokens = 2048  # 设置默认最大token数
 
-    def chat(self, prompt: str, role_name: str, you_name: str, query: str, short_history: list[ChatHistroy],
-             long_history: str) -> str:
-        try:
-            prompt = prompt + query
-            messages = [{"role": "user", "content": prompt}]
-            
-            # 移除max_tokens参数，防止导致truncate错误
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                stream=False,
-                temperature=self.temperature,
-                # 不设置max_tokens，避免truncate错误
-                # max_tokens=self.max_tokens
-            )
-
-            llm_result_text = response.choices[0].message.content
-            return llm_result_text
-        except Exception as e:
-            logger.error(f"ZhipuAI chat error: {str(e)}")
-            return "抱歉，发生了错误，请稍后重试。"
-
-    async def chatStream(self, prompt: str, role_name: str, you_name: str, query: str, history: list[dict[str, str]],
-                         realtime_callback=None, conversation_end_callback=None):
-
-        messages = [{'role': 'system', 'content': prompt}]
-        for item in history:
-            messages.append({'role': 'user', 'content': item["human"]})
-            messages.append({'role': 'assistant', 'content': item["ai"]})
-        messages.append({'role': 'user', 'content': you_name + "说" + query})
+    def complete(self, prompt: str, role_name: str, you_name: str, query: str, short_history: list[ChatHistroy],
+                 long_history: str) -> str:
+        prompt = prompt + query
+        messages = [{"role": "user", "content": prompt}]
+        
+        # 移除max_tokens参数，防止导致truncate错误
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=False,
+            temperature=self.temperature,
+            # 不设置max_tokens，避免truncate错误
+            # max_tokens=self.max_tokens
+        )
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                stream=True,
-                temperature=self.temperature,
-            )
+        llm_result_text = response.choices[0].message.content
+        return llm_result_text
 
-            answer = ''
-            for chunk in response:
-                print(f">>>> chunk {chunk}")
-                if len(chunk.choices) > 0:
-                    event_text = chunk.choices[0].delta.content
-                    print(f">>>> event_text {event_text}")
-                    if isinstance(event_text, str) and event_text != "":
-                        content = remove_spaces_and_tabs(event_text)
-                        if content == "":
-                            continue
-                        answer += content
-                        if realtime_callback:
-                            realtime_callback(role_name, you_name, content, False)
+    async def stream(self, prompt: str, role_name: str, you_name: str, query: str,
+                     history: list[dict[str, str]]) -> AsyncIterator[str]:
+        messages = self._stream_messages(prompt, you_name, query, history)
 
-            answer = format_chat_text(role_name, you_name, answer)
-            if conversation_end_callback:
-                conversation_end_callback(role_name, answer, you_name, query)
-        except Exception as e:
-            logger.error(f"ZhipuAI Stream chat error: {str(e)}")
-            if realtime_callback:
-                realtime_callback(role_name, you_name, "抱歉，发生了错误，请稍后重试。", True)
-            if conversation_end_callback:
-                conversation_end_callback(role_name, "抱歉，发生了错误，请稍后重试。", you_name, query)
+        # 智谱SDK只提供阻塞接口，在驱动事件循环的有界线程池中迭代，不阻塞事件循环
+        chunks = iterate_blocking(lambda: self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=True,
+            temperature=self.temperature,
+        ))
+        async for chunk in chunks:
+            if len(chunk.choices) > 0:
+                event_text = chunk.choices[0].delta.content
+                if isinstance(event_text, str) and event_text != "":
+                    content = remove_spaces_and_tabs(event_text)
+                    if content:
+                        yield content
@@ -0,0 +1,55 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...config import get_sys_config
+from ...memory.local.local_storage_impl import LocalStorage
+from ...memory.snapshot import VECTOR_DTYPES, export_snapshot, import_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "导出或导入记忆快照（长期记忆FAISS索引与元数据、短期记忆表）"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        export_parser = subparsers.add_parser("export", help="导出时间点一致的记忆快照")
+        export_parser.add_argument("path", help="快照目录")
+        export_parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default="float32",
+                                   help="向量存储类型，float16体积减半")
+        export_parser.add_argument("--no-short-memory", action="store_true", help="不导出短期记忆")
+
+        import_parser = subparsers.add_parser("import", help="从快照导入记忆")
+        import_parser.add_argument("path", help="快照目录")
+        import_parser.add_argument("--replace", action="store_true", help="导入前清空现有记忆")
+        import_parser.add_argument("--no-short-memory", action="store_true", help="不导入短期记忆")
+
+    def handle(self, *args, **options):
+        driver = get_sys_config().memory_storage_driver
+        if driver is None:
+            raise CommandError("记忆模块未初始化，请检查memoryStorageConfig配置")
+        faiss_storage = getattr(driver, "long_memory_storage", None)
+        local_storage = getattr(driver, "short_memory_storage", None)
+        if options["no_short_memory"] or not isinstance(local_storage, LocalStorage):
+            local_storage = None
+        if faiss_storage is None and local_storage is None:
+            raise CommandError("没有可用的记忆存储")
+
+        try:
+            if options["action"] == "export":
+                manifest = export_snapshot(options["path"], faiss_storage=faiss_storage,
+                                           local_storage=local_storage, vector_dtype=options["vector_dtype"])
+                long_rows = manifest.get("long_memory", {}).get("rows", 0)
+                short_rows = manifest.get("short_memory", {}).get("rows", 0)
+                self.stdout.write(self.style.SUCCESS(
+                    f"快照已导出到 {options['path']}：长期记忆 {long_rows} 条，短期记忆 {short_rows} 条"))
+            else:
+                imported = import_snapshot(options["path"], faiss_storage=faiss_storage,
+                                           local_storage=local_storage, replace=options["replace"])
+                self.stdout.write(self.style.SUCCESS(
+                    f"快照已导入：长期记忆 {imported.get('long_memory', 0)} 条，"
+                    f"短期记忆 {imported.get('short_memory', 0)} 条"))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"记忆快照操作失败: {str(e)}")
@@ -21,6 +21,11 @@ class BaseStorage(ABC):
         '''保存记忆'''
         pass
 
+    @abstractmethod
+    def save_many(self, memories: List[dict]) -> int:
+        '''批量保存记忆,返回保存成功的条数'''
+        pass
+
     @abstractmethod
     def clear(self, owner: str) -> bool:
         '''清空记忆'''
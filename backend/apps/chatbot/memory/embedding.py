@@ -1,54 +1,125 @@
 import numpy as np
 import hashlib
 import logging
+from typing import List, Optional
+
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+# 每个哈希摘要（SHA-256）的字节数，即每个文本块最多填充的维度数
+DIGEST_SIZE = 32
+
+
 class Embedding:
     """简单的文本嵌入类，使用哈希函数生成伪向量，无需外部模型"""
 
-    def __init__(self):
+    # 嵌入算法标识，算法变化时需要更新以隔离旧的向量缓存
+    model_id = "sha256-hash-768-v1"
+
+    def __init__(self, cache_dir: Optional[str] = None, cache_memory_size: int = 10000,
+                 cache_disk_size: int = 100000):
+        """
+        :param cache_dir: 向量磁盘缓存目录，为None时只使用进程内缓存
+        """
         self.dimension = 768  # 保持与原始模型相同的维度
+        self.cache = EmbeddingCache(cache_dir, self.model_id, self.dimension,
+                                    memory_size=cache_memory_size, disk_size=cache_disk_size)
         logger.info("初始化简单嵌入模型（无需下载外部模型）")
-        
+
     def get_embedding_from_language_model(self, text: str):
         """
-        使用哈希函数将文本转换为固定维度的向量
+        使用哈希函数将文本转换为固定维度的向量，优先读取向量缓存
         这是一个简单的替代方案，不需要下载外部模型
         注意：这不是真正的语义向量，仅用于避免系统崩溃
         """
+        if not text:
+            return np.zeros(self.dimension, dtype=np.float32)
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached
+        vector = self._compute_embedding(text)
+        if vector.any():
+            self.cache.put(text, vector)
+        return vector
+
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        批量生成文本向量，命中缓存的文本不再重复计算
+        返回形状为(n, dimension)的float32矩阵，每一行与get_embedding_from_language_model的结果完全一致
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self.cache.get_or_compute(texts, self._compute_embeddings)
+
+    def cache_stats(self) -> dict:
+        """获取向量缓存统计信息"""
+        return self.cache.stats()
+
+    def flush_cache(self) -> None:
+        """将向量缓存同步到磁盘"""
+        self.cache.flush()
+
+    def _compute_embedding(self, text: str) -> np.ndarray:
+        """计算单条文本的哈希向量"""
         try:
-            if not text:
-                return np.zeros(self.dimension, dtype=np.float32)
-                
-            # 将文本转换为UTF-8字节
-            text_bytes = text.encode('utf-8')
-            
-            # 使用哈希函数生成伪随机向量
             vector = np.zeros(self.dimension, dtype=np.float32)
-            
-            # 将文本分成若干段，每段生成一个哈希值
-            chunk_size = max(1, len(text) // 100)  # 确保至少有一个块
-            chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-            
-            for i, chunk in enumerate(chunks):
-                # 使用不同的哈希种子处理每个块
-                h = hashlib.sha256((chunk + str(i)).encode('utf-8')).digest()
-                
-                # 将哈希值转换为浮点数并填充向量的一部分
-                for j in range(min(32, self.dimension // len(chunks))):
-                    if i * 32 + j < self.dimension:
-                        # 将字节值转换为-1到1之间的浮点数
-                        vector[i * 32 + j] = (h[j] / 128.0) - 1.0
-            
+            if not text:
+                return vector
+
+            self._fill_vector(vector, text)
+
             # 规范化向量
             norm = np.linalg.norm(vector)
             if norm > 0:
                 vector = vector / norm
-                
+
             logger.debug(f"为文本生成了长度为{self.dimension}的伪向量")
             return vector
-            
+
         except Exception as e:
             logger.error(f"生成向量失败: {str(e)}")
             return np.zeros(self.dimension, dtype=np.float32)
+
+    def _compute_embeddings(self, texts: List[str]) -> np.ndarray:
+        """批量计算文本的哈希向量"""
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            if not text:
+                continue
+            try:
+                self._fill_vector(vectors[row], text)
+            except Exception as e:
+                logger.error(f"生成向量失败: {str(e)}")
+                vectors[row] = 0
+
+        # 逐行计算范数（与np.linalg.norm对一维向量的计算方式相同，保证结果逐位一致），再整体规范化
+        norms = np.array([np.sqrt(vector.dot(vector)) for vector in vectors], dtype=np.float32)
+        nonzero = norms > 0
+        vectors[nonzero] = vectors[nonzero] / norms[nonzero, None]
+        return vectors
+
+    def _fill_vector(self, vector: np.ndarray, text: str) -> None:
+        """
+        将文本的哈希值写入未规范化的向量
+        文本被分为若干段，第i段的SHA-256摘要前k个字节映射到[-1, 1)后写入vector[i*32:i*32+k]，
+        其中k = min(32, dimension // 段数)；只有前dimension // 32段会落入向量范围内，其余段无需计算哈希
+        """
+        chunk_size = max(1, len(text) // 100)  # 确保至少有一个块
+        num_chunks = (len(text) + chunk_size - 1) // chunk_size
+        width = min(DIGEST_SIZE, self.dimension // num_chunks)
+        if width <= 0:
+            return
+        used_chunks = min(num_chunks, (self.dimension + DIGEST_SIZE - 1) // DIGEST_SIZE)
+
+        # 使用不同的哈希种子处理每个块，拼接全部摘要后一次性转换
+        digests = b"".join(
+            hashlib.sha256((text[i * chunk_size:(i + 1) * chunk_size] + str(i)).encode('utf-8')).digest()
+            for i in range(used_chunks)
+        )
+        values = np.frombuffer(digests, dtype=np.uint8).reshape(used_chunks, DIGEST_SIZE)[:, :width]
+        positions = np.arange(used_chunks)[:, None] * DIGEST_SIZE + np.arange(width)[None, :]
+        in_range = positions < self.dimension
+
+        # 将字节值转换为-1到1之间的浮点数
+        vector[positions[in_range]] = values[in_range] / 128.0 - 1.0
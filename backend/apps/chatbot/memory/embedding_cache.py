@@ -0,0 +1,270 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from ..utils.cache_utils import LruTtlCache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# 文本哈希键长度（字节）
+KEY_SIZE = 16
+# 每行键之后存储向量的CRC32校验值（字节）
+CHECKSUM_SIZE = 4
+# 磁盘缓存文件格式版本，格式变化时旧文件重建
+DISK_FORMAT_VERSION = 2
+
+
+class EmbeddingCache:
+    """
+    两级文本向量缓存
+    - 一级：进程内LRU缓存
+    - 二级：磁盘缓存，使用内存映射的float32矩阵存储向量，哈希键→行号的索引常驻内存
+    缓存键由嵌入模型ID和文本哈希组成；磁盘缓存写满后按环形方式覆盖最早写入的行
+    每行键旁记录向量的校验值，读取时校验，崩溃后键已落盘而向量未落盘的行视为未命中；
+    磁盘缓存文件由一个进程独占，其他进程打开同一目录时只使用内存缓存
+    """
+
+    def __init__(self, cache_dir: Optional[str], model_id: str, dimension: Optional[int] = None,
+                 memory_size: int = 10000, disk_size: int = 100000, flush_interval: int = 100) -> None:
+        """
+        :param cache_dir: 磁盘缓存目录，为None时只使用内存缓存
+        :param model_id: 嵌入模型标识，不同模型的向量互不共享
+        :param dimension: 向量维度，为None时在第一次写入时确定
+        :param memory_size: 内存缓存条目上限
+        :param disk_size: 磁盘缓存条目上限
+        :param flush_interval: 每写入多少条向量同步一次磁盘
+        """
+        self.model_id = model_id
+        self.dimension = dimension
+        self.memory_cache = LruTtlCache(max_size=memory_size)
+        self.disk_size = disk_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._row_index: Dict[bytes, int] = {}
+        self._vectors = None
+        self._keys = None
+        self._lock_file = None
+        self._count = 0
+        self._pending = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+
+        self._base_path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            safe_name = re.sub(r'[^0-9A-Za-z_.-]', '_', model_id)[-80:]
+            self._base_path = os.path.join(cache_dir, safe_name)
+            try:
+                if self._acquire_file_lock():
+                    self._open_disk()
+                else:
+                    logger.warning(f"磁盘向量缓存已被其他进程使用，仅使用内存缓存: {self._base_path}")
+                    self._base_path = None
+            except Exception as e:
+                logger.warning(f"打开磁盘向量缓存失败，仅使用内存缓存: {str(e)}")
+                self._vectors = None
+                self._keys = None
+
+    def make_key(self, text: str) -> bytes:
+        """根据模型ID和文本内容生成缓存键"""
+        return hashlib.blake2b(f"{self.model_id}\0{text}".encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """获取文本向量，未命中返回None；返回的向量与缓存共用，为只读数组"""
+        key = self.make_key(text)
+        vector = self.memory_cache.get(key)
+        if vector is not None:
+            return vector
+        vector = self._disk_get(key)
+        if vector is not None:
+            vector.setflags(write=False)
+            self.memory_cache.put(key, vector)
+        return vector
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        """写入文本向量（复制一份只读数组，调用方之后修改原数组不影响缓存）"""
+        key = self.make_key(text)
+        vector = np.array(vector, dtype=np.float32).reshape(-1)
+        vector.setflags(write=False)
+        self.memory_cache.put(key, vector)
+        self._disk_put(key, vector)
+
+    def get_or_compute(self, texts: List[str], compute: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        批量获取文本向量，只对未命中的文本调用compute计算
+        :param compute: 输入文本列表，返回(n, dimension)向量矩阵的函数
+        :return: (len(texts), dimension)的float32矩阵
+        """
+        results: List[Optional[np.ndarray]] = [self.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            # 同一批次中重复的文本只计算一次
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = np.asarray(compute(unique_texts), dtype=np.float32).reshape(len(unique_texts), -1)
+            computed_map = {}
+            for text, vector in zip(unique_texts, computed):
+                vector = vector.copy()
+                computed_map[text] = vector
+                self.put(text, vector)
+            for i in missing:
+                results[i] = computed_map[texts[i]]
+        if not results:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return np.vstack(results)
+
+    def flush(self) -> None:
+        """将磁盘缓存同步到文件"""
+        with self._lock:
+            self._flush_locked()
+
+    def stats(self) -> Dict[str, object]:
+        """获取缓存统计信息"""
+        disk_total = self.disk_hits + self.disk_misses
+        return {
+            "model_id": self.model_id,
+            "memory": self.memory_cache.stats(),
+            "disk": {
+                "enabled": self._vectors is not None,
+                "size": len(self._row_index),
+                "max_size": self.disk_size,
+                "hits": self.disk_hits,
+                "misses": self.disk_misses,
+                "hit_rate": self.disk_hits / disk_total if disk_total else 0.0
+            }
+        }
+
+    def _acquire_file_lock(self) -> bool:
+        """以非阻塞方式独占磁盘缓存文件，多个进程各自维护行号索引，共享同一文件会互相覆盖"""
+        lock_file = open(self._base_path + ".lock", "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        # 锁随文件句柄持有到进程退出
+        self._lock_file = lock_file
+        return True
+
+    def _open_disk(self) -> None:
+        """打开（或创建）磁盘缓存文件"""
+        meta_path = self._base_path + ".meta.json"
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            # 维度或容量变化时旧文件无法复用，重新创建
+            if meta.get("format") != DISK_FORMAT_VERSION or meta.get("model_id") != self.model_id or \
+                    meta.get("disk_size") != self.disk_size or (self.dimension is not None and meta.get("dimension") != self.dimension):
+                logger.info(f"向量缓存参数已变化，重建磁盘缓存: {self._base_path}")
+                meta = {}
+            else:
+                self.dimension = meta["dimension"]
+
+        if self.dimension is None:
+            # 维度未知时延迟到第一次写入再创建文件
+            return
+
+        vectors_path = self._base_path + ".vectors"
+        keys_path = self._base_path + ".keys"
+        mode = "r+" if meta and os.path.exists(vectors_path) and os.path.exists(keys_path) else "w+"
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(self.disk_size, self.dimension))
+        # 每行为键 + 向量的CRC32
+        self._keys = np.memmap(keys_path, dtype=np.uint8, mode=mode, shape=(self.disk_size, KEY_SIZE + CHECKSUM_SIZE))
+        self._count = int(meta.get("count", 0)) if mode == "r+" else 0
+
+        # 全零键表示空行
+        if mode == "r+":
+            occupied = np.flatnonzero(self._keys[:, :KEY_SIZE].any(axis=1))
+            self._row_index = {self._keys[row, :KEY_SIZE].tobytes(): int(row) for row in occupied}
+        self._write_meta()
+        logger.info(f"磁盘向量缓存已加载: {self._base_path}, 条目数={len(self._row_index)}")
+
+    def _disk_get(self, key: bytes) -> Optional[np.ndarray]:
+        if self._vectors is None:
+            return None
+        with self._lock:
+            row = self._row_index.get(key)
+            if row is None:
+                self.disk_misses += 1
+                return None
+            vector = np.array(self._vectors[row])
+            if self._keys[row, KEY_SIZE:].tobytes() != _checksum(vector):
+                # 键已落盘而向量没有（写入中途崩溃），丢弃该行
+                logger.warning(f"磁盘向量缓存第{row}行校验失败，已丢弃")
+                del self._row_index[key]
+                self._keys[row] = 0
+                self.disk_misses += 1
+                return None
+            self.disk_hits += 1
+            return vector
+
+    def _disk_put(self, key: bytes, vector: np.ndarray) -> None:
+        if self._base_path is None:
+            return
+        with self._lock:
+            try:
+                if self._vectors is None:
+                    if self.dimension is not None:
+                        return
+                    self.dimension = vector.shape[0]
+                    self._open_disk()
+                if vector.shape[0] != self.dimension or key in self._row_index:
+                    return
+                # 环形覆盖：写满后替换最早写入的行
+                row = self._count % self.disk_size
+                old_key = self._keys[row, :KEY_SIZE].tobytes()
+                if any(old_key):
+                    self._row_index.pop(old_key, None)
+                # 先写向量再写键和校验值；内存映射页的落盘顺序不确定，读取时以校验值为准
+                self._vectors[row] = vector
+                self._keys[row] = np.frombuffer(key + _checksum(vector), dtype=np.uint8)
+                self._row_index[key] = row
+                self._count += 1
+                self._pending += 1
+                if self._pending >= self.flush_interval:
+                    self._flush_locked()
+            except Exception as e:
+                logger.warning(f"写入磁盘向量缓存失败: {str(e)}")
+
+    def _flush_locked(self) -> None:
+        if self._vectors is None or self._pending == 0:
+            return
+        # 先同步向量再同步键
+        self._vectors.flush()
+        self._keys.flush()
+        self._write_meta()
+        self._pending = 0
+
+    def _write_meta(self) -> None:
+        meta_path = self._base_path + ".meta.json"
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "format": DISK_FORMAT_VERSION,
+                "model_id": self.model_id,
+                "dimension": self.dimension,
+                "disk_size": self.disk_size,
+                "count": self._count
+            }, f)
+        os.replace(tmp_path, meta_path)
+
+
+def _checksum(vector: np.ndarray) -> bytes:
+    return zlib.crc32(np.ascontiguousarray(vector, dtype=np.float32).tobytes()).to_bytes(CHECKSUM_SIZE, "little")
@@ -0,0 +1,95 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每条记忆检索的近邻数量（不含自身）
+CONSOLIDATION_NEIGHBORS = 4
+# 后台线程每次最多处理的新记忆条数
+CONSOLIDATION_BATCH_SIZE = 1000
+
+
+def cosine_to_distance(threshold: float) -> float:
+    """余弦相似度阈值换算为单位向量间的L2距离平方阈值：||a-b||² = 2 - 2cos"""
+    return max(0.0, 2.0 - 2.0 * threshold)
+
+
+def plan_merges(ids: np.ndarray, distances: np.ndarray, labels: np.ndarray,
+                max_distance: float) -> Dict[int, List[int]]:
+    """
+    根据近邻检索结果规划合并：每条记忆合并进距离阈值内、ID比自己小（更早保存）且未被合并的最近邻
+    按ID升序处理，被合并的记忆不会再作为其他记忆的合并目标，不会出现循环合并
+    :param ids: 待检查的记忆ID，形状(n,)
+    :param distances: 近邻距离矩阵，形状(n, k)
+    :param labels: 近邻ID矩阵，形状(n, k)，-1表示无结果
+    :return: 保留的记忆ID → 合并进来的重复记忆ID列表
+    """
+    merges: Dict[int, List[int]] = defaultdict(list)
+    merged: Set[int] = set()
+    for row in np.argsort(ids, kind="stable"):
+        memory_id = int(ids[row])
+        if memory_id in merged:
+            continue
+        for distance, neighbor in zip(distances[row], labels[row]):
+            neighbor = int(neighbor)
+            if distance > max_distance:
+                break
+            if neighbor == -1 or neighbor >= memory_id or neighbor in merged:
+                continue
+            merges[neighbor].append(memory_id)
+            merged.add(memory_id)
+            break
+    return dict(merges)
+
+
+class MemoryConsolidator:
+    """
+    后台记忆整理线程
+    保存记忆后登记新记忆ID，定期（或积累到批量大小时）调用consolidate合并与已有记忆近似重复的新记忆
+    """
+
+    def __init__(self, consolidate: Callable[[List[int]], int], interval: float = 60.0,
+                 batch_size: int = CONSOLIDATION_BATCH_SIZE) -> None:
+        self.consolidate = consolidate
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: List[int] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="faiss-consolidator", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, ids: List[int]) -> None:
+        """登记新保存的记忆，积累到批量大小时唤醒后台线程"""
+        with self._lock:
+            self._pending.extend(ids)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            while True:
+                with self._lock:
+                    batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                if not batch:
+                    break
+                try:
+                    self.consolidate(batch)
+                except Exception as e:
+                    logger.error(f"后台记忆整理失败: {str(e)}")
+                    break
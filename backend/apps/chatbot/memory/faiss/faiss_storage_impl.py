@@ -2,55 +2,54 @@ import faiss
 import numpy as np
 import time
 import os
+import shutil
 import sqlite3
 import threading
 from ..base_storage import BaseStorage
-from ...utils.snowflake_utils import SnowFlake
+from ...utils.snowflake_utils import get_snow_flake
 from ...memory.embedding import Embedding
+from ...utils.cache_utils import LruTtlCache
+from ...utils.tokenizer_utils import get_tokenizer
+from .consolidation import CONSOLIDATION_BATCH_SIZE, CONSOLIDATION_NEIGHBORS, MemoryConsolidator, \
+    cosine_to_distance, plan_merges
+from .keyword_index import KeywordIndex, normalize_by_max, weighted_score_fusion
+from .metadata_store import ThreadSafeSQLite, count_memories, migrate_schema, owner_counts
+from .retention import MemoryRetention, RetentionPolicy
+from .scoring import ScoringWeights, top_k_indices
+from .persistence import FSYNC_GROUP, GROUP_COMMIT_INTERVAL, GROUP_COMMIT_RECORDS, OP_ADD, IndexCheckpointer, \
+    VectorLog, write_file_atomic
+from .index_store import INDEX_KIND_FLAT, IndexPolicy, MemoryIndex, MemoryScopes, extract_vectors, index_kind, \
+    prefetch_file
+import json
 import logging
-import jieba.analyse
 import traceback
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import datetime
 
 logger = logging.getLogger(__name__)
 
-class ThreadSafeSQLite:
-    """线程安全的SQLite连接管理器"""
-    
-    def __init__(self, db_path):
-        self.db_path = db_path
-        self._local = threading.local()
-        
-    def _get_conn(self):
-        if not hasattr(self._local, 'conn'):
-            self._local.conn = sqlite3.connect(self.db_path)
-            self._local.conn.row_factory = sqlite3.Row
-        return self._local.conn
-        
-    def _get_cursor(self):
-        if not hasattr(self._local, 'cursor'):
-            self._local.cursor = self._get_conn().cursor()
-        return self._local.cursor
-        
-    def execute(self, sql, params=None):
-        cursor = self._get_cursor()
-        if params:
-            cursor.execute(sql, params)
-        else:
-            cursor.execute(sql)
-        return cursor
-        
-    def commit(self):
-        self._get_conn().commit()
-        
-    def close(self):
-        if hasattr(self._local, 'cursor'):
-            self._local.cursor.close()
-            delattr(self._local, 'cursor')
-        if hasattr(self._local, 'conn'):
-            self._local.conn.close()
-            delattr(self._local, 'conn')
+# SQLite单条语句允许的最大参数个数（旧版本默认999）
+SQLITE_MAX_VARIABLES = 900
+
+# 每条长期记忆保存的关键词数量
+KEYWORDS_PER_MEMORY = 5
+
+# 向量检索与关键词检索两路分数融合时的默认通道权重；哈希嵌入的向量相似度区分度低，权重低于BM25
+VECTOR_SEARCH_WEIGHT = 0.3
+KEYWORD_SEARCH_WEIGHT = 0.7
+
+# 快照中元数据表的列，向量矩阵按同样的行顺序存储
+SNAPSHOT_COLUMNS = ("id", "text", "sender", "owner", "timestamp", "importance_score", "keywords",
+                    "occurrences", "access_count", "last_access")
+
+# 整理合并或容量淘汰累计删除的记录数达到该值时重写索引文件并VACUUM元数据库
+RECLAIM_THRESHOLD = 1000
+
+def _to_bool(value) -> bool:
+    """配置项可能以字符串形式传入"""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
 
 class FAISSStorage(BaseStorage):
     """FAISS向量存储记忆模块，替代Milvus实现"""
@@ -59,97 +58,714 @@ class FAISSStorage(BaseStorage):
         # 配置参数
         data_dir = memory_storage_config.get("data_dir", "storage/memory")
         self.index_path = os.path.join(data_dir, "memory.index")
+        self.index_meta_path = self.index_path + ".json"
         self.metadata_db = os.path.join(data_dir, "memory_metadata.db")
         self.dimension = 768  # 与现有embedding维度匹配
         
         # 创建存储目录
         os.makedirs(data_dir, exist_ok=True)
         
-        # 初始化向量嵌入模型
+        # 初始化向量嵌入模型：哈希向量重新计算比读磁盘缓存更快，只使用进程内缓存
         try:
-            self.embedding = Embedding()
+            self.embedding = Embedding(
+                cache_memory_size=int(memory_storage_config.get("embedding_cache_memory_size", 10000))
+            )
             logger.info("成功初始化嵌入模型")
         except Exception as emb_err:
             logger.error(f"初始化嵌入模型失败: {str(emb_err)}")
             raise  # 重新抛出异常，因为没有嵌入模型就无法继续
         
-        # 初始化FAISS索引
+        # 初始化线程安全的SQLite连接，并将表结构升级到最新版本
+        self.db = ThreadSafeSQLite(self.metadata_db)
+        schema_version = migrate_schema(self.db)
+        logger.info(f"SQLite元数据存储初始化完成: {self.metadata_db}，结构版本: {schema_version}")
+
+        # 向量ID即元数据主键id，由雪花算法统一生成；索引读写共用一把锁
+        # 多个进程共用同一数据目录时，机器编号不同才能保证记忆ID不重复
+        self.id_generator = get_snow_flake(data_center_id=6,
+                                           worker_id=int(memory_storage_config.get("id_worker_id", -1)))
+        self.index_lock = threading.RLock()
+        self.checkpoint_lock = threading.Lock()
+
+        # 追加写的向量日志，save只追加日志，由后台检查点合并进索引文件
+        self.vector_log = VectorLog(
+            os.path.join(data_dir, "wal"), self.dimension,
+            fsync=memory_storage_config.get("wal_fsync", FSYNC_GROUP),
+            group_records=int(memory_storage_config.get("wal_group_commit_records", GROUP_COMMIT_RECORDS)),
+            group_interval=float(memory_storage_config.get("wal_group_commit_ms", GROUP_COMMIT_INTERVAL * 1000)) / 1000
+        )
+
+        # 索引生命周期策略：先用平坦索引，规模达到阈值后在后台用真实向量训练IVF/压缩索引
+        self.index_policy = IndexPolicy.from_config(self.dimension, memory_storage_config)
+        self.scoring_weights = ScoringWeights.from_config(memory_storage_config)
+        self.candidate_pool_size = int(memory_storage_config.get("candidate_pool_size", 100))
+        self.vector_search_weight = float(memory_storage_config.get("vector_search_weight", VECTOR_SEARCH_WEIGHT))
+        self.keyword_search_weight = float(memory_storage_config.get("keyword_search_weight", KEYWORD_SEARCH_WEIGHT))
+        self.trained_size = self._load_index_meta().get("trained_size", 0)
+
+        # 初始化FAISS索引：索引文件以内存映射只读方式打开，新写入进入内存增量索引，检查点时合并
+        self.index = MemoryIndex(self.dimension, use_mmap=_to_bool(memory_storage_config.get("index_mmap", True)))
         try:
             if os.path.exists(self.index_path):
                 logger.info(f"加载现有FAISS索引: {self.index_path}")
                 try:
-                    self.index = faiss.read_index(self.index_path)
-                    logger.info(f"成功加载FAISS索引，包含 {self.index.ntotal} 条记录")
+                    self.index.load(self.index_path)
+                    logger.info(f"成功加载FAISS索引，包含 {self.index.ntotal} 条记录"
+                                f"{'（内存映射）' if self.index.base_mmapped else ''}")
+                    if _to_bool(memory_storage_config.get("index_prefetch", False)):
+                        prefetch_file(self.index_path)
                 except Exception as e:
                     logger.error(f"加载索引失败: {str(e)}，创建新索引")
-                    self._create_new_index()
+                    self.index.reset(self._create_new_index())
             else:
                 logger.info(f"索引文件不存在，创建新的FAISS索引")
-                self._create_new_index()
+                self.index.reset(self._create_new_index())
                 
-            # 确保索引已训练
-            if hasattr(self.index, 'is_trained') and not self.index.is_trained:
+            # 确保索引已训练（未训练的旧版索引必然为空，可完整读取后训练）
+            base = self.index.base
+            if hasattr(base, 'is_trained') and not base.is_trained:
                 logger.info("索引未训练，执行训练操作")
-                self.index.train(np.random.rand(max(1000, self.index.ntotal*2), self.dimension).astype('float32'))
+                if self.index.base_mmapped:
+                    base = faiss.read_index(self.index_path)
+                base.train(np.random.rand(max(1000, base.ntotal*2), self.dimension).astype('float32'))
+                self.index.reset(base)
+
+            # 重放上次检查点之后的向量日志
+            replayed = self._replay_vector_log()
+
+            # 旧版索引使用顺序位置作为ID，与元数据对不上，需要从元数据库重建
+            self._migrate_index_if_needed()
+            if replayed and self.vector_log.pending_records:
+                self.checkpoint(rebuild=False)
                 
-            logger.info(f"FAISS索引准备就绪，当前记录数: {self.index.ntotal}")
+            logger.info(f"FAISS索引准备就绪，类型: {self.index.kind}，当前记录数: {self.index.ntotal}")
         except Exception as idx_err:
             logger.error(f"初始化FAISS索引失败: {str(idx_err)}")
             # 尝试使用最简单的索引类型
             logger.info("尝试使用基础IndexFlatL2索引")
-            self.index = faiss.IndexFlatL2(self.dimension)
+            self.index.reset(faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension)))
         
-        # 初始化线程安全的SQLite连接
-        self.db = ThreadSafeSQLite(self.metadata_db)
-        self.db.execute('''
-            CREATE TABLE IF NOT EXISTS memory_metadata (
-                id INTEGER PRIMARY KEY,
-                text TEXT,
-                sender TEXT,
-                owner TEXT,
-                timestamp REAL,
-                importance_score INTEGER,
-                vector_id INTEGER UNIQUE,
-                keywords TEXT  -- 存储关键词
-            )
-        ''')
-        self.db.commit()
-        logger.info(f"SQLite元数据存储初始化完成: {self.metadata_db}")
-        
-        # 初始化缓存
-        self.cache = {}
-        self.cache_size = 1000  # 缓存大小
-        self.cache_ttl = 3600  # 缓存过期时间（秒）
+        # 记忆ID → (所有者, 发送者)映射，用于按角色/观众过滤向量检索；关键词倒排索引用于BM25检索
+        self.scopes = MemoryScopes()
+        self.keyword_index = KeywordIndex()
+        self._load_scopes()
+
+        # 初始化缓存：查询结果与元数据行分开缓存，各自独立淘汰
+        self.query_cache = LruTtlCache(max_size=1000, ttl=3600)
+        self.row_cache = LruTtlCache(max_size=5000, ttl=3600)
         
-        # 关键词提取器
-        self.keyword_extractor = jieba.analyse.TFIDF()
+        # 共享分词服务，分词和关键词结果在长期记忆与短期记忆之间复用
+        self.tokenizer = get_tokenizer()
+        self.tokenizer.configure(processes=int(memory_storage_config.get("tokenizer_processes", 0)))
+
+        # 删除（合并、淘汰）累计条数，由整理线程和保留线程共同更新，达到阈值时由检查点线程回收空间
+        self._reclaim_lock = threading.Lock()
+        self._removed_since_reclaim = 0
+
+        # 启动后台检查点线程
+        self.checkpointer = IndexCheckpointer(
+            self.vector_log, self._background_checkpoint,
+            max_records=int(memory_storage_config.get("checkpoint_max_records", 1000)),
+            interval=float(memory_storage_config.get("checkpoint_interval", 300))
+        )
+        self.checkpointer.start()
+        # 已有索引不符合当前规模（如旧版随机训练的IVF索引）时，由后台线程重建
+        if self.index_policy.needs_rebuild(self.index.kind, self.trained_size, self.index.ntotal):
+            self.checkpointer.request()
 
-    def _create_new_index(self):
-        """创建新的FAISS索引"""
+        # 启动后台记忆整理线程：合并同一所有者、同一发送者下余弦相似度达到阈值的近似重复记忆
+        self.consolidation_distance = cosine_to_distance(
+            float(memory_storage_config.get("consolidation_threshold", 0.95)))
+        self.consolidated_count = 0
+        self.consolidation_lock = threading.Lock()
+        self.consolidator = None
+        if _to_bool(memory_storage_config.get("consolidation_enabled", True)):
+            self.consolidator = MemoryConsolidator(
+                self._consolidate_ids,
+                interval=float(memory_storage_config.get("consolidation_interval", 60))
+            )
+            self.consolidator.start()
+
+        # 启动后台记忆保留线程：写回检索访问计数，淘汰超出每个所有者容量上限的记忆
+        self.retention_policy = RetentionPolicy.from_config(memory_storage_config)
+        self.retention = MemoryRetention(
+            self._enforce_retention,
+            interval=float(memory_storage_config.get("retention_interval", 300))
+        )
+        self.retention.start()
+
+    def _create_new_index(self) -> faiss.Index:
+        """
+        创建新的FAISS索引，外层使用IndexIDMap2使向量ID与元数据主键一致
+        新索引为精确的平坦索引，无需训练；规模达到阈值后由检查点重建为IVF索引
+        """
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+
+    def _load_index_meta(self) -> dict:
+        """读取索引附加信息（训练IVF时使用的向量数等）"""
         try:
-            # 尝试创建IVF索引（需要训练）
-            nlist = 100  # 聚类中心数量
-            quantizer = faiss.IndexFlatL2(self.dimension)
-            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist)
-            
-            # 使用随机数据训练索引
-            logger.info("使用随机数据训练索引")
-            train_vectors = np.random.rand(1000, self.dimension).astype('float32')
-            self.index.train(train_vectors)
-            logger.info("索引训练完成")
+            if os.path.exists(self.index_meta_path):
+                with open(self.index_meta_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"读取索引附加信息失败: {str(e)}")
+        return {}
+
+    def _save_index_meta(self, kind: str) -> None:
+        try:
+            write_file_atomic(self.index_meta_path, json.dumps({
+                "kind": kind,
+                "trained_size": self.trained_size
+            }).encode('utf-8'))
+        except Exception as e:
+            logger.warning(f"保存索引附加信息失败: {str(e)}")
+
+    def _retrain_index(self, index: faiss.Index, kind: str) -> faiss.Index:
+        """
+        使用索引中的真实向量训练指定种类的新索引，并写入全部向量
+        在检查点线程中执行，不持有索引锁，不阻塞search和save
+        """
+        start = time.time()
+        vectors, ids = extract_vectors(index)
+        if kind != INDEX_KIND_FLAT:
+            logger.info(f"开始训练{kind}索引，记录数: {len(ids)}")
+        new_index = self.index_policy.build(kind, self.index_policy.sample(vectors), len(ids))
+        if len(ids):
+            new_index.add_with_ids(vectors, ids)
+        logger.info(f"索引已重建为{kind}，记录数: {new_index.ntotal}，耗时 {time.time() - start:.2f}s")
+        return new_index
+
+    def _load_scopes(self) -> None:
+        """从元数据库加载全部记忆的所有者、发送者和关键词"""
+        try:
+            cursor = self.db.execute("SELECT id, owner, sender, keywords FROM memory_metadata")
+            for row in cursor.fetchall():
+                self.scopes.add(row[0], row[1], row[2])
+                if row[3]:
+                    self.keyword_index.add(row[0], row[3].split(","))
+            logger.info(f"已加载 {len(self.scopes)} 条记忆的所有者/发送者信息，关键词索引 {len(self.keyword_index)} 条")
+        except Exception as e:
+            logger.error(f"加载记忆所有者信息失败: {str(e)}")
+
+    def _count_metadata(self) -> int:
+        """获取元数据库中的记忆条数"""
+        return count_memories(self.db)
+
+    def count(self, owner: Optional[str] = None) -> int:
+        """获取记忆条数，owner为None时返回总数；读取触发器维护的计数器，无需扫描全表"""
+        try:
+            return count_memories(self.db, owner)
+        except Exception as e:
+            logger.error(f"获取记忆条数失败: {str(e)}")
+            return 0
+
+    def owner_counts(self) -> Dict[str, int]:
+        """获取每个所有者的记忆条数"""
+        try:
+            return owner_counts(self.db)
+        except Exception as e:
+            logger.error(f"获取所有者记忆条数失败: {str(e)}")
+            return {}
+
+    def _migrate_index_if_needed(self):
+        """
+        检查索引是否为ID映射索引且与元数据一致，否则从memory_metadata.db重建
+        旧版本使用index.add写入，FAISS返回的是顺序位置而不是元数据中的vector_id
+        """
+        row_count = self._count_metadata()
+        if self.index.is_id_mapped and self.index.ntotal == row_count:
+            return
+        logger.warning(f"FAISS索引与元数据不一致(索引类型={type(self.index.base).__name__}, "
+                       f"向量数={self.index.ntotal}, 元数据数={row_count})，从元数据库重建索引")
+        self._rebuild_index_from_metadata()
+
+    def _rebuild_index_from_metadata(self, batch_size: int = 512):
+        """使用元数据库中的文本重新生成向量，以元数据主键作为向量ID重建索引"""
+        with self.checkpoint_lock, self.index_lock:
+            index = self._create_new_index()
+            # 统一ID来源：vector_id与主键保持一致
+            self.db.execute("UPDATE memory_metadata SET vector_id = id WHERE vector_id IS NOT id")
+            self.db.commit()
+
+            cursor = self.db.execute("SELECT id, text FROM memory_metadata ORDER BY id")
+            rows = cursor.fetchall()
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                vectors = self._get_embeddings([row[1] or "" for row in batch])
+                ids = np.array([row[0] for row in batch], dtype=np.int64)
+                index.add_with_ids(vectors, ids)
+
+            # 规模超过阈值时直接使用真实向量训练IVF索引
+            kind = self.index_policy.target_kind(index.ntotal)
+            if kind != INDEX_KIND_FLAT:
+                index = self._retrain_index(index, kind)
+
+            write_file_atomic(self.index_path, faiss.serialize_index(index))
+            self.trained_size = index.ntotal if kind != INDEX_KIND_FLAT else 0
+            self._save_index_meta(kind)
+            # 重建后的索引已包含全部记录，旧日志不再需要
+            self.vector_log.reset()
+            self.index.load(self.index_path)
+            logger.info(f"FAISS索引重建完成，共 {self.index.ntotal} 条记录")
+
+    def _replay_vector_log(self) -> int:
+        """重放向量日志中尚未合并进索引文件的写入和删除，返回重放的记录数"""
+        if not self.index.is_id_mapped:
+            # 旧版索引会从元数据库整体重建，无需重放
+            return 0
+        replayed = 0
+        # 索引中已有的ID只取一次，重放时随写入和删除同步更新
+        present = self.index.id_set()
+        for op, ids, vectors in self.vector_log.replay():
+            id_list = ids.tolist()
+            if op == OP_ADD:
+                # 已在索引文件中的ID（检查点写完但日志未清理时）跳过，保证重放幂等
+                mask = np.fromiter((vector_id not in present for vector_id in id_list), dtype=bool, count=len(id_list))
+                if mask.any():
+                    self.index.add_with_ids(vectors[mask], ids[mask])
+                    present.update(ids[mask].tolist())
+            else:
+                self.index.remove_ids(ids)
+                present.difference_update(id_list)
+            replayed += len(ids)
+        if replayed:
+            logger.info(f"从向量日志恢复了 {replayed} 条记录，当前索引记录数: {self.index.ntotal}")
+        return replayed
+
+    def checkpoint(self, rebuild: bool = True) -> bool:
+        """
+        检查点：将向量日志和内存增量索引合并进索引文件
+        在索引锁内切换日志段并记录增量快照；在锁外生成合并后的索引、写临时文件并原子替换；
+        最后在锁内重新映射索引文件，删除已合并的日志段
+        :param rebuild: 是否允许按索引生命周期策略重建索引（升级为IVF或重新训练）
+        """
+        with self.checkpoint_lock:
+            try:
+                with self.index_lock:
+                    sealed_seq = self.vector_log.rotate()
+                    snapshot = self.index.begin_checkpoint()
+                try:
+                    merged = self.index.build_merged(self.index_path, snapshot)
+                    kind = self.index_policy.needs_rebuild(index_kind(merged), self.trained_size,
+                                                           merged.ntotal) if rebuild else None
+                    if kind:
+                        merged = self._retrain_index(merged, kind)
+                    write_file_atomic(self.index_path, faiss.serialize_index(merged))
+                    if kind:
+                        self.trained_size = merged.ntotal if kind != INDEX_KIND_FLAT else 0
+                        self._save_index_meta(kind)
+                    ntotal = merged.ntotal
+                    del merged
+                    with self.index_lock:
+                        self.index.finish_checkpoint(self.index_path, snapshot)
+                except Exception:
+                    with self.index_lock:
+                        self.index.abort_checkpoint()
+                    raise
+                self.vector_log.purge(sealed_seq)
+                self.vector_log.mark_checkpointed()
+                logger.info(f"FAISS索引检查点完成，当前记录数: {ntotal}")
+                return True
+            except Exception as e:
+                logger.error(f"FAISS索引检查点失败: {str(e)}")
+                return False
+
+    def consolidate(self, owner: Optional[str] = None) -> int:
+        """
+        全量整理记忆：合并指定所有者（None表示全部所有者）下的近似重复记忆
+        Args:
+            owner: 所有者
+        Returns:
+            int: 被合并删除的记忆条数
+        """
+        try:
+            if owner is None:
+                cursor = self.db.execute("SELECT id FROM memory_metadata ORDER BY id")
+            else:
+                cursor = self.db.execute("SELECT id FROM memory_metadata WHERE owner = ? ORDER BY id", (owner,))
+            ids = [row[0] for row in cursor.fetchall()]
+            removed = 0
+            for start in range(0, len(ids), CONSOLIDATION_BATCH_SIZE):
+                removed += self._consolidate_ids(ids[start:start + CONSOLIDATION_BATCH_SIZE])
+            logger.info(f"记忆整理完成，合并了 {removed} 条近似重复记忆")
+            return removed
+        except Exception as e:
+            logger.error(f"记忆整理失败: {str(e)}")
+            return 0
+
+    def _consolidate_ids(self, ids: List[int]) -> int:
+        """
+        检查一批记忆是否与同一所有者、同一发送者下更早的记忆近似重复，重复的合并进更早的记忆
+        向量由文本重新计算（命中向量缓存），在(所有者, 发送者)范围内检索近邻；
+        不同观众说的相同内容不合并，否则合并后的记忆会归到更早那条的发送者名下
+        Returns:
+            int: 被合并删除的记忆条数
+        """
+        with self.consolidation_lock:
+            rows = self._fetch_metadata(ids)
+            by_scope: Dict[Tuple[str, str], List[int]] = {}
+            for memory_id in ids:
+                row = rows.get(memory_id)
+                if row is not None and row["text"] and row["owner"] is not None and row["sender"] is not None:
+                    by_scope.setdefault((row["owner"], row["sender"]), []).append(memory_id)
+
+            merges: Dict[int, List[int]] = {}
+            for (owner, sender), scope_ids in by_scope.items():
+                selector, scope_size = self.scopes.selector(owner=owner, sender=sender)
+                if scope_size < 2:
+                    continue
+                vectors = self._get_embeddings([rows[memory_id]["text"] for memory_id in scope_ids])
+                with self.index_lock:
+                    self._set_nprobe()
+                    D, I = self.index.search(vectors, CONSOLIDATION_NEIGHBORS + 1, selector=selector)
+                merges.update(plan_merges(np.array(scope_ids, dtype=np.int64), D, I, self.consolidation_distance))
+            if not merges:
+                return 0
+            return self._merge_memories(merges)
+
+    def _merge_memories(self, merges: Dict[int, List[int]]) -> int:
+        """
+        合并记忆：保留的记忆累加重复记忆的条数，时间戳和重要性取最大值；删除重复记忆的元数据和向量
+        Args:
+            merges: 保留的记忆ID → 重复记忆ID列表
+        Returns:
+            int: 被删除的记忆条数
+        """
+        duplicate_of = {duplicate: survivor for survivor, duplicates in merges.items() for duplicate in duplicates}
+        duplicates = list(duplicate_of)
+        with self.db.transaction():
+            # 在事务内读取重复记忆的最新计数，累计到保留的记忆上
+            totals: Dict[int, list] = {}
+            for start in range(0, len(duplicates), SQLITE_MAX_VARIABLES):
+                chunk = duplicates[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self.db.execute(
+                    f"SELECT id, occurrences, timestamp, IFNULL(importance_score, 1) FROM memory_metadata WHERE id IN ({placeholders})",
+                    chunk
+                )
+                for memory_id, occurrences, timestamp, importance in cursor.fetchall():
+                    total = totals.setdefault(duplicate_of[memory_id], [0, 0.0, 1])
+                    total[0] += occurrences
+                    total[1] = max(total[1], timestamp or 0.0)
+                    total[2] = max(total[2], importance)
+            self.db.executemany(
+                "UPDATE memory_metadata SET occurrences = occurrences + ?, timestamp = MAX(timestamp, ?), "
+                "importance_score = MAX(IFNULL(importance_score, 1), ?) WHERE id = ?",
+                [(occurrences, timestamp, importance, survivor)
+                 for survivor, (occurrences, timestamp, importance) in totals.items()]
+            )
+            self.db.executemany("DELETE FROM memory_metadata WHERE id = ?", [(memory_id,) for memory_id in duplicates])
+
+        for memory_id in merges:
+            self.row_cache.invalidate(memory_id)
+        self._drop_memories(duplicates)
+        self.consolidated_count += len(duplicates)
+        logger.info(f"合并了 {len(duplicates)} 条近似重复记忆到 {len(merges)} 条记忆")
+        return len(duplicates)
+
+    def _enforce_retention(self, access: Dict[int, int]) -> int:
+        """
+        写回检索访问计数，并淘汰超出容量的记忆
+        每个所有者每轮最多淘汰eviction_batch_size条，由后台保留线程周期调用
+        Returns:
+            int: 本轮淘汰的记忆条数
+        """
+        if access:
+            now = time.time()
+            with self.db.transaction():
+                self.db.executemany(
+                    "UPDATE memory_metadata SET access_count = access_count + ?, last_access = ? WHERE id = ?",
+                    [(hits, now, memory_id) for memory_id, hits in access.items()]
+                )
+
+        evicted = 0
+        # 与合并互斥：合并会改写出现次数并删除记忆，淘汰需基于一致的候选集合
+        with self.consolidation_lock:
+            for owner, count in owner_counts(self.db).items():
+                excess = self.retention_policy.excess(count)
+                if excess == 0:
+                    continue
+                sql = "SELECT id, timestamp, IFNULL(last_access, 0), IFNULL(importance_score, 1), " \
+                      "access_count + occurrences - 1 FROM memory_metadata WHERE "
+                if owner:
+                    cursor = self.db.execute(sql + "owner = ?", (owner,))
+                else:
+                    cursor = self.db.execute(sql + "owner IS NULL OR owner = ''")
+                rows = cursor.fetchall()
+                if not rows:
+                    continue
+                ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+                values = np.array([tuple(row)[1:] for row in rows], dtype=np.float64)
+                scores = self.retention_policy.scores(values[:, 0], values[:, 1], values[:, 2], values[:, 3])
+                victims = ids[self.retention_policy.select_victims(scores, excess)].tolist()
+                evicted += self._delete_memories(victims)
+                logger.info(f"所有者 {owner} 的记忆数 {count} 超出上限，淘汰了 {len(victims)} 条")
+        return evicted
+
+    def _delete_memories(self, ids: List[int]) -> int:
+        """删除指定记忆的元数据和向量，返回删除条数"""
+        if not ids:
+            return 0
+        with self.db.transaction():
+            self.db.executemany("DELETE FROM memory_metadata WHERE id = ?", [(memory_id,) for memory_id in ids])
+        self._drop_memories(ids)
+        return len(ids)
+
+    def _drop_memories(self, ids: List[int]) -> None:
+        """元数据删除后，清理缓存、所有者映射和关键词索引，从向量索引中删除并记录向量日志"""
+        for memory_id in ids:
+            self.row_cache.invalidate(memory_id)
+        self.scopes.remove(ids)
+        self.keyword_index.remove(ids)
+        self.query_cache.clear()
+
+        vector_ids = np.array(ids, dtype=np.int64)
+        with self.index_lock:
+            self.index.remove_ids(vector_ids)
+            self.vector_log.append_remove(vector_ids)
+        self.checkpointer.notify()
+
+        with self._reclaim_lock:
+            self._removed_since_reclaim += len(ids)
+            reclaim = self._removed_since_reclaim >= RECLAIM_THRESHOLD
+        if reclaim:
+            self.checkpointer.request()
+
+    def retention_stats(self) -> dict:
+        """获取记忆保留统计：累计淘汰条数、当前保留条数和每个所有者的上限"""
+        stats = self.retention.stats()
+        stats["retained"] = self.count()
+        stats["max_per_owner"] = self.retention_policy.max_per_owner
+        return stats
+
+    def _background_checkpoint(self) -> bool:
+        """
+        后台检查点线程执行的检查点：检查点重写索引文件去掉已删除的向量后，
+        删除条数达到阈值时回收元数据库空间，VACUUM只在检查点线程中执行，不会并发
+        """
+        result = self.checkpoint()
+        with self._reclaim_lock:
+            reclaim = self._removed_since_reclaim >= RECLAIM_THRESHOLD
+            if reclaim:
+                self._removed_since_reclaim = 0
+        if reclaim:
+            self._reclaim_space()
+        return result
+
+    def _reclaim_space(self) -> None:
+        """VACUUM元数据库，回收删除记忆后的空间"""
+        try:
+            self.db.execute("VACUUM")
+            logger.info("元数据库空间已回收")
         except Exception as e:
-            logger.error(f"创建IVF索引失败: {str(e)}，使用基础索引")
-            # 使用不需要训练的基础索引
-            self.index = faiss.IndexFlatL2(self.dimension)
-            logger.info("已创建基础IndexFlatL2索引")
+            logger.warning(f"回收元数据库空间失败: {str(e)}")
+
+    def export_snapshot(self, writer, vector_dtype: str = "float32") -> dict:
+        """
+        导出时间点一致的快照：元数据表memory_metadata和按行对齐的向量矩阵vectors
+        只在检查点锁内复制索引文件和元数据库：索引锁内短暂复制增量索引并确定元数据读事务的快照，
+        再用SQLite在线备份把该快照复制到临时数据库后关闭读事务；之后在锁外从副本流式写出，
+        导出期间检查点和WAL检查点都不受阻塞
+        Args:
+            writer: 快照写入器（memory.snapshot.SnapshotWriter）
+            vector_dtype: 向量存储类型，float32或float16
+        Returns:
+            dict: 写入清单的长期记忆信息
+        """
+        index_copy = os.path.join(writer.path, "memory.index.tmp")
+        metadata_copy = os.path.join(writer.path, "memory_metadata.db.tmp")
+        copy_conn = sqlite3.connect(metadata_copy)
+        try:
+            with self.checkpoint_lock:
+                # 基础索引文件只在检查点时被替换，持有检查点锁时复制的文件与内存中的基础索引一致
+                has_base = os.path.exists(self.index_path)
+                if has_base:
+                    shutil.copyfile(self.index_path, index_copy)
+                with self.db.read_snapshot() as conn:
+                    # 元数据提交晚于向量写入、早于向量删除，锁内确定的元数据快照中的记忆都能在同一时刻的索引中找到向量
+                    with self.index_lock:
+                        delta = self.index.delta
+                        delta_ids = faiss.vector_to_array(delta.id_map).astype(np.int64)
+                        if delta.ntotal:
+                            delta_vectors = delta.index.reconstruct_n(0, delta.ntotal)
+                        else:
+                            delta_vectors = np.zeros((0, self.dimension), dtype=np.float32)
+                        total = conn.execute("SELECT COUNT(*) FROM memory_metadata").fetchone()[0]
+                        kind = self.index.kind
+                    # 在线备份在同一读事务中按页复制，得到与上面相同时间点的副本
+                    conn.backup(copy_conn)
+
+            if has_base:
+                base_vectors, base_ids = extract_vectors(faiss.read_index(index_copy))
+            else:
+                base_vectors, base_ids = np.zeros((0, self.dimension), dtype=np.float32), np.zeros(0, dtype=np.int64)
+            base_positions = {memory_id: row for row, memory_id in enumerate(base_ids.tolist())}
+            delta_positions = {memory_id: row for row, memory_id in enumerate(delta_ids.tolist())}
+
+            matrix = writer.create_matrix("vectors", total, self.dimension, vector_dtype)
+            missing = []
+
+            def rows():
+                cursor = copy_conn.execute(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM memory_metadata ORDER BY id")
+                for row_number, row in enumerate(cursor):
+                    if row[0] in delta_positions:
+                        matrix[row_number] = delta_vectors[delta_positions[row[0]]]
+                    elif row[0] in base_positions:
+                        matrix[row_number] = base_vectors[base_positions[row[0]]]
+                    else:
+                        missing.append((row_number, row[1]))
+                    yield row
+
+            count = writer.write_table("memory_metadata", SNAPSHOT_COLUMNS, rows())
+            del base_vectors
+        finally:
+            copy_conn.close()
+            for path in (index_copy, metadata_copy):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # 索引中缺失的向量由文本重新计算
+        for start in range(0, len(missing), CONSOLIDATION_BATCH_SIZE):
+            chunk = missing[start:start + CONSOLIDATION_BATCH_SIZE]
+            matrix[[row_number for row_number, _ in chunk]] = self._get_embeddings([text or "" for _, text in chunk])
+        if missing:
+            logger.warning(f"{len(missing)} 条记忆在索引中没有向量，已由文本重新计算")
+        matrix.flush()
+        del matrix
+
+        logger.info(f"长期记忆快照导出完成: {count} 条")
+        return {
+            "rows": count,
+            "dimension": self.dimension,
+            "vector_dtype": vector_dtype,
+            "index_kind": kind,
+            "embedding_model": getattr(self.embedding, "model_id", None)
+        }
+
+    def import_snapshot(self, reader, replace: bool = False, chunk_size: int = 5000) -> int:
+        """
+        从快照分块流式导入记忆，保留原始ID，已存在的ID跳过；导入后执行一次检查点，
+        之后的冷启动可直接内存映射打开合并后的索引文件
+        Args:
+            reader: 快照读取器（memory.snapshot.SnapshotReader）
+            replace: 是否先删除现有的全部记忆
+        Returns:
+            int: 导入的记忆条数
+        """
+        info = reader.manifest.get("long_memory")
+        if info is None or reader.section("memory_metadata") is None:
+            logger.warning("快照中没有长期记忆")
+            return 0
+        if info["dimension"] != self.dimension:
+            raise ValueError(f"快照向量维度 {info['dimension']} 与当前维度 {self.dimension} 不一致")
+        model_id = getattr(self.embedding, "model_id", None)
+        if info.get("embedding_model") != model_id:
+            raise ValueError(f"快照的嵌入模型 {info.get('embedding_model')} 与当前模型 {model_id} 不一致")
+
+        if replace:
+            cursor = self.db.execute("SELECT id FROM memory_metadata")
+            self._delete_memories([row[0] for row in cursor.fetchall()])
+
+        vectors = reader.open_matrix("vectors")
+        offset = 0
+        loaded = 0
+        for records in reader.read_table("memory_metadata", chunk_size):
+            block = np.ascontiguousarray(vectors[offset:offset + len(records)], dtype=np.float32)
+            offset += len(records)
+            loaded += self._bulk_load(records, block)
+
+        self.checkpoint()
+        logger.info(f"长期记忆快照导入完成: {loaded} 条")
+        return loaded
+
+    def _bulk_load(self, records: List[dict], vectors: np.ndarray) -> int:
+        """批量写入带有原始ID的记忆（快照导入），已存在的ID跳过，返回写入条数"""
+        ids = [record["id"] for record in records]
+        existing = set()
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            chunk = ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.db.execute(f"SELECT id FROM memory_metadata WHERE id IN ({placeholders})", chunk)
+            existing.update(row[0] for row in cursor.fetchall())
+        keep = [position for position, memory_id in enumerate(ids) if memory_id not in existing]
+        if not keep:
+            return 0
+
+        rows = [
+            (record["id"], record["text"], record["sender"], record["owner"], record["timestamp"],
+             record["importance_score"], record["id"], record["keywords"], record.get("occurrences", 1),
+             record.get("access_count", 0), record.get("last_access"))
+            for record in (records[position] for position in keep)
+        ]
+        self.db.executemany(
+            "INSERT INTO memory_metadata (id, text, sender, owner, timestamp, importance_score, vector_id, keywords, "
+            "occurrences, access_count, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        pks = np.array([row[0] for row in rows], dtype=np.int64)
+        block = np.ascontiguousarray(vectors[keep])
+        try:
+            with self.index_lock:
+                self.index.add_with_ids(block, pks)
+                try:
+                    self.vector_log.append_add(pks, block)
+                except Exception:
+                    self.index.remove_ids(pks)
+                    raise
+        except Exception:
+            self.db.rollback()
+            raise
+        self.db.commit()
+
+        for row in rows:
+            self.scopes.add(row[0], row[3], row[2])
+            if row[7]:
+                self.keyword_index.add(row[0], row[7].split(","))
+        self.query_cache.clear()
+        self.checkpointer.notify()
+        return len(rows)
+
+    def _next_id(self) -> int:
+        """生成记忆ID，同时作为元数据主键和FAISS向量ID"""
+        with self.index_lock:
+            return self.id_generator.task()
+
+    def _set_nprobe(self):
+        """为IVF类型的索引设置合理的nprobe值"""
+        self.index.set_nprobe(self.index_policy.nprobe)
 
     def _extract_keywords(self, text: str) -> str:
         """提取文本关键词"""
-        keywords = self.keyword_extractor.extract_tags(text, topK=5)
-        return ",".join(keywords)
+        return ",".join(self.tokenizer.keywords(text, top_k=KEYWORDS_PER_MEMORY))
+
+    def _query_keywords(self, query_text: str) -> frozenset:
+        """提取查询关键词，相同查询的分词结果由分词服务缓存"""
+        return frozenset(self.tokenizer.keywords(query_text, top_k=KEYWORDS_PER_MEMORY))
+
+    def _scope_predicate(self, owner: Optional[str], sender: Optional[str]):
+        """构建关键词检索的所有者/发送者过滤条件"""
+        if owner is None and sender is None:
+            return None
 
-    def search(self, query_text: str, limit: int = 3) -> list[str]:
-        """搜索相关记忆"""
+        def predicate(memory_id: int) -> bool:
+            scope = self.scopes.get(memory_id)
+            return scope is not None and (owner is None or scope[0] == owner) and \
+                (sender is None or scope[1] == sender)
+        return predicate
+
+    def search(self, query_text: str, limit: int = 3, sender: Optional[str] = None,
+               owner: Optional[str] = None) -> list[str]:
+        """
+        搜索相关记忆
+        向量检索与关键词BM25检索各取一路候选，通过倒数排名融合合并后，按相关性、关键词匹配度、时效性和重要性综合排序
+        Args:
+            query_text: 查询文本
+            limit: 返回条数
+            sender: 只检索该发送者（观众）的记忆，None表示不限
+            owner: 只检索该所有者（角色）的记忆，None表示不限
+        Returns:
+            List[str]: 记忆文本列表
+        """
         # 参数验证
         if not query_text:
             logger.warning("查询文本为空，跳过搜索")
@@ -168,12 +784,13 @@ class FAISSStorage(BaseStorage):
             return []
         
         # 检查缓存
-        cache_key = f"{query_text}_{limit}"
-        if cache_key in self.cache:
-            cached_result = self.cache[cache_key]
-            if time.time() - cached_result["timestamp"] < self.cache_ttl:
-                logger.debug("使用缓存的搜索结果")
-                return cached_result["result"]
+        cache_key = (query_text, limit, owner, sender)
+        cached_result = self.query_cache.get(cache_key)
+        if cached_result is not None:
+            logger.debug("使用缓存的搜索结果")
+            cached_ids, cached_texts = cached_result
+            self.retention.record_access(cached_ids)
+            return list(cached_texts)
         
         try:
             # 获取查询向量
@@ -195,101 +812,69 @@ class FAISSStorage(BaseStorage):
             
             # 提取查询关键词
             try:
-                query_keywords = set(self._extract_keywords(query_text).split(","))
+                query_keywords = self._query_keywords(query_text)
             except Exception as kw_err:
                 logger.warning(f"关键词提取失败: {str(kw_err)}")
-                query_keywords = set()
+                query_keywords = frozenset()
             
+            # 按所有者/发送者构建ID选择器，top-k只在范围内的向量中计算
+            selector, scope_size = self.scopes.selector(owner=owner, sender=sender)
+            if selector is not None and scope_size == 0:
+                logger.debug(f"所有者 {owner} / 发送者 {sender} 没有可检索的记忆")
+                return []
+
             # 设置搜索参数
-            actual_limit = min(limit * 5, 100)  # 限制候选项数量
-            if hasattr(self.index, 'nprobe'):
-                try:
-                    # 只有IVF类型的索引才有nprobe属性
-                    self.index.nprobe = min(10, self.index.nlist // 2)  # 设置合理的nprobe值
-                except Exception:
-                    # 忽略错误，使用默认值
-                    pass
+            actual_limit = max(limit, min(limit * 5, self.candidate_pool_size))  # 限制候选项数量
             
-            # 执行搜索
+            # 执行向量搜索（基础索引与增量索引合并），返回的I即为记忆ID；
+            # 向量已归一化，平方L2距离d换算为余弦相似度1 - d/2
+            vector_scores = {}
             try:
-                D, I = self.index.search(query_vector, actual_limit)
+                with self.index_lock:
+                    self._set_nprobe()
+                    D, I = self.index.search(query_vector, actual_limit, selector=selector)
+                vector_scores = {int(idx): max(0.0, 1.0 - float(distance) / 2.0)
+                                 for distance, idx in zip(D[0], I[0]) if idx != -1}
             except Exception as search_err:
                 logger.error(f"FAISS搜索失败: {str(search_err)}")
-                return []
-            
-            # 获取匹配的记忆项
-            memories = []
-            for i, idx in enumerate(I[0]):
-                if idx == -1 or i >= len(D[0]):  # 跳过无效索引
-                    continue
-                    
-                # 尝试从缓存获取
-                memory = self.cache.get(idx)
-                if memory is None:
-                    try:
-                        cursor = self.db.execute(
-                            "SELECT id, text, sender, owner, timestamp, importance_score, keywords FROM memory_metadata WHERE vector_id=?",
-                            (int(idx),)
-                        )
-                        result = cursor.fetchone()
-                        if result:
-                            memory = {
-                                "id": result[0],
-                                "text": result[1],
-                                "sender": result[2],
-                                "owner": result[3],
-                                "timestamp": result[4],
-                                "importance_score": result[5],
-                                "keywords": set(result[6].split(",")) if result[6] else set(),
-                                "relevance": max(0, min(1, 1 - D[0][i]))  # 确保分数在0到1之间
-                            }
-                            self._update_cache(result[0], memory)
-                    except Exception as db_err:
-                        logger.error(f"数据库查询失败: {str(db_err)}")
-                        continue
-                
-                if memory and isinstance(memory, dict) and "text" in memory:
-                    # 计算关键词匹配度
-                    keyword_overlap = len(query_keywords & memory.get("keywords", set())) if query_keywords else 0
-                    memory["keyword_score"] = keyword_overlap / max(len(query_keywords), 1) if query_keywords else 0
-                    
-                    memories.append(memory)
-                    if len(memories) >= limit*3:  # 保留更多候选用于后续排序
-                        break
+
+            # 关键词BM25检索，能找回向量候选之外的记忆
+            keyword_scores = {}
+            if query_keywords:
+                keyword_scores = normalize_by_max(dict(self.keyword_index.search(
+                    query_keywords, actual_limit, predicate=self._scope_predicate(owner, sender))))
+
+            # 按归一化分数和通道权重融合
+            fused = weighted_score_fusion([(vector_scores, self.vector_search_weight),
+                                           (keyword_scores, self.keyword_search_weight)])
+            candidates = sorted(fused, key=fused.get, reverse=True)
             
-            if not memories:
+            # 一次性批量获取所有候选记忆的元数据
+            try:
+                rows = self._fetch_metadata(candidates)
+            except Exception as db_err:
+                logger.error(f"数据库查询失败: {str(db_err)}")
+                return []
+
+            candidates = [memory_id for memory_id in candidates if rows.get(memory_id, {}).get("text")]
+            if not candidates:
                 logger.debug("未找到匹配的记忆")
                 return []
             
-            # 计算时效性和规范化分数
+            # 计算综合分数并取最高分的记忆
             try:
-                self._compute_recency(memories)
-                self._normalize_scores(memories)
+                ranked = self._rank_candidates(candidates, rows, fused, query_keywords, limit)
             except Exception as score_err:
                 logger.warning(f"计算分数失败: {str(score_err)}")
-                # 降级为简单排序
-                memories = sorted(memories, key=lambda m: m.get("relevance", 0), reverse=True)
-            else:
-                # 排序获取最高分的记忆
-                memories = sorted(memories, key=lambda m: m.get("total_score", 0), reverse=True)
+                # 降级为融合排名
+                ranked = candidates[:limit]
             
-            result = []
-            if len(memories) > 0:
-                try:
-                    memories_text = [item.get('text', '') for item in memories if item.get('text')]
-                    memories_size = min(limit, len(memories_text))  # 确保不会超出列表范围
-                    result = memories_text[:memories_size]
-                except Exception as extract_err:
-                    logger.error(f"提取记忆文本失败: {str(extract_err)}")
-                    return []
-                    
-                logger.info(f"返回 {len(result)} 条记忆结果")
+            result = [rows[memory_id]["text"] for memory_id in ranked]
+            logger.info(f"返回 {len(result)} 条记忆结果")
+            self.retention.record_access(ranked)
             
-            # 更新缓存
-            self._update_cache(cache_key, {
-                "result": result,
-                "timestamp": time.time()
-            })
+            # 更新缓存（同时保存记忆ID，缓存命中时也计入访问次数）
+            self.query_cache.put(cache_key, (tuple(ranked), tuple(result)))
             
             return result
             
@@ -313,99 +898,153 @@ class FAISSStorage(BaseStorage):
         if not text:
             logger.warning("尝试保存空文本，已跳过")
             return False
+        return self.save_many([{
+            "text": text,
+            "sender": sender,
+            "owner": owner,
+            "importance_score": importance_score
+        }]) == 1
+
+    def save_many(self, memories: List[dict]) -> int:
+        """
+        批量保存记忆：一次批量计算向量、一次executemany写入元数据、一次写入索引和向量日志，最后统一提交
+        Args:
+            memories: 记忆列表，每项包含text、sender、owner，可选importance_score（默认1）
+        Returns:
+            int: 保存成功的条数
+        """
+        memories = [memory for memory in memories if memory.get("text")]
+        if not memories:
+            return 0
             
         if not hasattr(self, 'index') or self.index is None:
             logger.error("FAISS索引未初始化，无法保存")
-            return False
+            return 0
             
         try:
-            # 获取向量嵌入
-            vector = self._get_embedding(text)
-            if vector is None or (isinstance(vector, np.ndarray) and np.isnan(vector).any()):
+            # 批量获取向量嵌入
+            texts = [memory["text"] for memory in memories]
+            vectors = self._get_embeddings(texts)
+            if vectors.shape != (len(texts), self.dimension) or np.isnan(vectors).any():
                 logger.error("获取向量嵌入失败，跳过保存")
-                return False
-                
-            # 确保向量是numpy数组且类型正确
-            if not isinstance(vector, np.ndarray):
-                vector = np.array(vector, dtype=np.float32)
-                
-            # 确保向量是2D的，shape为(1, dimension)
-            if vector.ndim == 1:
-                vector = vector.reshape(1, -1)
-                
-            # 确保向量是float32类型
-            if vector.dtype != np.float32:
-                vector = vector.astype(np.float32)
+                return 0
             
-            # 生成全局唯一ID
+            # 生成全局唯一ID，元数据主键与向量ID共用
             try:
-                timestamp = int(time.time() * 1000000)
-                random_part = np.random.randint(0, 1000000)
-                pk = timestamp + random_part
-                vector_id = pk  # 使用相同的ID作为向量ID
+                pks = [self._next_id() for _ in memories]
             except Exception as id_err:
                 logger.error(f"生成ID失败: {str(id_err)}")
-                return False
+                return 0
             
-            # 提取关键词
+            # 保存元数据到SQLite（先批量分词，逐条提取关键词时命中分词缓存）
             try:
-                keywords = self._extract_keywords(text)
-                if not keywords:
-                    keywords = " ".join(text.split()[:5])  # 使用前5个词作为关键词
-                    logger.warning("关键词提取失败，使用文本开头作为关键词")
+                self.tokenizer.analyze_many(texts)
             except Exception as kw_err:
-                logger.error(f"提取关键词失败: {str(kw_err)}")
-                keywords = ""  # 使用空字符串
-            
-            # 添加向量到FAISS索引
+                logger.warning(f"批量分词失败: {str(kw_err)}")
+            now = time.time()
+            rows = [
+                (pk, memory["text"], memory.get("sender"), memory.get("owner"), now,
+                 memory.get("importance_score", 1), pk, self._keywords_for_save(memory["text"]))
+                for pk, memory in zip(pks, memories)
+            ]
             try:
-                self.index.add(vector)
-            except Exception as idx_err:
-                logger.error(f"添加向量到索引失败: {str(idx_err)}")
-                return False
-            
-            # 保存元数据到SQLite
-            try:
-                self.db.execute(
+                self.db.executemany(
                     "INSERT INTO memory_metadata (id, text, sender, owner, timestamp, importance_score, vector_id, keywords) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (pk, text, sender, owner, time.time(), importance_score, vector_id, keywords)
+                    rows
                 )
-                self.db.commit()
-            except sqlite3.IntegrityError as sql_err:
-                logger.error(f"SQL完整性错误，可能是ID冲突: {str(sql_err)}")
-                try:
-                    # 尝试使用不同的ID重新插入
-                    pk = int(time.time() * 1000000) + np.random.randint(1000000, 2000000)
-                    vector_id = pk
-                    self.db.execute(
-                        "INSERT INTO memory_metadata (id, text, sender, owner, timestamp, importance_score, vector_id, keywords) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                        (pk, text, sender, owner, time.time(), importance_score, vector_id, keywords)
-                    )
-                    self.db.commit()
-                except Exception as retry_err:
-                    logger.error(f"重试插入数据库失败: {str(retry_err)}")
-                    return False
             except Exception as db_err:
                 logger.error(f"保存到数据库失败: {str(db_err)}")
-                return False
+                self.db.rollback()
+                return 0
             
-            # 定期保存索引
+            # 以记忆ID添加向量到FAISS索引并追加向量日志，失败时回滚元数据
             try:
-                if hasattr(self.index, 'ntotal') and self.index.ntotal % 100 == 0:  # 每100条记录保存一次
-                    faiss.write_index(self.index, self.index_path)
-                    logger.info(f"保存FAISS索引，当前记录数: {self.index.ntotal}")
-            except Exception as save_err:
-                logger.warning(f"保存索引文件失败: {str(save_err)}")
-                # 继续执行，这不是致命错误
+                ids = np.array(pks, dtype=np.int64)
+                with self.index_lock:
+                    self.index.add_with_ids(vectors, ids)
+                    try:
+                        self.vector_log.append_add(ids, vectors)
+                    except Exception:
+                        self.index.remove_ids(ids)
+                        raise
+            except Exception as idx_err:
+                logger.error(f"添加向量到索引失败: {str(idx_err)}")
+                self.db.rollback()
+                return 0
+            self.db.commit()
+            for pk, memory, row in zip(pks, memories, rows):
+                self.scopes.add(pk, memory.get("owner"), memory.get("sender"))
+                self.keyword_index.add(pk, row[7].split(","))
+
+            # 新记忆可能改变任意查询的结果，使查询缓存失效
+            self.query_cache.clear()
             
-            logger.info(f"成功保存长期记忆: id={pk}, sender={sender}, owner={owner}, vector_id={vector_id}")
-            return True
+            # 日志积累到阈值时唤醒后台检查点；新记忆交给后台整理线程检查是否与已有记忆重复
+            self.checkpointer.notify()
+            if self.consolidator is not None:
+                self.consolidator.submit(pks)
+            
+            if len(pks) == 1:
+                logger.info(f"成功保存长期记忆: id={pks[0]}, sender={memories[0].get('sender')}, "
+                            f"owner={memories[0].get('owner')}")
+            else:
+                logger.info(f"成功批量保存长期记忆: {len(pks)} 条")
+            return len(pks)
             
         except Exception as e:
             logger.error(f"保存记忆失败: {str(e)}")
             stack_trace = traceback.format_exc()
             logger.error(f"详细错误信息: {stack_trace}")
-            return False
+            return 0
+
+    def _keywords_for_save(self, text: str) -> str:
+        """提取待保存记忆的关键词，提取不到时使用文本开头"""
+        try:
+            keywords = self._extract_keywords(text)
+            if not keywords:
+                keywords = " ".join(text.split()[:5])  # 使用前5个词作为关键词
+                logger.warning("关键词提取失败，使用文本开头作为关键词")
+            return keywords
+        except Exception as kw_err:
+            logger.error(f"提取关键词失败: {str(kw_err)}")
+            return ""  # 使用空字符串
+
+    def _fetch_metadata(self, ids: List[int]) -> Dict[int, dict]:
+        """
+        批量获取记忆元数据
+        优先读取缓存，未命中的ID通过IN查询一次取回，避免逐条查询SQLite
+        """
+        rows = {}
+        missing = []
+        for memory_id in ids:
+            cached = self.row_cache.get(memory_id)
+            if cached is not None:
+                rows[memory_id] = cached
+            else:
+                missing.append(memory_id)
+
+        # SQLite单条语句的参数数量有限，超出时分批查询
+        for start in range(0, len(missing), SQLITE_MAX_VARIABLES):
+            chunk = missing[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.db.execute(
+                f"SELECT id, text, sender, owner, timestamp, importance_score, keywords, occurrences FROM memory_metadata WHERE id IN ({placeholders})",
+                chunk
+            )
+            for result in cursor.fetchall():
+                row = {
+                    "id": result[0],
+                    "text": result[1],
+                    "sender": result[2],
+                    "owner": result[3],
+                    "timestamp": result[4],
+                    "importance_score": result[5],
+                    "keywords": set(result[6].split(",")) if result[6] else set(),
+                    "occurrences": result[7]
+                }
+                rows[row["id"]] = row
+                self.row_cache.put(row["id"], row)
+        return rows
 
     def _get_embedding(self, text: str) -> np.ndarray:
         """获取文本的向量嵌入"""
@@ -416,37 +1055,61 @@ class FAISSStorage(BaseStorage):
             # 返回零向量作为后备
             return np.zeros(self.dimension, dtype=np.float32)
 
-    def _update_cache(self, key, value):
-        """更新缓存"""
-        self.cache[key] = value
-        if len(self.cache) > self.cache_size:
-            # 移除最旧的缓存项
-            oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k].get("timestamp", 0))
-            del self.cache[oldest_key]
-
-    def _compute_recency(self, memories):
-        """计算记忆的时效性分数"""
-        current_time = time.time()
-        for memory in memories:
-            age = current_time - memory["timestamp"]
-            memory["recency_score"] = 1.0 / (1.0 + age / 86400)  # 使用一天作为时间单位
-
-    def _normalize_scores(self, memories):
-        """规范化并组合各项分数"""
-        for memory in memories:
-            # 组合相关性、关键词匹配度和时效性
-            memory["total_score"] = (
-                0.5 * memory["relevance"] +
-                0.3 * memory["keyword_score"] +
-                0.2 * memory["recency_score"]
-            )
+    def _get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """批量获取文本的向量嵌入，返回(n, dimension)的float32矩阵"""
+        try:
+            return np.ascontiguousarray(self.embedding.get_embeddings(texts), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"批量获取向量嵌入失败: {str(e)}")
+            return np.zeros((len(texts), self.dimension), dtype=np.float32)
+
+    def cache_stats(self) -> Dict[str, dict]:
+        """获取缓存命中、未命中和淘汰统计"""
+        return {
+            "query_cache": self.query_cache.stats(),
+            "row_cache": self.row_cache.stats(),
+            "tokenizer_cache": self.tokenizer.cache_stats()
+        }
+
+    def _rank_candidates(self, candidates: List[int], rows: Dict[int, dict], fused: Dict[int, float],
+                         query_keywords: frozenset, limit: int) -> List[int]:
+        """
+        向量化计算候选记忆的综合分数
+        相关性为两路归一化分数的加权融合（保留向量相似度和BM25分数的差距），关键词匹配度为命中查询关键词的比例
+        Returns:
+            List[int]: 分数最高的limit个记忆ID，按分数降序
+        """
+        count = len(candidates)
+        relevance = np.fromiter((fused[memory_id] for memory_id in candidates), dtype=np.float64, count=count)
+        timestamps = np.fromiter((rows[memory_id]["timestamp"] or 0 for memory_id in candidates),
+                                 dtype=np.float64, count=count)
+        importance = np.fromiter((rows[memory_id]["importance_score"] or 1 for memory_id in candidates),
+                                 dtype=np.float64, count=count)
+        if query_keywords:
+            keyword = np.fromiter((len(query_keywords & rows[memory_id]["keywords"]) for memory_id in candidates),
+                                  dtype=np.float64, count=count) / len(query_keywords)
+        else:
+            keyword = np.zeros(count)
+        scores = self.scoring_weights.score(relevance, keyword, timestamps, importance)
+        return [candidates[i] for i in top_k_indices(scores, limit)]
 
     def __del__(self):
         """清理资源"""
         try:
-            # 保存最终的索引
-            if hasattr(self, 'index') and self.index is not None:
-                faiss.write_index(self.index, self.index_path)
+            # 停止后台整理和检查点，并合并剩余日志
+            if getattr(self, 'consolidator', None) is not None:
+                self.consolidator.stop()
+            if hasattr(self, 'retention'):
+                self.retention.stop()
+            if hasattr(self, 'checkpointer'):
+                self.checkpointer.stop()
+            if hasattr(self, 'index') and self.index is not None and hasattr(self, 'vector_log'):
+                if self.vector_log.pending_records:
+                    self.checkpoint(rebuild=False)
+                self.vector_log.close()
+            # 同步向量缓存
+            if hasattr(self, 'embedding'):
+                self.embedding.flush_cache()
             # 关闭数据库连接
             if hasattr(self, 'db'):
                 self.db.close()
@@ -499,9 +1162,9 @@ class FAISSStorage(BaseStorage):
             bool: 是否清除成功
         """
         try:
-            # 查询需要删除的向量ID
+            # 查询需要删除的向量ID（与元数据主键一致）
             cursor = self.db.execute(
-                "SELECT vector_id FROM memory_metadata WHERE owner = ?",
+                "SELECT id FROM memory_metadata WHERE owner = ?",
                 (owner,)
             )
             vector_ids = [row[0] for row in cursor.fetchall()]
@@ -511,25 +1174,24 @@ class FAISSStorage(BaseStorage):
                 return True  # 没有记录也算成功
                 
             # 从数据库中删除元数据
-            self.db.execute("DELETE FROM memory_metadata WHERE owner = ?", (owner,))
-            self.db.commit()
-            
-            # 清理缓存
-            keys_to_remove = []
-            for key in self.cache:
-                if isinstance(self.cache[key], dict) and self.cache[key].get("owner") == owner:
-                    keys_to_remove.append(key)
+            with self.db.transaction():
+                self.db.execute("DELETE FROM memory_metadata WHERE owner = ?", (owner,))
             
-            for key in keys_to_remove:
-                del self.cache[key]
+            # 清理缓存：删除的行及可能包含这些行的查询结果
+            for vector_id in vector_ids:
+                self.row_cache.invalidate(vector_id)
+            self.scopes.remove(vector_ids)
+            self.keyword_index.remove(vector_ids)
+            self.query_cache.clear()
                 
             # 如果支持删除向量，则从索引中删除
             try:
-                if hasattr(self.index, 'remove_ids'):
-                    self.index.remove_ids(np.array(vector_ids, dtype=np.int64))
-                    # 保存更新后的索引
-                    faiss.write_index(self.index, self.index_path)
-                    logger.info(f"从索引中移除了 {len(vector_ids)} 条向量")
+                ids = np.array(vector_ids, dtype=np.int64)
+                with self.index_lock:
+                    removed = self.index.remove_ids(ids)
+                    self.vector_log.append_remove(ids)
+                self.checkpointer.notify()
+                logger.info(f"从索引中移除了 {removed} 条向量")
             except Exception as idx_err:
                 # FAISS的某些索引类型不支持移除操作，这是可接受的
                 logger.warning(f"无法从索引中移除向量: {str(idx_err)}")
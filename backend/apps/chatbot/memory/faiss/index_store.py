@@ -0,0 +1,498 @@
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 不支持posix_fadvise的平台上，预读时每次读取的字节数
+PREFETCH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 索引类型：精确平坦索引 → IVF → 压缩的IVF（SQ8/PQ），按规模依次升级
+INDEX_KIND_FLAT = "flat"
+INDEX_KIND_IVF = "ivf"
+INDEX_KIND_IVF_SQ8 = "ivf_sq8"
+INDEX_KIND_IVF_PQ = "ivf_pq"
+INDEX_KIND_RANK = {INDEX_KIND_FLAT: 0, INDEX_KIND_IVF: 1, INDEX_KIND_IVF_SQ8: 2, INDEX_KIND_IVF_PQ: 2}
+
+# FAISS建议每个聚类中心至少有39个训练样本
+MIN_POINTS_PER_CENTROID = 39
+
+
+def read_index_file(path: str, mmap: bool = True) -> Tuple[faiss.Index, bool]:
+    """
+    读取FAISS索引文件
+    优先以内存映射只读方式打开，多个进程可共享同一份系统页缓存；索引类型不支持时退回完整读取
+    :return: (索引, 是否为内存映射)
+    """
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+        except Exception as e:
+            logger.info(f"索引不支持内存映射，完整读取: {path}, {str(e)}")
+    return faiss.read_index(path), False
+
+
+def prefetch_file(path: str, background: bool = True) -> None:
+    """
+    预读文件到系统页缓存，减少内存映射索引首次查询时的缺页开销
+    :param background: 是否在后台线程中执行
+    """
+    def _prefetch():
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                else:
+                    while os.read(fd, PREFETCH_CHUNK_SIZE):
+                        pass
+            finally:
+                os.close(fd)
+            logger.debug(f"索引文件预读完成: {path}")
+        except OSError as e:
+            logger.warning(f"预读索引文件失败: {path}, {str(e)}")
+
+    if background:
+        threading.Thread(target=_prefetch, name="faiss-prefetch", daemon=True).start()
+    else:
+        _prefetch()
+
+
+def index_kind(index: Optional[faiss.Index]) -> str:
+    """根据IndexIDMap2内层索引的类型判断索引种类"""
+    if not isinstance(index, faiss.IndexIDMap2):
+        return INDEX_KIND_FLAT if index is None else type(index).__name__
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return INDEX_KIND_IVF_PQ
+    if isinstance(inner, faiss.IndexIVFScalarQuantizer):
+        return INDEX_KIND_IVF_SQ8
+    if isinstance(inner, faiss.IndexIVF):
+        return INDEX_KIND_IVF
+    return INDEX_KIND_FLAT
+
+
+def extract_vectors(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    取出IndexIDMap2索引中的全部向量和ID（按写入顺序）
+    压缩索引（SQ8/PQ）取出的是解码后的近似向量
+    """
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32), ids
+    inner = faiss.downcast_index(index.index)
+    if not isinstance(inner, faiss.IndexFlat):
+        inner = faiss.extract_index_ivf(index)
+        inner.make_direct_map()
+    return inner.reconstruct_n(0, index.ntotal), ids
+
+
+def remove_from_index(index: faiss.Index, ids: Set[int]) -> faiss.Index:
+    """
+    从IndexIDMap2索引中删除向量，返回删除后的索引
+    平坦索引删除后位置与id_map同步压缩，可直接remove_ids；
+    IVF索引的内部ID是写入时的顺序位置，删除后再写入会产生重复的内部ID，因此改为取出剩余向量重建
+    """
+    remove = np.array(sorted(ids), dtype=np.int64)
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexFlat):
+        index.remove_ids(remove)
+        return index
+
+    vectors, all_ids = extract_vectors(index)
+    keep = ~np.isin(all_ids, remove)
+
+    empty = faiss.clone_index(inner)
+    empty.reset()
+    faiss.extract_index_ivf(empty).set_direct_map_type(faiss.DirectMap.NoMap)
+    rebuilt = faiss.IndexIDMap2(empty)
+    if keep.any():
+        rebuilt.add_with_ids(np.ascontiguousarray(vectors[keep]), all_ids[keep])
+    return rebuilt
+
+
+class IndexPolicy:
+    """
+    索引生命周期策略
+    记忆较少时使用精确的平坦索引；超过ivf_threshold后改用在真实向量样本上训练的IVF索引，
+    超过compressed_threshold后（可选）改用IVF-SQ8或IVF-PQ压缩索引；
+    IVF训练后规模再增长retrain_growth倍时重新训练聚类中心
+    """
+
+    def __init__(self, dimension: int, ivf_threshold: int = 20000, compressed_index_type: str = "none",
+                 compressed_threshold: int = 200000, nprobe: int = 16, retrain_growth: float = 4.0,
+                 train_sample_size: int = 50000, pq_m: int = 0) -> None:
+        """
+        :param compressed_index_type: 压缩索引类型，none/sq8/pq
+        :param pq_m: PQ子量化器个数，0表示自动选择（每个子量化器约8维）
+        """
+        self.dimension = dimension
+        self.ivf_threshold = ivf_threshold
+        self.compressed_index_type = (compressed_index_type or "none").lower()
+        self.compressed_threshold = compressed_threshold
+        self.nprobe = nprobe
+        self.retrain_growth = retrain_growth
+        self.train_sample_size = train_sample_size
+        self.pq_m = pq_m
+
+    @classmethod
+    def from_config(cls, dimension: int, config: dict) -> "IndexPolicy":
+        return cls(
+            dimension,
+            ivf_threshold=int(config.get("ivf_threshold", 20000)),
+            compressed_index_type=str(config.get("compressed_index_type", "none")),
+            compressed_threshold=int(config.get("compressed_threshold", 200000)),
+            nprobe=int(config.get("nprobe", 16)),
+            retrain_growth=float(config.get("retrain_growth", 4.0)),
+            train_sample_size=int(config.get("train_sample_size", 50000)),
+            pq_m=int(config.get("pq_m", 0))
+        )
+
+    def target_kind(self, ntotal: int) -> str:
+        """根据记忆数量确定应使用的索引种类"""
+        if self.compressed_index_type in ("sq8", "pq") and ntotal >= self.compressed_threshold:
+            return INDEX_KIND_IVF_PQ if self.compressed_index_type == "pq" else INDEX_KIND_IVF_SQ8
+        if ntotal >= self.ivf_threshold:
+            return INDEX_KIND_IVF
+        return INDEX_KIND_FLAT
+
+    def needs_rebuild(self, kind: str, trained_size: int, ntotal: int) -> Optional[str]:
+        """
+        判断当前索引是否需要重建
+        :param kind: 当前索引种类
+        :param trained_size: 当前IVF索引训练时的向量数，0表示未知（如旧版使用随机数据训练的索引）
+        :return: 需要重建为的索引种类，无需重建时返回None
+        """
+        target = self.target_kind(ntotal)
+        if target != kind:
+            # 滞回：规模只是略低于阈值时不降级，避免在阈值附近反复重建
+            if kind in INDEX_KIND_RANK and INDEX_KIND_RANK[target] < INDEX_KIND_RANK[kind] and \
+                    ntotal >= self.ivf_threshold // 2:
+                return None
+            return target
+        if kind != INDEX_KIND_FLAT and ntotal >= max(trained_size, 1) * self.retrain_growth:
+            return kind
+        return None
+
+    def nlist_for(self, ntotal: int) -> int:
+        """聚类中心数量约为4*sqrt(n)，并保证每个中心有足够的训练样本"""
+        nlist = int(4 * math.sqrt(max(ntotal, 1)))
+        return max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID, 65536))
+
+    def _pq_m(self) -> int:
+        if self.pq_m > 0:
+            return self.pq_m
+        m = max(1, self.dimension // 8)
+        while self.dimension % m:
+            m -= 1
+        return m
+
+    def build(self, kind: str, train_vectors: np.ndarray, ntotal: int) -> faiss.Index:
+        """
+        创建指定种类的空索引，IVF类索引使用train_vectors训练
+        :param ntotal: 预计写入的向量数，用于确定聚类中心数量
+        """
+        if kind == INDEX_KIND_FLAT or len(train_vectors) == 0:
+            return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+        nlist = self.nlist_for(max(ntotal, len(train_vectors)))
+        nlist = max(1, min(nlist, len(train_vectors)))
+        quantizer = faiss.IndexFlatL2(self.dimension)
+        if kind == INDEX_KIND_IVF_PQ:
+            inner = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, self._pq_m(), 8)
+        elif kind == INDEX_KIND_IVF_SQ8:
+            inner = faiss.IndexIVFScalarQuantizer(quantizer, self.dimension, nlist, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            inner = faiss.IndexIVFFlat(quantizer, self.dimension, nlist)
+        inner.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+        return faiss.IndexIDMap2(inner)
+
+    def sample(self, vectors: np.ndarray) -> np.ndarray:
+        """从向量中随机抽取训练样本"""
+        if len(vectors) <= self.train_sample_size:
+            return vectors
+        rows = np.random.default_rng().choice(len(vectors), self.train_sample_size, replace=False)
+        return vectors[np.sort(rows)]
+
+
+class MemoryScopes:
+    """
+    记忆ID → (所有者, 发送者)的内存映射
+    用于在向量检索时构建ID选择器，只在指定角色/观众的记忆中计算top-k
+    """
+
+    def __init__(self) -> None:
+        self._scopes: Dict[int, Tuple[str, str]] = {}
+        self._by_owner: Dict[str, Set[int]] = defaultdict(set)
+        self._by_owner_sender: Dict[Tuple[str, str], Set[int]] = defaultdict(set)
+        self._by_sender: Dict[str, Set[int]] = defaultdict(set)
+        # 已构建的ID选择器，按(owner, sender)缓存，对应范围的记忆变化时失效
+        self._selectors: Dict[Tuple[Optional[str], Optional[str]], Tuple[faiss.IDSelector, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._scopes)
+
+    def add(self, memory_id: int, owner: str, sender: str) -> None:
+        with self._lock:
+            self._scopes[memory_id] = (owner, sender)
+            self._by_owner[owner].add(memory_id)
+            self._by_sender[sender].add(memory_id)
+            self._by_owner_sender[(owner, sender)].add(memory_id)
+            self._invalidate(owner, sender)
+
+    def remove(self, memory_ids: Iterable[int]) -> None:
+        with self._lock:
+            for memory_id in memory_ids:
+                scope = self._scopes.pop(memory_id, None)
+                if scope is None:
+                    continue
+                owner, sender = scope
+                self._discard(self._by_owner, owner, memory_id)
+                self._discard(self._by_sender, sender, memory_id)
+                self._discard(self._by_owner_sender, scope, memory_id)
+                self._invalidate(owner, sender)
+
+    def get(self, memory_id: int) -> Optional[Tuple[str, str]]:
+        return self._scopes.get(memory_id)
+
+    def ids(self, owner: Optional[str] = None, sender: Optional[str] = None) -> Set[int]:
+        """获取指定范围内的记忆ID"""
+        if owner is not None and sender is not None:
+            return set(self._by_owner_sender.get((owner, sender), ()))
+        if owner is not None:
+            return set(self._by_owner.get(owner, ()))
+        if sender is not None:
+            return set(self._by_sender.get(sender, ()))
+        return set(self._scopes)
+
+    def selector(self, owner: Optional[str] = None, sender: Optional[str] = None) -> Tuple[Optional[faiss.IDSelector], int]:
+        """
+        获取指定范围的ID选择器
+        :return: (选择器, 范围内的记忆数)；未指定范围时选择器为None
+        """
+        if owner is None and sender is None:
+            return None, len(self._scopes)
+        key = (owner, sender)
+        with self._lock:
+            cached = self._selectors.get(key)
+            if cached is None:
+                ids = self.ids(owner, sender)
+                selector = faiss.IDSelectorBatch(np.fromiter(ids, dtype=np.int64, count=len(ids)))
+                cached = (selector, len(ids))
+                self._selectors[key] = cached
+            return cached
+
+    def _invalidate(self, owner: str, sender: str) -> None:
+        for key in ((owner, sender), (owner, None), (None, sender)):
+            self._selectors.pop(key, None)
+
+    @staticmethod
+    def _discard(mapping: dict, key, memory_id: int) -> None:
+        ids = mapping.get(key)
+        if ids is not None:
+            ids.discard(memory_id)
+            if not ids:
+                del mapping[key]
+
+
+class MemoryIndex:
+    """
+    基础索引 + 内存增量索引
+    - 基础索引来自索引文件，可内存映射只读打开，打开后不再原地修改
+    - 新写入的向量进入内存中的增量平坦索引；删除基础索引中的向量时只记录墓碑
+    - 检查点时将基础索引、增量和墓碑合并为新的索引文件，随后重新映射
+    本类不加锁，由调用方（FAISSStorage）使用索引锁保护
+    """
+
+    def __init__(self, dimension: int, use_mmap: bool = True) -> None:
+        self.dimension = dimension
+        self.use_mmap = use_mmap
+        self.base: Optional[faiss.Index] = None
+        self.base_mmapped = False
+        self.base_ids: Set[int] = set()
+        self.delta = self._new_delta()
+        self.tombstones: Set[int] = set()
+        self.nprobe = 16
+        # 检查点写文件期间发生的删除，合并完成后需要在新的基础索引上补记墓碑
+        self._removed_during_checkpoint: Optional[Set[int]] = None
+
+    def _new_delta(self) -> faiss.Index:
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+
+    @property
+    def ntotal(self) -> int:
+        base_total = self.base.ntotal if self.base is not None else 0
+        return base_total - len(self.tombstones) + self.delta.ntotal
+
+    @property
+    def is_id_mapped(self) -> bool:
+        """基础索引是否以元数据主键作为向量ID"""
+        return isinstance(self.base, faiss.IndexIDMap2)
+
+    @property
+    def kind(self) -> str:
+        """基础索引种类：flat/ivf/ivf_sq8/ivf_pq"""
+        return index_kind(self.base)
+
+    def load(self, path: str) -> None:
+        """从索引文件加载基础索引，并清空增量和墓碑"""
+        base, mmapped = read_index_file(path, mmap=self.use_mmap)
+        self._set_base(base, mmapped)
+        self.delta = self._new_delta()
+        self.tombstones = set()
+
+    def reset(self, base: faiss.Index) -> None:
+        """以内存中的索引作为基础索引，并清空增量和墓碑"""
+        self._set_base(base, False)
+        self.delta = self._new_delta()
+        self.tombstones = set()
+
+    def _set_base(self, base: faiss.Index, mmapped: bool) -> None:
+        self.base = base
+        self.base_mmapped = mmapped
+        if isinstance(base, faiss.IndexIDMap2):
+            self.base_ids = set(faiss.vector_to_array(base.id_map).tolist())
+        else:
+            self.base_ids = set()
+
+    def contains(self, vector_id: int) -> bool:
+        if vector_id in self.base_ids:
+            return vector_id not in self.tombstones
+        return self.delta.ntotal > 0 and vector_id in self._delta_ids()
+
+    def id_set(self) -> Set[int]:
+        """索引中全部有效ID的集合（基础索引去掉墓碑，加上增量），批量判断时只构建一次"""
+        ids = self.base_ids - self.tombstones
+        if self.delta.ntotal > 0:
+            ids |= self._delta_ids()
+        return ids
+
+    def _delta_ids(self) -> Set[int]:
+        return set(faiss.vector_to_array(self.delta.id_map).tolist())
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        """写入向量，只进入增量索引"""
+        self.delta.add_with_ids(vectors, ids)
+
+    def remove_ids(self, ids: Iterable[int]) -> int:
+        """删除向量：增量中的直接删除，基础索引中的记为墓碑，返回删除条数"""
+        id_list = [int(vector_id) for vector_id in ids]
+        removed = 0
+        if self.delta.ntotal:
+            removed += self.delta.remove_ids(np.array(id_list, dtype=np.int64))
+        for vector_id in id_list:
+            if vector_id in self.base_ids and vector_id not in self.tombstones:
+                self.tombstones.add(vector_id)
+                removed += 1
+        if self._removed_during_checkpoint is not None:
+            self._removed_during_checkpoint.update(id_list)
+        return removed
+
+    def set_nprobe(self, nprobe: int) -> None:
+        """为IVF类型的基础索引设置nprobe"""
+        self.nprobe = nprobe
+        if self.base is None:
+            return
+        try:
+            ivf_index = faiss.extract_index_ivf(self.base)
+            ivf_index.nprobe = max(1, min(nprobe, ivf_index.nlist))
+        except Exception:
+            # 非IVF索引没有nprobe参数，忽略
+            pass
+
+    def _search_params(self, index: faiss.Index, selector: Optional[faiss.IDSelector]):
+        if selector is None:
+            return None
+        if index_kind(index) != INDEX_KIND_FLAT:
+            # 传入IVF检索参数时会覆盖索引上的nprobe，需要显式设置
+            nlist = faiss.extract_index_ivf(index).nlist
+            return faiss.SearchParametersIVF(sel=selector, nprobe=max(1, min(self.nprobe, nlist)))
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, query: np.ndarray, k: int,
+               selector: Optional[faiss.IDSelector] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        同时检索基础索引和增量索引，过滤墓碑后按距离合并
+        :param selector: ID选择器，只在被选中的向量中计算top-k
+        返回值与faiss.Index.search一致：形状为(nq, k)的距离矩阵和ID矩阵，不足k个时以-1填充
+        """
+        nq = query.shape[0]
+        distances = np.full((nq, k), np.inf, dtype=np.float32)
+        labels = np.full((nq, k), -1, dtype=np.int64)
+        parts = []
+        if self.base is not None and self.base.ntotal:
+            # 多取墓碑数量的候选，保证过滤后仍有k个结果
+            base_k = min(self.base.ntotal, k + len(self.tombstones))
+            parts.append(self.base.search(query, base_k, params=self._search_params(self.base, selector)))
+        if self.delta.ntotal:
+            parts.append(self.delta.search(query, min(k, self.delta.ntotal),
+                                           params=self._search_params(self.delta, selector)))
+        if not parts:
+            return distances, labels
+
+        all_d = np.hstack([part[0] for part in parts])
+        all_i = np.hstack([part[1] for part in parts])
+        valid = all_i != -1
+        if self.tombstones:
+            valid &= ~np.isin(all_i, np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))
+        for row in range(nq):
+            row_d = all_d[row][valid[row]]
+            row_i = all_i[row][valid[row]]
+            order = np.argsort(row_d, kind="stable")[:k]
+            distances[row, :len(order)] = row_d[order]
+            labels[row, :len(order)] = row_i[order]
+        return distances, labels
+
+    def begin_checkpoint(self) -> Tuple[np.ndarray, np.ndarray, Set[int]]:
+        """
+        记录检查点快照：当前增量向量、增量ID和墓碑
+        之后的写入仍进入增量索引，不受合并影响
+        """
+        delta_ids = faiss.vector_to_array(self.delta.id_map).astype(np.int64)
+        if self.delta.ntotal:
+            delta_vectors = self.delta.index.reconstruct_n(0, self.delta.ntotal)
+        else:
+            delta_vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        self._removed_during_checkpoint = set()
+        return delta_ids, delta_vectors, set(self.tombstones)
+
+    def build_merged(self, path: str, snapshot: Tuple[np.ndarray, np.ndarray, Set[int]]) -> faiss.Index:
+        """
+        在锁外生成合并后的完整索引
+        基础索引文件只在检查点时被替换，因此可以重新完整读取一份副本进行修改
+        """
+        delta_ids, delta_vectors, tombstones = snapshot
+        if self.base is None:
+            merged = self._new_delta()
+        elif self.base_mmapped and os.path.exists(path):
+            merged = faiss.read_index(path)
+        else:
+            merged = faiss.clone_index(self.base)
+        if tombstones:
+            merged = remove_from_index(merged, tombstones)
+        if len(delta_ids):
+            merged.add_with_ids(np.ascontiguousarray(delta_vectors, dtype=np.float32), delta_ids)
+        return merged
+
+    def finish_checkpoint(self, path: str, snapshot: Tuple[np.ndarray, np.ndarray, Set[int]]) -> None:
+        """合并后的索引文件已写入：重新打开基础索引，只保留快照之后的增量和墓碑"""
+        delta_ids, _, tombstones = snapshot
+        removed_since = self._removed_during_checkpoint or set()
+        self._removed_during_checkpoint = None
+
+        base, mmapped = read_index_file(path, mmap=self.use_mmap)
+        self._set_base(base, mmapped)
+        if len(delta_ids) and self.delta.ntotal:
+            self.delta.remove_ids(delta_ids)
+        # 快照之后删除的向量若已被写入新的基础索引，需要补记墓碑
+        pending = (self.tombstones - tombstones) | removed_since
+        self.tombstones = {vector_id for vector_id in pending if vector_id in self.base_ids}
+
+    def abort_checkpoint(self) -> None:
+        self._removed_during_checkpoint = None
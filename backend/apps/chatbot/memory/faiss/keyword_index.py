@@ -0,0 +1,124 @@
+import heapq
+import math
+import threading
+from collections import defaultdict
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class KeywordIndex:
+    """
+    记忆关键词倒排索引，使用BM25打分
+    文档为一条记忆，词项为保存时提取的jieba关键词；save/clear时增量维护
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._doc_terms: Dict[int, Dict[str, int]] = {}
+        self._doc_length: Dict[int, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, doc_id: int, keywords: Iterable[str]) -> None:
+        """添加（或替换）一条记忆的关键词"""
+        terms: Dict[str, int] = defaultdict(int)
+        for keyword in keywords:
+            keyword = keyword.strip()
+            if keyword:
+                terms[keyword] += 1
+        with self._lock:
+            self._remove_locked(doc_id)
+            if not terms:
+                return
+            self._doc_terms[doc_id] = dict(terms)
+            self._doc_length[doc_id] = sum(terms.values())
+            self._total_length += self._doc_length[doc_id]
+            for term, tf in terms.items():
+                self._postings[term][doc_id] = tf
+
+    def remove(self, doc_ids: Iterable[int]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id: int) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_length.pop(doc_id)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, terms: Iterable[str], k: int,
+               predicate: Optional[Callable[[int], bool]] = None) -> List[Tuple[int, float]]:
+        """
+        按BM25分数检索
+        :param terms: 查询关键词
+        :param k: 返回条数
+        :param predicate: 记忆过滤条件（如所有者/发送者范围），返回False的记忆不参与排序
+        :return: 按分数降序排列的(记忆ID, 分数)列表
+        """
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if doc_count == 0 or k <= 0:
+                return []
+            avg_length = self._total_length / doc_count
+            scores: Dict[int, float] = defaultdict(float)
+            for term in set(terms):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    if predicate is not None and not predicate(doc_id):
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_length[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[int]], k: int = 60) -> Dict[int, float]:
+    """
+    倒数排名融合：score(d) = Σ 1 / (k + rank(d))，rank从1开始
+    :param rankings: 多路检索结果，每路为按相关度降序排列的ID列表
+    :return: ID → 融合分数
+    """
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return fused
+
+
+def normalize_by_max(scores: Dict[int, float]) -> Dict[int, float]:
+    """按最高分归一化到[0, 1]，用于分数没有上限的BM25"""
+    top = max(scores.values(), default=0.0)
+    if top <= 0:
+        return {}
+    return {doc_id: score / top for doc_id, score in scores.items()}
+
+
+def weighted_score_fusion(channels: Iterable[Tuple[Dict[int, float], float]]) -> Dict[int, float]:
+    """
+    按归一化分数加权融合：score(d) = Σ w · s(d) / Σ w，s为该路归一化到[0, 1]的分数，只计有结果的通道
+    与只看排名的RRF不同，保留了各路分数的差距，BM25远高于其余候选的记忆不会被排名相近的弱匹配挤掉
+    :param channels: 每路为(ID → 归一化分数, 通道权重)
+    :return: ID → 融合分数，范围[0, 1]
+    """
+    channels = [(scores, weight) for scores, weight in channels if scores and weight > 0]
+    total_weight = sum(weight for _, weight in channels)
+    fused: Dict[int, float] = defaultdict(float)
+    for scores, weight in channels:
+        for doc_id, score in scores.items():
+            fused[doc_id] += weight * score / total_weight
+    return fused
@@ -0,0 +1,201 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 等待其他连接释放写锁的最长时间（毫秒）
+BUSY_TIMEOUT_MS = 5000
+# 每个连接缓存的预编译语句数
+CACHED_STATEMENTS = 256
+
+
+class ThreadSafeSQLite:
+    """
+    线程安全的SQLite连接管理器
+    每个线程一个连接，连接打开时启用WAL日志、busy_timeout和synchronous=NORMAL；
+    每次execute使用新游标，预编译语句由连接的语句缓存复用
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _get_conn(self):
+        if not hasattr(self._local, 'conn'):
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000,
+                                   cached_statements=CACHED_STATEMENTS)
+            conn.row_factory = sqlite3.Row
+            # WAL模式下读写互不阻塞，NORMAL同步级别只在检查点时落盘
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return self._local.conn
+
+    def execute(self, sql, params=None):
+        if params:
+            return self._get_conn().execute(sql, params)
+        return self._get_conn().execute(sql)
+
+    def executemany(self, sql, seq_of_params):
+        return self._get_conn().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._get_conn().commit()
+
+    def rollback(self):
+        self._get_conn().rollback()
+
+    @contextmanager
+    def transaction(self):
+        """在一个事务中执行多条语句，成功时统一提交，异常时回滚"""
+        try:
+            yield self
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+
+    @contextmanager
+    def read_snapshot(self):
+        """
+        在独立连接上开启只读事务，事务内的查询看到同一时间点的数据
+        WAL模式下读事务不阻塞写入；快照在事务内第一条查询时确定
+        """
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            try:
+                conn.execute("ROLLBACK")
+            finally:
+                conn.close()
+
+    def close(self):
+        if hasattr(self._local, 'conn'):
+            self._local.conn.close()
+            delattr(self._local, 'conn')
+
+
+def _create_metadata_table(db: ThreadSafeSQLite) -> None:
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS memory_metadata (
+            id INTEGER PRIMARY KEY,
+            text TEXT,
+            sender TEXT,
+            owner TEXT,
+            timestamp REAL,
+            importance_score INTEGER,
+            vector_id INTEGER UNIQUE,
+            keywords TEXT  -- 存储关键词
+        )
+    ''')
+
+
+def _create_query_indexes(db: ThreadSafeSQLite) -> None:
+    # pageQuery按所有者分页、clear按所有者删除、按发送者过滤
+    db.execute("CREATE INDEX IF NOT EXISTS idx_memory_owner_timestamp ON memory_metadata (owner, timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_memory_sender ON memory_metadata (sender)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_memory_timestamp ON memory_metadata (timestamp)")
+
+
+def _create_owner_counters(db: ThreadSafeSQLite) -> None:
+    # 按所有者维护记录数，由触发器随插入/删除更新，替代COUNT(*)全表扫描
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS memory_owner_counts (
+            owner TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_memory_count_insert AFTER INSERT ON memory_metadata
+        BEGIN
+            INSERT OR IGNORE INTO memory_owner_counts (owner, count) VALUES (IFNULL(NEW.owner, ''), 0);
+            UPDATE memory_owner_counts SET count = count + 1 WHERE owner = IFNULL(NEW.owner, '');
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_memory_count_delete AFTER DELETE ON memory_metadata
+        BEGIN
+            UPDATE memory_owner_counts SET count = count - 1 WHERE owner = IFNULL(OLD.owner, '');
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_memory_count_update AFTER UPDATE OF owner ON memory_metadata
+        WHEN IFNULL(OLD.owner, '') != IFNULL(NEW.owner, '')
+        BEGIN
+            UPDATE memory_owner_counts SET count = count - 1 WHERE owner = IFNULL(OLD.owner, '');
+            INSERT OR IGNORE INTO memory_owner_counts (owner, count) VALUES (IFNULL(NEW.owner, ''), 0);
+            UPDATE memory_owner_counts SET count = count + 1 WHERE owner = IFNULL(NEW.owner, '');
+        END
+    ''')
+    # 升级时根据已有数据初始化计数
+    db.execute("DELETE FROM memory_owner_counts")
+    db.execute('''
+        INSERT INTO memory_owner_counts (owner, count)
+        SELECT IFNULL(owner, ''), COUNT(*) FROM memory_metadata GROUP BY IFNULL(owner, '')
+    ''')
+
+
+def _add_column(db: ThreadSafeSQLite, table: str, column: str, definition: str) -> None:
+    """添加列，列已存在时跳过（旧版本迁移中途失败、列已部分添加的数据库）"""
+    columns = {row[1] for row in db.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _add_occurrences_column(db: ThreadSafeSQLite) -> None:
+    # 近似重复的记忆合并后，记录合并进来的条数
+    _add_column(db, "memory_metadata", "occurrences", "INTEGER NOT NULL DEFAULT 1")
+
+
+def _add_access_columns(db: ThreadSafeSQLite) -> None:
+    # 记忆被检索命中的次数和最后一次命中的时间，用于容量淘汰
+    _add_column(db, "memory_metadata", "access_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(db, "memory_metadata", "last_access", "REAL")
+
+
+# 元数据库结构迁移，下标+1即为迁移后的版本号（记录在PRAGMA user_version中），只能追加不能修改
+SCHEMA_MIGRATIONS: List[Callable[[ThreadSafeSQLite], None]] = [
+    _create_metadata_table,
+    _create_query_indexes,
+    _create_owner_counters,
+    _add_occurrences_column,
+    _add_access_columns,
+]
+
+
+def migrate_schema(db: ThreadSafeSQLite) -> int:
+    """
+    将元数据库升级到最新结构，每个版本的迁移连同版本号更新在独立事务中执行
+    sqlite3模块不会在DDL前隐式开启事务，因此显式BEGIN，迁移失败时整个版本回滚，下次启动重新执行
+    :return: 升级后的版本号
+    """
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        db.commit()
+        with db.transaction():
+            db.execute("BEGIN")
+            migration(db)
+            db.execute(f"PRAGMA user_version = {target}")
+        logger.info(f"元数据库结构已升级到版本 {target}")
+    return max(version, len(SCHEMA_MIGRATIONS))
+
+
+def count_memories(db: ThreadSafeSQLite, owner: Optional[str] = None) -> int:
+    """获取记忆条数（读取维护的计数器）"""
+    if owner is None:
+        row = db.execute("SELECT IFNULL(SUM(count), 0) FROM memory_owner_counts").fetchone()
+    else:
+        row = db.execute("SELECT count FROM memory_owner_counts WHERE owner = ?", (owner,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def owner_counts(db: ThreadSafeSQLite) -> Dict[str, int]:
+    """获取每个所有者的记忆条数"""
+    cursor = db.execute("SELECT owner, count FROM memory_owner_counts WHERE count > 0 ORDER BY owner")
+    return {row[0]: int(row[1]) for row in cursor.fetchall()}
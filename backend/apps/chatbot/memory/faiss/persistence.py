@@ -0,0 +1,259 @@
+import glob
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 日志记录头：操作类型(1字节) + 记录条数(uint32) + 负载CRC32(uint32)
+RECORD_HEADER = struct.Struct("<cII")
+OP_ADD = b"A"
+OP_REMOVE = b"D"
+SEGMENT_PATTERN = re.compile(r"segment_(\d{8})\.log$")
+# 落盘方式：group为组提交（累计一定条数或时间后统一fsync，切换段和关闭时必定fsync），always为每次追加都fsync
+FSYNC_GROUP = "group"
+FSYNC_ALWAYS = "always"
+# 组提交的条数和时间阈值，达到任一即fsync
+GROUP_COMMIT_RECORDS = 256
+GROUP_COMMIT_INTERVAL = 0.1
+
+
+def write_file_atomic(path: str, data) -> None:
+    """先写临时文件并落盘，再通过rename原子替换目标文件"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class VectorLog:
+    """
+    追加写的向量日志（预写日志），按段文件存储
+    每次save只需在当前段末尾追加一条记录，检查点时切换到新段，
+    已合并进索引文件的旧段随后被删除；启动时重放剩余段即可恢复未合并的写入
+    默认组提交：追加只写入操作系统缓冲，累计group_records条或距首条未落盘记录group_interval秒后统一fsync，
+    崩溃时最多丢失这一窗口内的写入；fsync="always"时每次追加都fsync
+    """
+
+    def __init__(self, log_dir: str, dimension: int, fsync: str = FSYNC_GROUP,
+                 group_records: int = GROUP_COMMIT_RECORDS, group_interval: float = GROUP_COMMIT_INTERVAL) -> None:
+        self.log_dir = log_dir
+        self.dimension = dimension
+        self.fsync = fsync
+        self.group_records = max(1, int(group_records))
+        self.group_interval = max(0.0, float(group_interval))
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+        # 已写入但尚未fsync的记录数
+        self._unsynced = 0
+        # 最近一次rotate时封存的(记录数, 字节数)，检查点成功后扣除
+        self._sealed_counts = (0, 0)
+        self._dirty = threading.Event()
+        self._closed = threading.Event()
+
+        segments = self._list_segments()
+        self._seq = segments[-1][0] + 1 if segments else 1
+        self._file = open(self._segment_path(self._seq), "ab")
+        # 自上次检查点以来写入的记录数和字节数
+        self.pending_records = 0
+        self.pending_bytes = 0
+        for _, path in segments:
+            self.pending_bytes += os.path.getsize(path)
+        self.pending_records = 1 if self.pending_bytes else 0
+
+        # 组提交的定时落盘线程，保证最后一批写入在group_interval秒内落盘
+        self._syncer = None
+        if self.fsync != FSYNC_ALWAYS:
+            self._syncer = threading.Thread(target=self._run_syncer, name="faiss-wal-sync", daemon=True)
+            self._syncer.start()
+
+    def append_add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """记录向量写入"""
+        payload = np.ascontiguousarray(ids, dtype=np.int64).tobytes() + \
+            np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+        self._append(OP_ADD, len(ids), payload)
+
+    def append_remove(self, ids: np.ndarray) -> None:
+        """记录向量删除"""
+        payload = np.ascontiguousarray(ids, dtype=np.int64).tobytes()
+        self._append(OP_REMOVE, len(ids), payload)
+
+    def _append(self, op: bytes, count: int, payload: bytes) -> None:
+        record = RECORD_HEADER.pack(op, count, zlib.crc32(payload)) + payload
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            self.pending_records += count
+            self.pending_bytes += len(record)
+            self._unsynced += count
+            if self.fsync == FSYNC_ALWAYS or self._unsynced >= self.group_records:
+                self._sync_locked()
+            else:
+                self._dirty.set()
+
+    def sync(self) -> None:
+        """将已写入的记录落盘"""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        if self._unsynced and not self._file.closed:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._dirty.clear()
+
+    def rotate(self) -> int:
+        """
+        落盘并封存当前段，开启新段
+        未合并计数不在此重置，检查点成功后由mark_checkpointed扣除，失败时计数保留，检查点线程会继续重试
+        :return: 已封存的最大段序号，检查点完成后可删除不大于该序号的段
+        """
+        with self._lock:
+            self._sync_locked()
+            sealed = self._seq
+            self._file.close()
+            self._seq += 1
+            self._file = open(self._segment_path(self._seq), "ab")
+            self._sealed_counts = (self.pending_records, self.pending_bytes)
+            return sealed
+
+    def mark_checkpointed(self) -> None:
+        """检查点成功后调用，扣除最近一次rotate时已封存的记录数和字节数"""
+        with self._lock:
+            records, size = self._sealed_counts
+            self._sealed_counts = (0, 0)
+            self.pending_records = max(0, self.pending_records - records)
+            self.pending_bytes = max(0, self.pending_bytes - size)
+
+    def purge(self, upto_seq: int) -> None:
+        """删除不大于指定序号的段文件"""
+        for seq, path in self._list_segments():
+            if seq <= upto_seq:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"删除向量日志段失败: {path}, {str(e)}")
+
+    def replay(self) -> Iterator[Tuple[bytes, np.ndarray, Optional[np.ndarray]]]:
+        """
+        按写入顺序读取全部日志记录
+        遇到不完整或校验失败的记录（崩溃时的半截写入）即停止读取该段
+        :return: (操作类型, ID数组, 向量矩阵或None)
+        """
+        for seq, path in self._list_segments():
+            with open(path, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                op, count, crc = RECORD_HEADER.unpack_from(data, offset)
+                size = count * 8 + (count * self.dimension * 4 if op == OP_ADD else 0)
+                start = offset + RECORD_HEADER.size
+                payload = data[start:start + size]
+                if len(payload) < size or zlib.crc32(payload) != crc or op not in (OP_ADD, OP_REMOVE):
+                    logger.warning(f"向量日志段 {path} 在偏移 {offset} 处损坏，忽略其后的记录")
+                    break
+                ids = np.frombuffer(payload[:count * 8], dtype=np.int64)
+                vectors = None
+                if op == OP_ADD:
+                    vectors = np.frombuffer(payload[count * 8:], dtype=np.float32).reshape(count, self.dimension)
+                yield op, ids, vectors
+                offset = start + size
+
+    def reset(self) -> None:
+        """删除全部日志段（索引已从其他来源完整重建时使用）"""
+        sealed = self.rotate()
+        self.purge(sealed)
+        self.mark_checkpointed()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._dirty.set()
+        with self._lock:
+            if not self._file.closed:
+                self._sync_locked()
+                self._file.close()
+
+    def _run_syncer(self) -> None:
+        while not self._closed.is_set():
+            self._dirty.wait()
+            if self._closed.wait(self.group_interval):
+                break
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                logger.error(f"向量日志落盘失败: {str(e)}")
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.log_dir, f"segment_{seq:08d}.log")
+
+    def _list_segments(self) -> List[Tuple[int, str]]:
+        segments = []
+        for path in glob.glob(os.path.join(self.log_dir, "segment_*.log")):
+            match = SEGMENT_PATTERN.search(path)
+            if match:
+                segments.append((int(match.group(1)), path))
+        return sorted(segments)
+
+
+class IndexCheckpointer:
+    """
+    后台检查点线程
+    当未合并的日志记录数或字节数超过阈值，或距上次检查点超过时间间隔时，调用checkpoint将日志合并进索引文件
+    """
+
+    def __init__(self, vector_log: VectorLog, checkpoint: Callable[[], bool], max_records: int = 1000,
+                 max_bytes: int = 32 * 1024 * 1024, interval: float = 300.0) -> None:
+        self.vector_log = vector_log
+        self.checkpoint = checkpoint
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._requested = False
+        self._last_checkpoint = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="faiss-checkpointer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def notify(self) -> None:
+        """写入后调用，达到阈值时唤醒后台线程"""
+        if self.vector_log.pending_records >= self.max_records or self.vector_log.pending_bytes >= self.max_bytes:
+            self._wakeup.set()
+
+    def request(self) -> None:
+        """请求尽快执行一次检查点（即使没有未合并的日志，如需要重建索引时）"""
+        self._requested = True
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=min(self.interval, 10.0))
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            due = time.monotonic() - self._last_checkpoint >= self.interval
+            over = self.vector_log.pending_records >= self.max_records or \
+                self.vector_log.pending_bytes >= self.max_bytes
+            requested, self._requested = self._requested, False
+            if not requested and (self.vector_log.pending_records == 0 or not (due or over)):
+                continue
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logger.error(f"后台检查点失败: {str(e)}")
+            self._last_checkpoint = time.monotonic()
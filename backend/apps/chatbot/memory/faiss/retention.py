@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+from .scoring import MAX_IMPORTANCE_SCORE
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+
+class RetentionPolicy:
+    """
+    记忆保留策略
+    每个所有者最多保留max_per_owner条记忆，超出时淘汰保留分数最低的记忆；
+    保留分数综合时效性（自最后一次保存或被检索起按半衰期衰减）、重要性和访问频次
+    """
+
+    def __init__(self, max_per_owner: int = 50000, half_life_days: float = 7.0, batch_size: int = 1000,
+                 recency_weight: float = 0.4, importance_weight: float = 0.3,
+                 frequency_weight: float = 0.3) -> None:
+        """
+        :param max_per_owner: 每个所有者的记忆上限，0表示不限制
+        :param batch_size: 每个所有者每轮最多淘汰的条数，超出部分在后续轮次中逐步淘汰
+        """
+        self.max_per_owner = max_per_owner
+        self.half_life = half_life_days * SECONDS_PER_DAY
+        self.batch_size = batch_size
+        self.recency_weight = recency_weight
+        self.importance_weight = importance_weight
+        self.frequency_weight = frequency_weight
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RetentionPolicy":
+        return cls(
+            max_per_owner=int(config.get("max_memories_per_owner", 50000)),
+            half_life_days=float(config.get("retention_half_life_days", 7.0)),
+            batch_size=int(config.get("eviction_batch_size", 1000))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_per_owner > 0
+
+    def excess(self, count: int) -> int:
+        """本轮应淘汰的条数"""
+        if not self.enabled:
+            return 0
+        return min(max(0, count - self.max_per_owner), self.batch_size)
+
+    def scores(self, timestamps: np.ndarray, last_access: np.ndarray, importance: np.ndarray,
+               accesses: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+        """
+        计算保留分数，分数越低越先被淘汰
+        :param timestamps: 保存时间（秒）
+        :param last_access: 最后一次被检索的时间（秒），从未被检索为0
+        :param importance: 重要性评分，1~10
+        :param accesses: 被检索次数与合并次数之和
+        """
+        now = time.time() if now is None else now
+        ages = np.maximum(now - np.maximum(timestamps, last_access), 0.0)
+        recency = np.power(0.5, ages / self.half_life)
+        importance = np.clip(importance, 0, MAX_IMPORTANCE_SCORE) / MAX_IMPORTANCE_SCORE
+        frequency = 1.0 - 1.0 / (1.0 + np.maximum(accesses, 0))
+        return (self.recency_weight * recency +
+                self.importance_weight * importance +
+                self.frequency_weight * frequency)
+
+    def select_victims(self, scores: np.ndarray, count: int) -> np.ndarray:
+        """取保留分数最低的count个下标"""
+        if count <= 0 or len(scores) == 0:
+            return np.empty(0, dtype=np.int64)
+        if count >= len(scores):
+            return np.arange(len(scores))
+        return np.argpartition(scores, count - 1)[:count]
+
+
+class MemoryRetention:
+    """
+    后台记忆保留线程
+    检索命中的记忆只在内存中计数，每轮先批量写回访问次数，再调用enforce淘汰超出容量的记忆
+    """
+
+    def __init__(self, enforce: Callable[[Dict[int, int]], int], interval: float = 300.0) -> None:
+        """
+        :param enforce: 写回访问计数并执行一轮淘汰，返回淘汰条数
+        """
+        self.enforce = enforce
+        self.interval = interval
+        self._access: Counter = Counter()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="faiss-retention", daemon=True)
+        self.evicted_total = 0
+        self.runs = 0
+        self.last_run: Optional[float] = None
+        self.last_evicted = 0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def record_access(self, ids: Iterable[int]) -> None:
+        """记录检索命中的记忆"""
+        with self._lock:
+            self._access.update(ids)
+
+    def drain_access(self) -> Dict[int, int]:
+        """取出并清空尚未写回的访问计数"""
+        with self._lock:
+            access, self._access = self._access, Counter()
+        return dict(access)
+
+    def request(self) -> None:
+        """请求尽快执行一轮淘汰"""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._access)
+        return {
+            "evicted_total": self.evicted_total,
+            "last_evicted": self.last_evicted,
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "pending_access": pending
+        }
+
+    def run_once(self) -> int:
+        evicted = self.enforce(self.drain_access())
+        self.evicted_total += evicted
+        self.last_evicted = evicted
+        self.runs += 1
+        self.last_run = time.time()
+        return evicted
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"后台记忆淘汰失败: {str(e)}")
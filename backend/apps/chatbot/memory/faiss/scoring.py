@@ -0,0 +1,62 @@
+import time
+from typing import Optional
+
+import numpy as np
+
+# 时效性分数的时间单位（秒），记忆每过一个单位分数衰减为 1 / (1 + 天数)
+RECENCY_UNIT_SECONDS = 86400
+# 重要性评分（MemoryImportance）的取值上限
+MAX_IMPORTANCE_SCORE = 10
+
+
+class ScoringWeights:
+    """
+    记忆检索的综合评分
+    各项分数以NumPy数组批量计算，候选数量增加时只增加数组长度，不增加Python层的逐条运算
+    """
+
+    def __init__(self, relevance: float = 0.4, keyword: float = 0.25, recency: float = 0.2,
+                 importance: float = 0.15) -> None:
+        self.relevance = relevance
+        self.keyword = keyword
+        self.recency = recency
+        self.importance = importance
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ScoringWeights":
+        return cls(
+            relevance=float(config.get("relevance_weight", 0.4)),
+            keyword=float(config.get("keyword_weight", 0.25)),
+            recency=float(config.get("recency_weight", 0.2)),
+            importance=float(config.get("importance_weight", 0.15))
+        )
+
+    def score(self, relevance: np.ndarray, keyword: np.ndarray, timestamps: np.ndarray,
+              importance: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+        """
+        计算综合分数
+        :param relevance: 相关性分数，范围[0, 1]
+        :param keyword: 关键词匹配度，范围[0, 1]
+        :param timestamps: 记忆保存时间（秒）
+        :param importance: 重要性评分，1~10
+        :return: 与输入等长的综合分数数组
+        """
+        now = time.time() if now is None else now
+        ages = np.maximum(now - timestamps, 0.0)
+        recency = 1.0 / (1.0 + ages / RECENCY_UNIT_SECONDS)
+        importance = np.clip(importance, 0, MAX_IMPORTANCE_SCORE) / MAX_IMPORTANCE_SCORE
+        return (self.relevance * np.clip(relevance, 0.0, 1.0) +
+                self.keyword * keyword +
+                self.recency * recency +
+                self.importance * importance)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """取分数最高的k个下标并按分数降序排列，使用argpartition避免对全部候选排序"""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
@@ -1,19 +1,29 @@
 import datetime
 import logging
-import jieba
-import jieba.analyse
+import threading
+from typing import Any, Dict, List
+
 import json
+from django.db import transaction
 from django.db.models import Q
 from ..base_storage import BaseStorage
 from ...models import LocalMemoryModel
+from ...utils.tokenizer_utils import get_tokenizer
 
 # TODO 搜索方式待整改
 logger = logging.getLogger(__name__)
 
+# 快照中短期记忆表的列
+SNAPSHOT_COLUMNS = ("text", "tags", "sender", "owner", "timestamp")
+
 
 class LocalStorage(BaseStorage):
+    # 主键使用毫秒时间戳，同一毫秒内的多条记录顺延，保证批量写入时主键不冲突
+    _id_lock = threading.Lock()
+    _last_id = 0
 
     def __init__(self, memory_storage_config: dict[str, str]):
+        self.tokenizer = get_tokenizer()
         logger.info("=> Load LocalStorage Success")
 
     def search(self, query_text: str, limit: int = 10, sender: str = None, owner: str = None) -> list[str]:
@@ -74,6 +84,14 @@ class LocalStorage(BaseStorage):
         results.reverse()
         return results
 
+    def recent(self, owner: str, sender: str, limit: int) -> list[str]:
+        """获取指定所有者与发送者之间最近limit条记忆（从旧到新）"""
+        results = LocalMemoryModel.objects.filter(owner=owner, sender=sender).order_by('-timestamp', '-id').values_list(
+            'text', flat=True)[:limit]
+        results = list(results)
+        results.reverse()
+        return results
+
     def save(self, text: str, sender: str, owner: str, importance_score: int = 1) -> bool:
         """
         保存记忆
@@ -87,25 +105,13 @@ class LocalStorage(BaseStorage):
         """
         try:
             # 生成唯一ID
-            pk = int(datetime.datetime.now().timestamp() * 1000)
-            
-            # 分词处理
-            query_words = jieba.cut(text, cut_all=False)
-            query_tags = list(query_words)
-            keywords = jieba.analyse.extract_tags(" ".join(query_tags), topK=20)
+            pk = self._allocate_ids(1)[0]
             
             # 获取当前时间戳
             current_timestamp = datetime.datetime.now().isoformat()
             
             # 创建并保存记录
-            local_memory_model = LocalMemoryModel(
-                id=pk,
-                text=text,
-                tags=",".join(keywords),  # 设置标签
-                sender=sender,
-                owner=owner,
-                timestamp=current_timestamp
-            )
+            local_memory_model = self._build_model(pk, text, sender, owner, current_timestamp)
             local_memory_model.save()
             
             logger.debug(f"成功保存本地记忆: id={pk}, sender={sender}, owner={owner}")
@@ -115,6 +121,106 @@ class LocalStorage(BaseStorage):
             logger.error(f"保存本地记忆失败: {str(e)}")
             return False
 
+    def save_many(self, memories: List[Dict[str, Any]]) -> int:
+        """
+        批量保存记忆，所有记录通过一次bulk_create写入
+        Args:
+            memories: 记忆列表，每项包含text、sender、owner，可选importance_score
+        Returns:
+            int: 保存成功的条数
+        """
+        memories = [memory for memory in memories if memory.get("text")]
+        if not memories:
+            return 0
+        try:
+            pks = self._allocate_ids(len(memories))
+            current_timestamp = datetime.datetime.now().isoformat()
+            # 调用方已分词的记忆直接使用其关键词，其余文本批量分词
+            self.tokenizer.analyze_many([memory["text"] for memory in memories if memory.get("keywords") is None])
+            records = [
+                self._build_model(pk, memory["text"], memory.get("sender"), memory.get("owner"), current_timestamp,
+                                  keywords=memory.get("keywords"))
+                for pk, memory in zip(pks, memories)
+            ]
+            LocalMemoryModel.objects.bulk_create(records)
+            logger.debug(f"成功批量保存本地记忆: {len(records)} 条")
+            return len(records)
+        except Exception as e:
+            logger.error(f"批量保存本地记忆失败: {str(e)}")
+            return 0
+
+    def _build_model(self, pk: int, text: str, sender: str, owner: str, timestamp: str,
+                     keywords: List[str] = None) -> LocalMemoryModel:
+        # 分词处理（共享分词服务，最近处理过的文本不再重复分词）
+        if keywords is None:
+            keywords = self.tokenizer.keywords(text)
+        return LocalMemoryModel(
+            id=pk,
+            text=text,
+            tags=",".join(keywords),  # 设置标签
+            sender=sender,
+            owner=owner,
+            timestamp=timestamp
+        )
+
+    @classmethod
+    def _allocate_ids(cls, count: int) -> List[int]:
+        """分配连续的主键"""
+        with cls._id_lock:
+            start = max(int(datetime.datetime.now().timestamp() * 1000), cls._last_id + 1)
+            cls._last_id = start + count - 1
+            return list(range(start, start + count))
+
+    def count(self, owner: str = None) -> int:
+        """获取记忆条数"""
+        query = LocalMemoryModel.objects.all()
+        if owner:
+            query = query.filter(owner=owner)
+        return query.count()
+
+    def export_snapshot(self, writer) -> int:
+        """
+        导出短期记忆表local_memory，在一个事务内读取保证时间点一致
+        Args:
+            writer: 快照写入器（memory.snapshot.SnapshotWriter）
+        Returns:
+            int: 导出的记录数
+        """
+        with transaction.atomic():
+            rows = LocalMemoryModel.objects.order_by('id').values_list(*SNAPSHOT_COLUMNS).iterator(chunk_size=2000)
+            count = writer.write_table("local_memory", SNAPSHOT_COLUMNS, (
+                (text, tags, sender, owner, timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp)
+                for text, tags, sender, owner, timestamp in rows
+            ))
+        logger.info(f"短期记忆快照导出完成: {count} 条")
+        return count
+
+    def import_snapshot(self, reader, replace: bool = False, chunk_size: int = 2000) -> int:
+        """
+        从快照分块导入短期记忆，每块通过一次bulk_create写入，主键重新分配
+        Args:
+            reader: 快照读取器（memory.snapshot.SnapshotReader）
+            replace: 是否先删除现有的全部短期记忆
+        Returns:
+            int: 导入的记录数
+        """
+        if reader.section("local_memory") is None:
+            logger.warning("快照中没有短期记忆")
+            return 0
+        if replace:
+            LocalMemoryModel.objects.all().delete()
+        loaded = 0
+        for records in reader.read_table("local_memory", chunk_size):
+            pks = self._allocate_ids(len(records))
+            LocalMemoryModel.objects.bulk_create([
+                LocalMemoryModel(id=pk, text=record["text"], tags=record["tags"], sender=record["sender"],
+                                 owner=record["owner"], timestamp=record["timestamp"])
+                for pk, record in zip(pks, records)
+            ])
+            loaded += len(records)
+        logger.info(f"短期记忆快照导入完成: {loaded} 条")
+        return loaded
+
     def clear(self, owner: str) -> bool:
         """
         清空指定所有者的记忆
@@ -1,6 +1,8 @@
+import atexit
 import json
 import logging
 import traceback
+import weakref
 from typing import Any, Dict, List
 
 # 使用接口模块中的接口
@@ -8,27 +10,51 @@ from ..config.interfaces import SysConfigInterface
 
 from .faiss.faiss_storage_impl import FAISSStorage
 from .local.local_storage_impl import LocalStorage
-from ..utils.snowflake_utils import SnowFlake
+from .short_term_memory import ShortTermMemory
+from .snapshot import import_snapshot
+from .summary_pipeline import (BATCH_SUMMARY_PROMPT, SUMMARY_BATCH_SIZE, SUMMARY_DEADLINE, SUMMARY_MAX_WAIT,
+                               SummaryPipeline)
+from ..utils.snowflake_utils import SnowFlake, WorkerIdConflictError, get_snow_flake
+from ..utils.tokenizer_utils import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
 
+# 尚未关闭的记忆驱动，进程退出时统一关闭，避免待写入的对话丢失
+_open_drivers: "weakref.WeakSet[MemoryStorageDriver]" = weakref.WeakSet()
+
+
+def _close_open_drivers() -> None:
+    for driver in list(_open_drivers):
+        driver.close()
+
+
+atexit.register(_close_open_drivers)
+
+
 class MemoryStorageDriver:
     sys_config: SysConfigInterface  # 使用接口定义
     short_memory_storage: LocalStorage
     long_memory_storage: FAISSStorage
-    snow_flake: SnowFlake = SnowFlake(data_center_id=5, worker_id=5)
+    snow_flake: SnowFlake
 
     def __init__(self, memory_storage_config: dict[str, str], sys_config: SysConfigInterface) -> None:
         # 使用接口类型
         self.sys_config = sys_config
+        self._closed = False
         
-        # 初始化雪花ID生成器
-        self.snow_flake = SnowFlake(data_center_id=5, worker_id=5)
+        # 初始化雪花ID生成器，机器编号按配置或自动占用空闲编号，编号被其他进程占用时拒绝启动
+        self.snow_flake = get_snow_flake(data_center_id=5,
+                                         worker_id=int(memory_storage_config.get("id_worker_id", -1)))
+
+        # 共享分词服务：每轮对话只分词一次，短期记忆标签和长期记忆关键词复用同一结果
+        self.tokenizer = get_tokenizer()
         
-        # 初始化短期记忆存储
+        # 初始化短期记忆存储，最近对话由内存中的窗口提供，异步写入数据库
+        self.short_term_memory = None
         try:
             self.short_memory_storage = LocalStorage(memory_storage_config)
+            self.short_term_memory = ShortTermMemory(self.short_memory_storage)
             logger.info("短期记忆存储初始化成功")
         except Exception as short_err:
             logger.error(f"短期记忆存储初始化失败: {str(short_err)}")
@@ -37,6 +63,7 @@ class MemoryStorageDriver:
             self.short_memory_storage = SimpleNamespace()
             self.short_memory_storage.pageQuery = lambda *args, **kwargs: []
             self.short_memory_storage.save = lambda *args, **kwargs: False
+            self.short_memory_storage.save_many = lambda *args, **kwargs: 0
             self.short_memory_storage.clear = lambda *args, **kwargs: False
         
         # 长期记忆存储初始化
@@ -45,6 +72,8 @@ class MemoryStorageDriver:
             try:
                 self.long_memory_storage = FAISSStorage(memory_storage_config)
                 logger.info("长期记忆存储初始化成功")
+            except WorkerIdConflictError:
+                raise
             except Exception as e:
                 logger.error(f"长期记忆存储初始化失败: {str(e)}")
                 stack_trace = traceback.format_exc()
@@ -53,9 +82,39 @@ class MemoryStorageDriver:
                 sys_config.enable_longMemory = False
                 logger.warning("由于初始化失败，长期记忆功能已禁用")
 
+        # 批量摘要流水线：开启摘要时，对话按角色积累后一次LLM调用生成整批摘要，再批量写入长期记忆
+        self.summary_pipeline = None
+        if self.long_memory_storage is not None:
+            self.summary_pipeline = SummaryPipeline(
+                summarize=self.__summarize_batch,
+                store=self.long_memory_storage.save_many,
+                batch_size=memory_storage_config.get("summary_batch_size", SUMMARY_BATCH_SIZE),
+                max_wait=memory_storage_config.get("summary_max_wait", SUMMARY_MAX_WAIT),
+                deadline=memory_storage_config.get("summary_deadline", SUMMARY_DEADLINE)
+            )
+
+        # 冷启动恢复：记忆为空时从配置的快照导入
+        restore_path = memory_storage_config.get("snapshot_restore_path")
+        if restore_path:
+            try:
+                import_snapshot(
+                    restore_path,
+                    faiss_storage=self.long_memory_storage,
+                    local_storage=self.short_memory_storage if isinstance(self.short_memory_storage, LocalStorage) else None,
+                    only_if_empty=True
+                )
+            except Exception as restore_err:
+                logger.error(f"从快照恢复记忆失败: {str(restore_err)}")
+
+        _open_drivers.add(self)
+
     def search_short_memory(self, query_text: str, you_name: str, role_name: str) -> list[Dict[str, str]]:
-        """查询短期记忆"""
+        """查询当前角色与当前观众之间的短期记忆"""
         try:
+            if self.short_term_memory is not None:
+                return self.short_term_memory.recent(
+                    owner=role_name, sender=you_name, limit=self.sys_config.local_memory_num)
+
             # 使用更新后的参数调用search方法
             local_memory = self.short_memory_storage.pageQuery(
                 page_num=1, 
@@ -93,10 +152,12 @@ class MemoryStorageDriver:
             return ""
         
         try:
-            # 查询长期记忆 - 使用修改后的参数列表
+            # 查询长期记忆，只检索当前角色与当前观众之间的记忆
             memories_result = self.long_memory_storage.search(
                 query_text=prompt,
-                limit=self.sys_config.search_memory_size
+                limit=self.sys_config.search_memory_size,
+                sender=you_name,
+                owner=role_name
             )
             
             # 日志记录
@@ -136,45 +197,74 @@ class MemoryStorageDriver:
 
     def save(self, you_name: str, query_text: str, role_name: str, answer_text: str) -> None:
         """保存对话记忆"""
+        self.save_many([{
+            "you_name": you_name,
+            "query_text": query_text,
+            "role_name": role_name,
+            "answer_text": answer_text
+        }])
+
+    def save_many(self, conversations: List[Dict[str, str]]) -> None:
+        """
+        批量保存对话记忆，短期记忆和长期记忆各自一次批量写入
+        Args:
+            conversations: 对话列表，每项包含you_name、query_text、role_name、answer_text
+        """
+        if not conversations:
+            return
         try:
-            # 存储短期记忆
-            pk = self.get_current_entity_id()
-            local_history = {
-                "ai": self.__format_role_history(role_name=role_name, answer_text=answer_text),
-                "human": self.__format_you_history(you_name=you_name, query_text=query_text)
-            }
-            
-            # 使用命名参数调用短期记忆存储
-            self.short_memory_storage.save(
-                text=json.dumps(local_history),
-                sender=you_name,
-                owner=role_name,
-                importance_score=1
-            )
+            # 存储短期记忆，标签取自对话文本的分词结果（长期记忆保存同一文本时命中分词缓存）
+            histories = [self.format_history(**conversation) for conversation in conversations]
+            analyzed = self.tokenizer.analyze_many(histories)
+            local_memories = []
+            for conversation, tokenized in zip(conversations, analyzed):
+                local_history = {
+                    "ai": self.__format_role_history(role_name=conversation["role_name"],
+                                                     answer_text=conversation["answer_text"]),
+                    "human": self.__format_you_history(you_name=conversation["you_name"],
+                                                       query_text=conversation["query_text"])
+                }
+                local_memories.append({
+                    "owner": conversation["role_name"],
+                    "sender": conversation["you_name"],
+                    "entry": local_history,
+                    "memory": {
+                        "text": json.dumps(local_history),
+                        "sender": conversation["you_name"],
+                        "owner": conversation["role_name"],
+                        "importance_score": 1,
+                        "keywords": list(tokenized.keywords)
+                    }
+                })
+            if self.short_term_memory is not None:
+                self.short_term_memory.append_many(local_memories)
+            else:
+                self.short_memory_storage.save_many([memory["memory"] for memory in local_memories])
 
             # 是否开启长期记忆
             if self.sys_config.enable_longMemory and hasattr(self, 'long_memory_storage') and self.long_memory_storage is not None:
                 try:
-                    # 将当前对话语句生成摘要
-                    history = self.format_history(
-                        you_name=you_name, query_text=query_text, role_name=role_name, answer_text=answer_text)
-                    importance_score = 3
-                    if self.sys_config.enable_summary:
-                        memory_summary = MemorySummary(self.sys_config)
-                        history = memory_summary.summary(
-                            llm_model_type=self.sys_config.summary_llm_model_driver_type, input=history)
-                        # 计算记忆的重要程度
-                        memory_importance = MemoryImportance(self.sys_config)
-                        importance_score = memory_importance.importance(
-                            self.sys_config.summary_llm_model_driver_type, input=history)
-                    
-                    # 使用更新后的参数列表调用save方法
-                    self.long_memory_storage.save(
-                        text=history,
-                        sender=you_name,
-                        owner=role_name,
-                        importance_score=importance_score
-                    )
+                    long_memories = []
+                    memory_importance = MemoryImportance(self.sys_config)
+                    for conversation, history in zip(conversations, histories):
+                        # 开启摘要时先按规则评分，摘要结果缺失时作为回退值
+                        importance_score = 3
+                        if self.sys_config.enable_summary:
+                            importance_score = memory_importance.importance(
+                                self.sys_config.summary_llm_model_driver_type, input=history)
+                        long_memories.append({
+                            "text": history,
+                            "sender": conversation["you_name"],
+                            "owner": conversation["role_name"],
+                            "importance_score": importance_score
+                        })
+
+                    # 开启摘要时交给流水线批量摘要后写入，不阻塞聊天历史队列
+                    if self.sys_config.enable_summary and self.summary_pipeline is not None:
+                        self.summary_pipeline.submit(long_memories)
+                    else:
+                        # 一次批量写入向量索引和元数据
+                        self.long_memory_storage.save_many(long_memories)
                 except Exception as e:
                     stack_trace = traceback.format_exc()
                     logger.error(f"保存长期记忆失败: {str(e)}")
@@ -183,6 +273,18 @@ class MemoryStorageDriver:
         except Exception as e:
             logger.error(f"保存对话记忆失败: {str(e)}")
 
+    def __summarize_batch(self, query: str) -> str:
+        """一次LLM调用生成整批对话的摘要"""
+        return self.sys_config.llm_model_driver.chat(
+            prompt=BATCH_SUMMARY_PROMPT,
+            type=self.sys_config.summary_llm_model_driver_type,
+            role_name="",
+            you_name="",
+            query=query,
+            short_history=[],
+            long_history=""
+        )
+
     def format_history(self, you_name: str, query_text: str, role_name: str, answer_text: str):
         you_history = self.__format_you_history(
             you_name=you_name, query_text=query_text)
@@ -203,9 +305,29 @@ class MemoryStorageDriver:
         '''生成唯一标识'''
         return self.snow_flake.task()
 
+    def close(self) -> None:
+        """停止后台线程：待摘要的对话以原文写入长期记忆，短期记忆的待写入记录写入数据库"""
+        if self._closed:
+            return
+        self._closed = True
+        _open_drivers.discard(self)
+        try:
+            if self.summary_pipeline is not None:
+                self.summary_pipeline.stop()
+            if self.short_term_memory is not None:
+                self.short_term_memory.stop()
+            logger.info("记忆模块已关闭")
+        except Exception as e:
+            logger.error(f"关闭记忆模块失败: {str(e)}")
+
     def clear(self, owner: str) -> None:
+        if self.summary_pipeline is not None:
+            self.summary_pipeline.discard(owner)
         self.long_memory_storage.clear(owner)
-        self.short_memory_storage.clear(owner)
+        if self.short_term_memory is not None:
+            self.short_term_memory.clear(owner)
+        else:
+            self.short_memory_storage.clear(owner)
 
 
 class MemorySummary:
@@ -240,7 +362,8 @@ class MemorySummary:
                 you_name="", 
                 query=f"input:{input}", 
                 short_history=[],
-                long_history=""
+                long_history="",
+                cache="memory_summary"
             )
             
             logger.debug(f"=> summary: {result}")
@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个(所有者, 发送者)保留的最近对话轮数
+SHORT_TERM_WINDOW_SIZE = 50
+# 最多缓存的(所有者, 发送者)窗口数，超出时淘汰最久未使用的窗口
+SHORT_TERM_MAX_KEYS = 1024
+# 后台线程每次写入数据库的最大条数
+WRITE_BATCH_SIZE = 256
+# 写入失败后的重试间隔（秒），连续失败时翻倍，不超过上限
+RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 60.0
+
+
+class ShortTermWriteError(RuntimeError):
+    """批量写入数据库失败，待写入记录保留等待重试"""
+
+
+class ShortTermMemory:
+    """
+    短期对话窗口
+    按(所有者, 发送者)维护最近若干轮对话的环形缓冲区，条目为解析好的字典，读取只是一次字典查找；
+    写入时先更新缓冲区，再由后台线程批量写入LocalMemoryModel；缓冲区未命中时从数据库懒加载
+    """
+
+    def __init__(self, storage, window_size: int = SHORT_TERM_WINDOW_SIZE,
+                 max_keys: int = SHORT_TERM_MAX_KEYS) -> None:
+        """
+        :param storage: 短期记忆存储（LocalStorage）
+        """
+        self.storage = storage
+        self.window_size = window_size
+        self.max_keys = max_keys
+        self._windows: "OrderedDict[Tuple[str, str], Deque[dict]]" = OrderedDict()
+        # 尚未写入数据库的记录，写入成功后才移除，懒加载时与数据库中的记录合并
+        self._pending: List[dict] = []
+        self._lock = threading.Lock()
+        # 懒加载读取数据库与后台写入互斥，保证“数据库 + 待写入”始终是完整的历史
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="short-term-memory-writer", daemon=True)
+        self._thread.start()
+
+    def recent(self, owner: str, sender: str, limit: int) -> List[dict]:
+        """获取最近limit轮对话（从旧到新），返回的字典为只读"""
+        key = (owner, sender)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None:
+                self._windows.move_to_end(key)
+        if window is None:
+            window = self._load(key)
+        with self._lock:
+            entries = list(window)
+        return entries[-limit:] if limit > 0 else []
+
+    def append_many(self, records: List[dict]) -> None:
+        """
+        追加对话并异步写入数据库
+        :param records: 每项包含owner、sender、entry（解析好的对话字典）和memory（写入LocalStorage.save_many的记录）
+        """
+        if not records:
+            return
+        # 先加载缺失的窗口，保证窗口中包含数据库里已有的历史
+        for key in {(record["owner"], record["sender"]) for record in records}:
+            with self._lock:
+                loaded = key in self._windows
+            if not loaded:
+                self._load(key)
+        with self._lock:
+            for record in records:
+                window = self._windows.get((record["owner"], record["sender"]))
+                if window is not None:
+                    window.append(record["entry"])
+            self._pending.extend(records)
+        self._wakeup.set()
+
+    def clear(self, owner: str) -> bool:
+        """清空指定所有者的窗口、待写入记录和数据库中的短期记忆"""
+        with self._flush_lock:
+            with self._lock:
+                self._pending = [record for record in self._pending if record["owner"] != owner]
+                for key in [key for key in self._windows if key[0] == owner]:
+                    del self._windows[key]
+            return self.storage.clear(owner)
+
+    def flush(self) -> int:
+        """
+        将待写入的记录批量写入数据库，返回写入条数
+        一批记录全部写入后才从待写入列表中移除；写入失败时保留该批及之后的记录并抛出ShortTermWriteError
+        """
+        written = 0
+        while True:
+            with self._flush_lock:
+                with self._lock:
+                    batch = self._pending[:WRITE_BATCH_SIZE]
+                if not batch:
+                    return written
+                # 没有文本的记录不会写入数据库，直接丢弃
+                memories = [record["memory"] for record in batch if record["memory"].get("text")]
+                saved = self.storage.save_many(memories) if memories else 0
+                # LocalStorage.save_many在一个事务中批量写入，条数不足说明整批未写入
+                if saved != len(memories):
+                    raise ShortTermWriteError(f"短期记忆写入数据库失败: {saved}/{len(memories)}，"
+                                              f"保留{len(self._pending)}条待写入记录")
+                with self._lock:
+                    del self._pending[:len(batch)]
+                written += saved
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止后台线程，等待待写入的记录写入数据库"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _load(self, key: Tuple[str, str]) -> Deque[dict]:
+        """从数据库和待写入记录中加载窗口"""
+        owner, sender = key
+        with self._flush_lock:
+            texts = self.storage.recent(owner=owner, sender=sender, limit=self.window_size)
+            entries = []
+            for text in texts:
+                try:
+                    entries.append(json.loads(text))
+                except json.JSONDecodeError:
+                    logger.warning(f"无法解析JSON字符串: {text}")
+            with self._lock:
+                window = self._windows.get(key)
+                if window is None:
+                    entries.extend(record["entry"] for record in self._pending
+                                   if record["owner"] == owner and record["sender"] == sender)
+                    window = deque(entries, maxlen=self.window_size)
+                    self._windows[key] = window
+                    while len(self._windows) > self.max_keys:
+                        self._windows.popitem(last=False)
+                return window
+
+    def _run(self) -> None:
+        backoff = 0.0
+        while not self._stopped.is_set():
+            if backoff:
+                # 写入失败后退避重试，期间新追加的记录不触发写入
+                self._stopped.wait(backoff)
+            else:
+                self._wakeup.wait(timeout=1.0)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                backoff = 0.0
+            except Exception as e:
+                backoff = min(backoff * 2 if backoff else RETRY_BACKOFF, MAX_RETRY_BACKOFF)
+                logger.error(f"{str(e)}，{backoff:.0f}s后重试")
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"停止时{str(e)}，这些记录将丢失")
@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import ExitStack
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 快照格式版本，格式不兼容地变化时递增；版本1的表按行存储，仍可读取
+SNAPSHOT_FORMAT_VERSION = 2
+READABLE_FORMAT_VERSIONS = (1, 2)
+MANIFEST_FILE = "manifest.json"
+TABLE_SUFFIX = ".jsonl.gz"
+MATRIX_SUFFIX = ".npy"
+# 计算校验和时每次读取的字节数
+CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
+VECTOR_DTYPES = ("float32", "float16")
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _section_files(section: dict) -> List[str]:
+    if "files" in section:
+        return list(section["files"].values())
+    return [section["file"]]
+
+
+class SnapshotWriter:
+    """
+    记忆快照写入器
+    快照是一个目录：表按列存储，每列一个gzip压缩的JSON Lines文件（每行一个值，文件名为“表名.列名.jsonl.gz”），
+    同一列的值相邻存放，压缩率高于按行存储，读取时逐行对齐各列；
+    向量以.npy矩阵存储（float32或float16），最后写入带校验和的manifest.json；
+    清单最后写入，存在清单即表示快照完整
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.sections = {}
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            raise FileExistsError(f"快照目录已存在快照: {path}")
+
+    def write_table(self, name: str, columns: Sequence[str], rows: Iterable[Sequence]) -> int:
+        """流式按列写入一张表，返回写入的行数"""
+        count = 0
+        files = {column: f"{name}.{column}{TABLE_SUFFIX}" for column in columns}
+        with ExitStack() as stack:
+            outputs = [stack.enter_context(gzip.open(os.path.join(self.path, files[column]), "wt", encoding="utf-8"))
+                       for column in columns]
+            for row in rows:
+                for output, value in zip(outputs, row):
+                    output.write(json.dumps(value, ensure_ascii=False))
+                    output.write("\n")
+                count += 1
+        self.sections[name] = {"type": "columns", "files": files, "columns": list(columns), "rows": count}
+        return count
+
+    def create_matrix(self, name: str, rows: int, dimension: int, dtype: str = "float32") -> np.ndarray:
+        """创建内存映射的.npy矩阵，调用方逐行填充"""
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"不支持的向量类型: {dtype}")
+        self.sections[name] = {"type": "matrix", "file": name + MATRIX_SUFFIX, "rows": rows,
+                               "dimension": dimension, "dtype": dtype}
+        return np.lib.format.open_memmap(os.path.join(self.path, name + MATRIX_SUFFIX), mode="w+",
+                                         dtype=dtype, shape=(rows, dimension))
+
+    def finish(self, **info) -> dict:
+        """计算各文件校验和并写入清单"""
+        files = {}
+        for section in self.sections.values():
+            for file_name in _section_files(section):
+                file_path = os.path.join(self.path, file_name)
+                files[file_name] = {"size": os.path.getsize(file_path), "sha256": _file_sha256(file_path)}
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": time.time(),
+            "sections": self.sections,
+            "files": files,
+            **info
+        }
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+        return manifest
+
+
+class SnapshotReader:
+    """记忆快照读取器，表按块流式读取，向量矩阵以内存映射方式打开"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"快照清单不存在，快照可能不完整: {manifest_path}")
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") not in READABLE_FORMAT_VERSIONS:
+            raise ValueError(f"不支持的快照格式版本: {self.manifest.get('format_version')}")
+
+    def verify(self) -> None:
+        """校验各文件的大小和SHA-256，不一致时抛出ValueError"""
+        for file_name, expected in self.manifest["files"].items():
+            file_path = os.path.join(self.path, file_name)
+            if not os.path.exists(file_path) or os.path.getsize(file_path) != expected["size"] or \
+                    _file_sha256(file_path) != expected["sha256"]:
+                raise ValueError(f"快照文件校验失败: {file_name}")
+
+    def section(self, name: str) -> Optional[dict]:
+        return self.manifest["sections"].get(name)
+
+    def read_table(self, name: str, chunk_size: int = 5000) -> Iterator[List[dict]]:
+        """按块读取表，每块为以列名为键的记录列表"""
+        section = self.section(name)
+        if section is None:
+            return
+        columns = section["columns"]
+        chunk = []
+        for row in self._read_rows(section):
+            chunk.append(dict(zip(columns, row)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _read_rows(self, section: dict) -> Iterator[Sequence]:
+        if section["type"] == "table":
+            # 版本1：每行一条记录
+            with gzip.open(os.path.join(self.path, section["file"]), "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+            return
+        with ExitStack() as stack:
+            inputs = [stack.enter_context(gzip.open(os.path.join(self.path, section["files"][column]), "rt",
+                                                    encoding="utf-8"))
+                      for column in section["columns"]]
+            for lines in zip(*inputs):
+                yield [json.loads(line) for line in lines]
+
+    def open_matrix(self, name: str) -> np.ndarray:
+        section = self.section(name)
+        return np.load(os.path.join(self.path, section["file"]), mmap_mode="r")
+
+
+def export_snapshot(path: str, faiss_storage=None, local_storage=None, vector_dtype: str = "float32") -> dict:
+    """
+    导出记忆快照
+    :param faiss_storage: 长期记忆存储（FAISSStorage），None表示不导出
+    :param local_storage: 短期记忆存储（LocalStorage），None表示不导出
+    :param vector_dtype: 向量存储类型，float32或float16（体积减半，精度略有损失）
+    :return: 快照清单
+    """
+    started = time.time()
+    writer = SnapshotWriter(path)
+    info = {}
+    if faiss_storage is not None:
+        info["long_memory"] = faiss_storage.export_snapshot(writer, vector_dtype=vector_dtype)
+    if local_storage is not None:
+        info["short_memory"] = {"rows": local_storage.export_snapshot(writer)}
+    manifest = writer.finish(**info)
+    logger.info(f"记忆快照导出完成: {path}，耗时 {time.time() - started:.2f}s")
+    return manifest
+
+
+def import_snapshot(path: str, faiss_storage=None, local_storage=None, replace: bool = False,
+                    only_if_empty: bool = False) -> dict:
+    """
+    导入记忆快照，先校验清单中的校验和，再分块流式批量写入
+    :param replace: 是否先清空现有记忆
+    :param only_if_empty: 只导入到没有任何记忆的存储中（用于启动时冷恢复）
+    :return: 各存储导入的条数
+    """
+    started = time.time()
+    reader = SnapshotReader(path)
+    reader.verify()
+    imported = {}
+    if faiss_storage is not None and not (only_if_empty and faiss_storage.count() > 0):
+        imported["long_memory"] = faiss_storage.import_snapshot(reader, replace=replace)
+    if local_storage is not None and not (only_if_empty and local_storage.count() > 0):
+        imported["short_memory"] = local_storage.import_snapshot(reader, replace=replace)
+    logger.info(f"记忆快照导入完成: {path}，{imported}，耗时 {time.time() - started:.2f}s")
+    return imported
@@ -0,0 +1,308 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每次摘要调用最多合并的对话轮数
+SUMMARY_BATCH_SIZE = 8
+# 所有者积累的对话最多等待的秒数，超时后不足一批也进行摘要
+SUMMARY_MAX_WAIT = 30.0
+# 单次摘要调用的截止时间（秒），超时则该批对话以原文保存
+SUMMARY_DEADLINE = 20.0
+# 每轮对话送入摘要的最大长度
+SUMMARY_MAX_INPUT_LENGTH = 500
+# 并发进行摘要调用的最大数量，超时仍在运行的调用也计入，已满时新批次直接以原文保存
+SUMMARY_WORKERS = 2
+# 写入失败后等待重试的最大记忆条数，超出时丢弃最早的记录
+SUMMARY_RETRY_LIMIT = 1024
+
+BATCH_SUMMARY_PROMPT = '''
+               <s>[INST] <<SYS>>
+                Please help me extract key information from each of the conversations below and rate its importance.
+                Each conversation is given on its own line as "id: content". Here is an example:
+                input:
+                1: alan说你好，爱莉，很高兴认识你，我是一名程序员，我喜欢吃川菜;爱莉说我们是兼容的
+                2: bob说早安;爱莉说早安，bob
+                output:
+                [{"id": 1, "summary": "alan向爱莉表示自己是一名程序员，alan喜欢吃川菜，爱莉认为和alan是兼容的", "importance": 5},
+                 {"id": 2, "summary": "bob和爱莉互道早安", "importance": 1}]
+                importance is an integer from 1 (mundane) to 10 (extremely poignant).
+                Please export the summaries in Chinese.
+                Please use JSON format strictly and output a JSON array with exactly one object per conversation:
+                [{"id": conversation id, "summary": "A summary of the conversation you generated", "importance": importance}]
+                <</SYS>>
+        '''
+
+
+def build_batch_query(texts: List[str]) -> str:
+    """将多轮对话编号拼接为一次摘要调用的输入"""
+    lines = []
+    for position, text in enumerate(texts, start=1):
+        text = text.replace("\n", " ")
+        if len(text) > SUMMARY_MAX_INPUT_LENGTH:
+            text = text[:SUMMARY_MAX_INPUT_LENGTH]
+        lines.append(f"{position}: {text}")
+    return "input:\n" + "\n".join(lines)
+
+
+def parse_batch_summaries(result: str, count: int) -> List[Optional[Tuple[str, Optional[int]]]]:
+    """
+    解析摘要调用返回的JSON数组
+    :return: 与输入对齐的列表，每项为(摘要, 重要性)，缺失或无法解析的项为None
+    """
+    parsed: List[Optional[Tuple[str, Optional[int]]]] = [None] * count
+    if not result:
+        return parsed
+    start_idx = result.find('[')
+    end_idx = result.rfind(']')
+    if start_idx == -1 or end_idx == -1:
+        logger.warning("摘要结果中未找到JSON数组，使用原始对话")
+        return parsed
+    try:
+        items = json.loads(result[start_idx:end_idx + 1])
+    except json.JSONDecodeError as e:
+        logger.warning(f"摘要结果JSON解析错误: {str(e)}, 使用原始对话")
+        return parsed
+    if not isinstance(items, list):
+        return parsed
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        summary = item.get("summary") or item.get("Summary")
+        if not isinstance(summary, str) or not summary.strip():
+            continue
+        try:
+            index = int(item.get("id", position + 1)) - 1
+        except (TypeError, ValueError):
+            index = position
+        if not 0 <= index < count or parsed[index] is not None:
+            continue
+        importance = None
+        try:
+            importance = min(max(int(item["importance"]), 1), 10)
+        except (KeyError, TypeError, ValueError):
+            pass
+        parsed[index] = (summary.strip(), importance)
+    return parsed
+
+
+class SummaryPipeline:
+    """
+    批量摘要流水线
+    保存长期记忆时不再逐轮同步调用LLM：对话先按所有者积累，积累到batch_size轮或等待超过max_wait秒后，
+    由后台线程一次LLM调用生成整批对话的摘要和重要性（JSON数组），再一次批量写入长期记忆；
+    调用超过deadline秒、失败或结果缺失的对话以原文和规则评分保存；进行中的摘要调用已达workers个时不再排队，
+    新批次直接以原文保存；写入失败的记忆保留到下一轮重试
+    """
+
+    def __init__(self, summarize: Callable[[str], str], store: Callable[[List[dict]], object],
+                 batch_size: int = SUMMARY_BATCH_SIZE, max_wait: float = SUMMARY_MAX_WAIT,
+                 deadline: float = SUMMARY_DEADLINE, workers: int = SUMMARY_WORKERS) -> None:
+        """
+        :param summarize: 摘要调用，输入为编号后的对话，返回LLM的原始输出
+        :param store: 批量写入长期记忆，参数为FAISSStorage.save_many的记录列表
+        """
+        self.summarize = summarize
+        self.store = store
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self.deadline = deadline
+        # 所有者 -> (最早一条的入队时间, 记忆列表)
+        self._pending: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.workers = max(1, int(workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="memory-summary")
+        # 已提交且尚未结束的摘要调用数，超时后future.cancel()无法中断运行中的调用，结束时才释放
+        self._inflight = 0
+        # 写入失败、等待重试的记忆
+        self._failed: List[dict] = []
+        self._stats = {"turns": 0, "llm_calls": 0, "summarized": 0, "fallbacks": 0, "timeouts": 0,
+                       "saturated": 0, "store_failures": 0}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-summary-pipeline", daemon=True)
+        self._thread.start()
+
+    def submit(self, memories: List[dict]) -> None:
+        """
+        登记待摘要的对话
+        :param memories: FAISSStorage.save_many的记录，text为原始对话，importance_score为规则评分（作为回退值）
+        """
+        if not memories:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for memory in memories:
+                owner = memory["owner"]
+                if owner not in self._pending:
+                    self._pending[owner] = (now, [])
+                self._pending[owner][1].append(memory)
+                self._stats["turns"] += 1
+                if len(self._pending[owner][1]) >= self.batch_size:
+                    self._wakeup.set()
+
+    def discard(self, owner: str) -> None:
+        """丢弃指定所有者尚未摘要的对话（清空记忆时调用）"""
+        with self._lock:
+            self._pending.pop(owner, None)
+
+    def flush(self, force: bool = False, summarize: bool = True) -> int:
+        """
+        处理已就绪的批次：满一批的所有者，或等待超过max_wait秒的所有者
+        :param force: 处理所有待摘要的对话
+        :param summarize: 为False时不调用LLM，直接以原文保存（停止时使用）
+        :return: 写入的记忆条数
+        """
+        written = self._retry_failed()
+        batches = self._take_batches(force)
+        if not batches:
+            return written
+        if summarize:
+            memories = self._summarize_batches(batches)
+        else:
+            memories = [memory for batch in batches for memory in batch]
+            with self._lock:
+                self._stats["fallbacks"] += len(memories)
+        return written + self._store(memories)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止后台线程，等待剩余对话以原文写入长期记忆"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = sum(len(memories) for _, memories in self._pending.values())
+            stats["inflight"] = self._inflight
+            stats["failed"] = len(self._failed)
+        return stats
+
+    def _store(self, memories: List[dict]) -> int:
+        """写入长期记忆，失败时保留记忆等待下一轮重试"""
+        try:
+            saved = self.store(memories)
+        except Exception as e:
+            logger.error(f"批量写入长期记忆失败: {str(e)}")
+            saved = 0
+        # FAISSStorage.save_many在一个事务中写入整批，返回0说明整批未写入
+        if saved != 0 or not any(memory.get("text") for memory in memories):
+            return len(memories) if saved is None else saved
+        with self._lock:
+            self._stats["store_failures"] += 1
+            self._failed.extend(memories)
+            dropped = len(self._failed) - SUMMARY_RETRY_LIMIT
+            if dropped > 0:
+                del self._failed[:dropped]
+        logger.warning(f"{len(memories)}条记忆写入失败，等待下一轮重试")
+        if dropped > 0:
+            logger.error(f"等待重试的记忆超过{SUMMARY_RETRY_LIMIT}条，丢弃最早的{dropped}条")
+        return 0
+
+    def _retry_failed(self) -> int:
+        with self._lock:
+            memories, self._failed = self._failed, []
+        if not memories:
+            return 0
+        return self._store(memories)
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._inflight -= 1
+
+    def _take_batches(self, force: bool) -> List[List[dict]]:
+        now = time.monotonic()
+        batches = []
+        with self._lock:
+            for owner in list(self._pending):
+                since, memories = self._pending[owner]
+                expired = force or now - since >= self.max_wait
+                taken = 0
+                while len(memories) - taken >= self.batch_size or (taken < len(memories) and expired):
+                    batches.append(memories[taken:taken + self.batch_size])
+                    taken += self.batch_size
+                if taken >= len(memories):
+                    del self._pending[owner]
+                elif taken:
+                    # 剩余的对话重新计时
+                    self._pending[owner] = (now, memories[taken:])
+        return batches
+
+    def _submit(self, batch: List[dict]):
+        """提交一批摘要调用，进行中的调用已达上限时返回None，该批以原文保存"""
+        with self._lock:
+            if self._inflight >= self.workers:
+                self._stats["saturated"] += 1
+                return None
+            self._inflight += 1
+            self._stats["llm_calls"] += 1
+        try:
+            future = self._executor.submit(self.summarize, build_batch_query([m["text"] for m in batch]))
+        except RuntimeError as e:
+            self._release(None)
+            logger.error(f"提交摘要调用失败: {str(e)}")
+            return None
+        future.add_done_callback(self._release)
+        return future
+
+    def _summarize_batches(self, batches: List[List[dict]]) -> List[dict]:
+        """并发发起各批次的摘要调用，在共同的截止时间内收集结果"""
+        deadline = time.monotonic() + self.deadline
+        futures = [self._submit(batch) for batch in batches]
+        memories = []
+        for batch, future in zip(batches, futures):
+            result = None
+            if future is None:
+                logger.warning(f"进行中的摘要调用已达{self.workers}个，{len(batch)}轮对话以原文保存")
+            else:
+                try:
+                    result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    future.cancel()
+                    logger.warning(f"摘要调用超过{self.deadline}s截止时间，{len(batch)}轮对话以原文保存")
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                except Exception as e:
+                    logger.error(f"批量摘要调用失败: {str(e)}")
+            summarized = 0
+            for memory, parsed in zip(batch, parse_batch_summaries(result, len(batch))):
+                if parsed is not None:
+                    summary, importance = parsed
+                    memory = dict(memory, text=summary)
+                    if importance is not None:
+                        memory["importance_score"] = importance
+                    summarized += 1
+                memories.append(memory)
+            with self._lock:
+                self._stats["summarized"] += summarized
+                self._stats["fallbacks"] += len(batch) - summarized
+        return memories
+
+    def _run(self) -> None:
+        interval = max(0.5, min(self.max_wait, 5.0))
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"批量摘要处理失败: {str(e)}")
+        # 停止时不再等待LLM，剩余对话以原文保存，避免丢失
+        try:
+            self.flush(force=True, summarize=False)
+        except Exception as e:
+            logger.error(f"保存待摘要的对话失败: {str(e)}")
+        with self._lock:
+            lost = len(self._failed)
+        if lost:
+            logger.error(f"停止时仍有{lost}条记忆写入失败，这些记录将丢失")
+        self._executor.shutdown(wait=False)
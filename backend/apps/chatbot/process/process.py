@@ -1,6 +1,8 @@
+import copy
 import logging
-import traceback
+import time
 
+from django.db import close_old_connections
 from rest_framework.generics import get_object_or_404
 
 from ..character import role_dialogue_example
@@ -11,6 +13,7 @@ from ..models import RolePackageModel
 from ..output.realtime_message_queue import realtime_callback
 from ..chat.chat_history_queue import conversation_end_callback
 from ..utils.datatime_utils import get_current_time_str
+from .retrieval import RetrievalStage
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +32,87 @@ class ProcessCore():
         self.portrait_observation = PortraitObservation(llm_model_driver=self.sys_config.llm_model_driver,
                                                         llm_model_driver_type=self.sys_config.conversation_llm_model_driver_type)
 
+        # 对话前的检索阶段，各检索来源并发执行
+        self.retrieval_stage = RetrievalStage()
+
+    def _submit_context(self, character, you_name: str, query: str, sys_config) -> dict:
+        """提交依赖角色的检索任务：角色安装包的对话示例、短期记忆和长期记忆"""
+        role_name = character.role_name
+        tasks = {}
+        # 判断是否有角色安装包？如果有动态获取对话示例
+        if character.role_package_id != -1:
+            tasks["dialogue_examples"] = self.retrieval_stage.submit(
+                "dialogue_examples", (character.role_package_id, query),
+                self._search_dialogue_examples, character.role_package_id, query, you_name, role_name)
+        # 确保记忆驱动存在
+        if sys_config.memory_storage_driver is not None:
+            # 短期记忆每轮对话后都会变化，上一轮的结果缺少最近一次问答，超时时不回退到该结果
+            tasks["short_memory"] = self.retrieval_stage.submit(
+                "short_memory", (role_name, you_name),
+                self._search_short_memory, sys_config, query, you_name, role_name, fallback=False)
+            # 只有在启用长期记忆功能时才检索长期记忆
+            if sys_config.enable_longMemory and hasattr(sys_config.memory_storage_driver, 'long_memory_storage'):
+                tasks["long_memory"] = self.retrieval_stage.submit(
+                    "long_memory", (role_name, you_name, query),
+                    self._search_long_memory, sys_config, query, you_name, role_name)
+        return tasks
+
+    def _get_character(self, role_id):
+        close_old_connections()
+        return self.singleton_character_generation.get_character(role_id)
+
+    def _search_dialogue_examples(self, role_package_id: int, query: str, you_name: str, role_name: str) -> str:
+        close_old_connections()
+        db_role_package_model = get_object_or_404(RolePackageModel, pk=role_package_id)
+        return role_dialogue_example.generate(query, you_name, role_name,
+                                              db_role_package_model.dataset_json_path,
+                                              db_role_package_model.embed_index_idx_path)
+
+    def _search_short_memory(self, sys_config, query: str, you_name: str, role_name: str) -> list:
+        # 窗口未命中时会从LocalMemoryModel懒加载，在检索线程中同样需要先清理失效的数据库连接
+        close_old_connections()
+        # 限制短期记忆的数量
+        max_short_history = 10  # 设置合理的短期记忆限制
+        short_history = sys_config.memory_storage_driver.search_short_memory(
+            query_text=query, you_name=you_name, role_name=role_name)
+        if len(short_history) > max_short_history:
+            logger.info(f"短期记忆超过{max_short_history}条，进行截断")
+            short_history = short_history[-max_short_history:]
+        return short_history
+
+    def _search_long_memory(self, sys_config, query: str, you_name: str, role_name: str) -> str:
+        long_history = sys_config.memory_storage_driver.search_lang_memory(
+            prompt=query,  # 使用正确的参数名
+            you_name=you_name,
+            role_name=role_name
+        )
+
+        # 记录长期记忆的长度
+        logger.info(f"检索到的长期记忆长度: {len(long_history)}")
+
+        # 如果长期记忆为空，记录原因
+        if not long_history:
+            logger.debug("未找到相关的长期记忆")
+
+        # 设置安全的最大长度限制
+        max_length = 2000  # 明确定义最大长度
+        if len(long_history) > max_length:
+            logger.info(f"长期记忆长度超过{max_length}个字符，进行截断")
+            # 在完整句子处截断
+            truncated = long_history[:max_length]
+            last_period = max(
+                truncated.rfind('。'),
+                truncated.rfind('！'),
+                truncated.rfind('？'),
+                truncated.rfind('\n')
+            )
+            if last_period > 0:
+                long_history = truncated[:last_period + 1]
+            else:
+                long_history = truncated
+            logger.info(f"截断后的长期记忆长度: {len(long_history)}")
+        return long_history
+
     def chat(self, you_name: str, query: str):
         """处理聊天请求"""
         try:
@@ -43,92 +127,48 @@ class ProcessCore():
                 logger.error("系统配置未初始化")
                 raise RuntimeError("系统配置未初始化")
             
-            # 生成角色prompt
-            character = self.singleton_character_generation.get_character(
-                sys_config.character)
+            # 检索阶段：角色、对话示例、短期记忆、长期记忆并发检索，各来源有独立的超时和回退
+            timings = {}
+            stage_started = time.monotonic()
+            role_id = sys_config.character
+            character_task = self.retrieval_stage.submit(
+                "character", role_id, self._get_character, role_id)
+            # 角色很少变化，先用上一次获取的角色发起依赖角色名的检索，与角色查询并发
+            hint = self.retrieval_stage.cached("character", role_id)
+            context_tasks = self._submit_context(hint, you_name, query, sys_config) if hint is not None else None
+            character = self.retrieval_stage.result(character_task, timings=timings)
             if not character:
                 logger.error("角色生成失败")
                 raise RuntimeError("角色生成失败")
-                
+            if context_tasks is None or hint.role_name != character.role_name or \
+                    hint.role_package_id != character.role_package_id:
+                context_tasks = self._submit_context(character, you_name, query, sys_config)
+            # 复制角色对象，动态对话示例不写回缓存的角色
+            character = copy.copy(character)
+
             role_name = character.role_name
             logger.info(f"开始处理聊天请求: you_name={you_name}, role_name={role_name}, query={query}")
 
-            # 判断是否有角色安装包？如果有动态获取对话示例
-            try:
-                if character.role_package_id != -1:
-                    db_role_package_model = get_object_or_404(RolePackageModel, pk=character.role_package_id)
-                    character.examples_of_dialogue = role_dialogue_example.generate(query, you_name, role_name,
-                                                                                    db_role_package_model.dataset_json_path,
-                                                                                    db_role_package_model.embed_index_idx_path)
-            except Exception as e:
-                logger.error(f"获取角色对话示例失败: {str(e)}")
-                # 继续使用默认对话示例
+            short_history = []
+            long_history = ""
+            if "dialogue_examples" in context_tasks:
+                examples = self.retrieval_stage.result(context_tasks["dialogue_examples"], timings=timings)
+                # 获取失败时继续使用默认对话示例
+                if examples:
+                    character.examples_of_dialogue = examples
+            if "short_memory" in context_tasks:
+                short_history = self.retrieval_stage.result(context_tasks["short_memory"], default=[],
+                                                            timings=timings)
+            elif sys_config.memory_storage_driver is None:
+                logger.warning("记忆驱动未初始化，跳过记忆检索")
+            if "long_memory" in context_tasks:
+                long_history = self.retrieval_stage.result(context_tasks["long_memory"], default="",
+                                                           timings=timings)
+            logger.info(f"检索阶段耗时 {(time.monotonic() - stage_started) * 1000:.1f}ms，各来源(ms): {timings}")
 
             prompt = self.singleton_character_generation.output_prompt(
                 character)
 
-            # 检索关联的短期记忆和长期记忆
-            try:
-                short_history = []
-                long_history = ""
-                
-                # 确保记忆驱动存在
-                if sys_config.memory_storage_driver is not None:
-                    # 限制短期记忆的数量
-                    max_short_history = 10  # 设置合理的短期记忆限制
-                    short_history = sys_config.memory_storage_driver.search_short_memory(
-                        query_text=query, you_name=you_name, role_name=role_name)
-                    if len(short_history) > max_short_history:
-                        logger.info(f"短期记忆超过{max_short_history}条，进行截断")
-                        short_history = short_history[-max_short_history:]
-                    
-                    # 只有在启用长期记忆功能时才检索长期记忆
-                    if sys_config.enable_longMemory and hasattr(sys_config.memory_storage_driver, 'long_memory_storage'):
-                        try:
-                            long_history = sys_config.memory_storage_driver.search_lang_memory(
-                                prompt=query,  # 使用正确的参数名
-                                you_name=you_name,
-                                role_name=role_name
-                            )
-                            
-                            # 记录长期记忆的长度
-                            logger.info(f"检索到的长期记忆长度: {len(long_history)}")
-                            
-                            # 如果长期记忆为空，记录原因
-                            if not long_history:
-                                logger.debug("未找到相关的长期记忆")
-                            
-                            # 设置安全的最大长度限制
-                            max_length = 2000  # 明确定义最大长度
-                            if len(long_history) > max_length:
-                                logger.info(f"长期记忆长度超过{max_length}个字符，进行截断")
-                                # 在完整句子处截断
-                                truncated = long_history[:max_length]
-                                last_period = max(
-                                    truncated.rfind('。'),
-                                    truncated.rfind('！'),
-                                    truncated.rfind('？'),
-                                    truncated.rfind('\n')
-                                )
-                                if last_period > 0:
-                                    long_history = truncated[:last_period + 1]
-                                else:
-                                    long_history = truncated
-                                logger.info(f"截断后的长期记忆长度: {len(long_history)}")
-                        except Exception as mem_err:
-                            logger.error(f"检索长期记忆失败: {str(mem_err)}")
-                            stack_trace = traceback.format_exc()
-                            logger.error(f"详细错误信息: {stack_trace}")
-                            long_history = ""
-                else:
-                    logger.warning("记忆驱动未初始化，跳过记忆检索")
-            except Exception as e:
-                logger.error(f"检索记忆失败: {str(e)}")
-                stack_trace = traceback.format_exc()
-                logger.error(f"详细错误信息: {stack_trace}")
-                short_history = []
-                long_history = ""
-
             current_time = get_current_time_str()
             logger.info(f"格式化prompt前: 长期记忆长度={len(long_history)}")
             
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from ..utils.cache_utils import LruTtlCache
+
+logger = logging.getLogger(__name__)
+
+# 检索阶段的工作线程数
+RETRIEVAL_WORKERS = 8
+# 每个来源同时执行的任务数上限；超时的任务仍占用工作线程，达到上限时新请求直接使用回退结果，
+# 不再排队，4个来源的上限之和不超过工作线程数，慢来源不会挤占其他来源
+MAX_INFLIGHT_PER_SOURCE = 2
+# 各检索来源的超时时间（秒），超时后使用上一次成功的结果或空结果，不再等待
+RETRIEVAL_TIMEOUTS = {
+    "character": 5.0,
+    "dialogue_examples": 1.5,
+    "short_memory": 0.5,
+    "long_memory": 1.5,
+}
+DEFAULT_RETRIEVAL_TIMEOUT = 1.0
+# 每个来源缓存的最近成功结果数量
+FALLBACK_CACHE_SIZE = 256
+
+
+class RetrievalTask:
+    """一次提交的检索任务"""
+
+    def __init__(self, source: str, key: Hashable, future: Optional[Future], started: float,
+                 fallback: bool = True) -> None:
+        self.source = source
+        self.key = key
+        # 来源的进行中任务达到上限时未提交，future为None
+        self.future = future
+        self.started = started
+        self.fallback = fallback
+
+
+class RetrievalStage:
+    """
+    对话前的检索阶段
+    各检索来源（角色、对话示例、短期记忆、长期记忆）提交到线程池并发执行，首个token的等待时间由各来源之和变为最慢的一个；
+    每个来源有各自的超时时间，超时或出错时回退到该来源上一次成功的结果（没有则为空结果），并记录各来源耗时；
+    每个来源进行中的任务数有上限，超时后仍在执行的任务不会在线程池中无限积压
+    """
+
+    def __init__(self, workers: int = RETRIEVAL_WORKERS, timeouts: Optional[Dict[str, float]] = None,
+                 max_inflight: int = MAX_INFLIGHT_PER_SOURCE) -> None:
+        self.timeouts = dict(RETRIEVAL_TIMEOUTS, **(timeouts or {}))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-retrieval")
+        self._fallbacks = LruTtlCache(max_size=FALLBACK_CACHE_SIZE * len(self.timeouts))
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.max_inflight = max_inflight
+        self._inflight: Dict[str, int] = defaultdict(int)
+
+    def submit(self, source: str, key: Hashable, fn: Callable[..., Any], *args,
+               fallback: bool = True, **kwargs) -> RetrievalTask:
+        """
+        提交检索任务
+        :param key: 回退缓存的键，任务成功时以(source, key)缓存结果
+        :param fallback: 超时或出错时是否使用该键上一次成功的结果；结果随对话变化的来源（如短期记忆）应传False
+        """
+        started = time.monotonic()
+        with self._lock:
+            if self._inflight[source] >= self.max_inflight:
+                logger.warning(f"检索来源{source}有{self._inflight[source]}个任务仍在执行，跳过本次检索")
+                self._record_locked(source, "skipped")
+                return RetrievalTask(source, key, None, started, fallback)
+            self._inflight[source] += 1
+
+        def run():
+            result = fn(*args, **kwargs)
+            self._fallbacks.put((source, key), result)
+            self._record(source, "completed", time.monotonic() - started)
+            return result
+
+        def done(_future):
+            with self._lock:
+                self._inflight[source] -= 1
+
+        future = self._executor.submit(run)
+        future.add_done_callback(done)
+        return RetrievalTask(source, key, future, started, fallback)
+
+    def result(self, task: RetrievalTask, default: Any = None, timings: Optional[Dict[str, float]] = None) -> Any:
+        """
+        在该来源的超时时间内等待结果，超时或出错时返回缓存的结果或default
+        :param timings: 传入时记录该来源的等待耗时（毫秒）
+        """
+        timeout = self.timeouts.get(task.source, DEFAULT_RETRIEVAL_TIMEOUT)
+        if task.future is None:
+            result = self._fallback(task, default)
+        else:
+            try:
+                result = task.future.result(timeout=max(0.0, task.started + timeout - time.monotonic()))
+            except FutureTimeoutError:
+                logger.warning(f"检索来源{task.source}超过{timeout}s，使用回退结果")
+                self._record(task.source, "timeouts")
+                result = self._fallback(task, default)
+            except Exception as e:
+                logger.error(f"检索来源{task.source}失败: {str(e)}")
+                self._record(task.source, "errors")
+                result = self._fallback(task, default)
+        if timings is not None:
+            timings[task.source] = round((time.monotonic() - task.started) * 1000, 1)
+        return result
+
+    def _fallback(self, task: RetrievalTask, default: Any) -> Any:
+        if not task.fallback:
+            return default
+        return self._fallbacks.get((task.source, task.key), default)
+
+    def cached(self, source: str, key: Hashable, default: Any = None) -> Any:
+        """获取来源上一次成功的结果"""
+        return self._fallbacks.get((source, key), default)
+
+    def _record(self, source: str, event: str, elapsed: Optional[float] = None) -> None:
+        with self._lock:
+            self._record_locked(source, event, elapsed)
+
+    def _record_locked(self, source: str, event: str, elapsed: Optional[float] = None) -> None:
+        stats = self._stats.setdefault(source, {"completed": 0, "timeouts": 0, "errors": 0, "skipped": 0,
+                                                "total_ms": 0.0, "max_ms": 0.0})
+        stats[event] += 1
+        if elapsed is not None:
+            elapsed_ms = elapsed * 1000
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """各来源的完成次数、超时次数、出错次数、跳过次数、进行中任务数和耗时"""
+        with self._lock:
+            result = {}
+            for source, stats in self._stats.items():
+                result[source] = dict(stats)
+                result[source]["inflight"] = self._inflight.get(source, 0)
+                result[source]["avg_ms"] = stats["total_ms"] / stats["completed"] if stats["completed"] else 0.0
+            return result
@@ -11,12 +11,24 @@ def ready():
     
     # 初始化默认角色
     init_default_role()
+
+    # 后台预热分词器，避免首次对话时才加载jieba词典
+    warmup_tokenizer()
     
     # 其他初始化操作...
     
     logger.info("========== 初始化完成 ==========")
 
 
+def warmup_tokenizer():
+    """从缓存目录加载预构建的jieba词典和IDF表"""
+    try:
+        from .utils.tokenizer_utils import get_tokenizer
+        get_tokenizer().warmup(background=True)
+    except Exception as e:
+        logger.error(f"分词器预热失败: {str(e)}")
+
+
 def init_default_role():
     """确保默认角色（爱莉）存在于数据库中"""
     from .models import CustomRoleModel
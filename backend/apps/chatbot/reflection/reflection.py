@@ -51,7 +51,7 @@ class ImportanceRating:
         prompt = input_prompt + self.output_prompt
         result = self.llm_model_driver.chat(
             prompt=prompt, type=self.llm_model_driver_type, role_name="", you_name="", query="",
-            short_history=[], long_history="")
+            short_history=[], long_history="", cache="importance_rating")
         logger.debug(f"=># ImportanceRating # => 当前记忆重要性评分:{result}")
         rating = "1"
         try:
@@ -188,7 +188,7 @@ class PortraitAnalysis:
         logger.debug(f"=> prompt:{prompt}")
         result = self.llm_model_driver.chat(
             prompt=prompt, type=self.llm_model_driver_type, role_name="", you_name="", query="",
-            short_history=[], long_history="")
+            short_history=[], long_history="", cache="portrait_analysis")
         logger.debug(f"=> personas:{result}")
         analysis = "无"
         try:
@@ -1,3 +1,3 @@
-from .snowflake_utils import SnowFlake
+from .snowflake_utils import SnowFlake, get_snow_flake
 
-singleton_snow_flake = SnowFlake(1, 1)
+singleton_snow_flake = get_snow_flake(1)
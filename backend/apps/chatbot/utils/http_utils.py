@@ -0,0 +1,115 @@
+import importlib.util
+import logging
+import os
+import threading
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 连接池参数，可通过环境变量覆盖
+# 缓存连接池的主机数
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 16))
+# 每个主机保持的最大连接数
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 32))
+# 空闲连接保持的秒数
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60))
+# 默认请求超时（秒）
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 60))
+
+
+class _TimeoutAdapter(HTTPAdapter):
+    """未指定超时的请求使用默认超时，避免连接池中的连接被挂起的请求长期占用"""
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = HTTP_TIMEOUT
+        return super().send(request, **kwargs)
+
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def http2_available() -> bool:
+    """是否安装了h2，安装后httpx客户端对支持的主机使用HTTP/2"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _httpx_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+                        max_keepalive_connections=HTTP_POOL_MAXSIZE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+
+def get_http_session() -> requests.Session:
+    """
+    获取进程内共享的requests会话
+    按主机保持keep-alive连接池，同一主机的后续请求复用已建立的TCP+TLS连接，不再重复DNS解析和握手
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = _TimeoutAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_http_client() -> httpx.Client:
+    """获取进程内共享的httpx同步客户端（LLM SDK使用），安装h2时启用HTTP/2"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(http2=http2_available(), limits=_httpx_limits(),
+                                       timeout=HTTP_TIMEOUT)
+    return _client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    获取进程内共享的httpx异步客户端
+    异步客户端的连接绑定在首次使用的事件循环上，只应在模型驱动的常驻事件循环中使用
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = httpx.AsyncClient(http2=http2_available(), limits=_httpx_limits(),
+                                                  timeout=HTTP_TIMEOUT)
+    return _async_client
+
+
+def configure_http(pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None,
+                   keepalive_expiry: Optional[float] = None, timeout: Optional[float] = None) -> None:
+    """调整连接池参数，只影响之后创建的会话和客户端，需在启动时、首次请求前调用"""
+    global HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_KEEPALIVE_EXPIRY, HTTP_TIMEOUT
+    if pool_connections is not None:
+        HTTP_POOL_CONNECTIONS = int(pool_connections)
+    if pool_maxsize is not None:
+        HTTP_POOL_MAXSIZE = int(pool_maxsize)
+    if keepalive_expiry is not None:
+        HTTP_KEEPALIVE_EXPIRY = float(keepalive_expiry)
+    if timeout is not None:
+        HTTP_TIMEOUT = float(timeout)
+
+
+def close_http_clients() -> None:
+    """关闭共享的同步会话和客户端（异步客户端随驱动事件循环结束）"""
+    global _session, _client
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+        if _client is not None:
+            _client.close()
+            _client = None
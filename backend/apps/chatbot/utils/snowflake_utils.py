@@ -1,5 +1,14 @@
+import os
 import time
 import logging
+import threading
+from typing import Dict, IO, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # 分配位置
 WORKER_BITS = 5
@@ -20,6 +29,86 @@ SEQUENCE_MASK = -1 ^ (-1 << SEQUENCE_BITS)  # 掩码
 EPOCH = 1577808001000  # 元时间戳 此处元设为 2020-01-01 00:00:01
 
 
+# 机器编号的环境变量，未配置时在锁文件目录中自动占用一个空闲编号
+WORKER_ID_ENV = "SNOWFLAKE_WORKER_ID"
+WORKER_LOCK_DIR = os.environ.get("SNOWFLAKE_LOCK_DIR", os.path.join("storage", "snowflake"))
+
+# 本进程已占用的锁文件路径 -> 文件句柄，锁随句柄持有到进程退出
+_claimed: Dict[str, IO] = {}
+# 锁文件目录 -> 本进程自动分配的机器编号
+_auto_worker_ids: Dict[str, int] = {}
+_claim_lock = threading.Lock()
+_snow_flakes: Dict[tuple, "SnowFlake"] = {}
+
+
+class WorkerIdConflictError(RuntimeError):
+    """机器编号已被同一台机器上的其他进程占用，继续运行会生成重复的ID"""
+
+
+def _try_lock(worker_id: int, lock_dir: str) -> bool:
+    """以非阻塞方式独占机器编号对应的锁文件，调用方需持有_claim_lock"""
+    path = os.path.abspath(os.path.join(lock_dir, f"worker_{worker_id:02d}.lock"))
+    if path in _claimed:
+        return True
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_file = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return False
+    _claimed[path] = lock_file
+    return True
+
+
+def allocate_worker_id(worker_id: int = -1, lock_dir: Optional[str] = None) -> int:
+    """
+    确定本进程的机器编号
+    依次使用参数、环境变量SNOWFLAKE_WORKER_ID，均未指定时占用锁文件目录中第一个空闲编号（同一进程只分配一次）；
+    编号以锁文件独占，进程退出时自动释放
+    :param worker_id: 配置的机器编号，-1表示未配置
+    :raises WorkerIdConflictError: 指定的编号已被其他进程占用，或没有空闲编号
+    """
+    lock_dir = os.path.abspath(lock_dir or WORKER_LOCK_DIR)
+    if worker_id < 0 and os.environ.get(WORKER_ID_ENV):
+        worker_id = int(os.environ[WORKER_ID_ENV])
+    with _claim_lock:
+        if worker_id >= 0:
+            if worker_id > WORKER_UPPER_LIMIT:
+                raise ValueError("WORKER ID 高于上限")
+            if not _try_lock(worker_id, lock_dir):
+                raise WorkerIdConflictError(f"机器编号{worker_id}已被其他进程占用（{lock_dir}），"
+                                            f"请为每个工作进程配置不同的编号")
+            return worker_id
+        if lock_dir not in _auto_worker_ids:
+            for candidate in range(WORKER_UPPER_LIMIT + 1):
+                if _try_lock(candidate, lock_dir):
+                    _auto_worker_ids[lock_dir] = candidate
+                    logging.info(f"雪花算法机器编号: {candidate}")
+                    break
+            else:
+                raise WorkerIdConflictError(f"{lock_dir}中的{WORKER_UPPER_LIMIT + 1}个机器编号均已被占用")
+        return _auto_worker_ids[lock_dir]
+
+
+def get_snow_flake(data_center_id: int, worker_id: int = -1) -> "SnowFlake":
+    """
+    获取进程内共享的ID生成器，同一数据中心和机器编号只创建一个实例，重复创建的实例会生成相同的ID
+    :param worker_id: 配置的机器编号，-1表示自动分配（见allocate_worker_id）
+    """
+    worker_id = allocate_worker_id(worker_id)
+    key = (data_center_id, worker_id)
+    with _claim_lock:
+        snow_flake = _snow_flakes.get(key)
+        if snow_flake is None:
+            snow_flake = _snow_flakes[key] = SnowFlake(data_center_id, worker_id)
+        return snow_flake
+
+
 class SnowFlake(object):
 
     def __init__(self, data_center_id, worker_id, sequence=0):
@@ -41,6 +130,7 @@ class SnowFlake(object):
         self.sequence = sequence
 
         self.last_timestamp = -1  # 最近一次生成编号的时间戳
+        self._lock = threading.Lock()
 
     @staticmethod
     def _timestamp(n=1e3) -> int:
@@ -54,16 +144,16 @@ class SnowFlake(object):
         """
         超限检查
         :param timestamp:
-        :return:
+        :return: 用于生成编号的时间戳
         """
         self._time_back_off_check(timestamp)
-        self._number_check(timestamp)
+        return self._number_check(timestamp)
 
     def _number_check(self, timestamp):
         """
         数超限检查，检查当前时间生成的编号是否超过上限，超过上限则的等到下一个时间生成
         :param timestamp:
-        :return:
+        :return: 用于生成编号的时间戳，序号溢出时为下一个时间
         """
         if timestamp == self.last_timestamp:
             self.sequence = (self.sequence + 1) & SEQUENCE_MASK
@@ -71,6 +161,7 @@ class SnowFlake(object):
                 timestamp = self._wait_next_time(self.last_timestamp)
         else:
             self.sequence = 0
+        return timestamp
 
     def _time_back_off_check(self, timestamp):
         if timestamp < self.last_timestamp:
@@ -82,10 +173,10 @@ class SnowFlake(object):
         获取一个编号
         :return:
         """
-        timestamp = self._timestamp()
-        self._check(timestamp)
-        self.last_timestamp = timestamp
-        return self._generate(timestamp)
+        with self._lock:
+            timestamp = self._check(self._timestamp())
+            self.last_timestamp = timestamp
+            return self._generate(timestamp)
 
     def _generate(self, timestamp) -> int:
         """ 生成一个编号
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import jieba
+from jieba.analyse import TFIDF
+
+from .cache_utils import LruTtlCache
+
+logger = logging.getLogger(__name__)
+
+# jieba前缀词典缓存目录，预构建的词典保存在此处，启动时直接加载，不受系统临时目录清理影响
+TOKENIZER_CACHE_DIR = "storage/jieba"
+# 每条文本保留的关键词数量（短期记忆标签使用20个，长期记忆使用前5个）
+MAX_KEYWORDS = 20
+# 批量分词时启用进程池的最小文本数
+POOL_MIN_BATCH = 64
+POOL_CHUNK_SIZE = 16
+
+
+class TokenizedText(NamedTuple):
+    """一次分词的结果：分词序列和按TF-IDF权重降序排列的关键词"""
+    tokens: Tuple[str, ...]
+    keywords: Tuple[str, ...]
+
+
+def _analyze(tfidf: TFIDF, text: str) -> TokenizedText:
+    """
+    分词并提取关键词，只调用一次jieba.cut
+    关键词的计算与jieba.analyse.TFIDF.extract_tags相同，只是复用已有的分词结果
+    """
+    tokens = tuple(tfidf.tokenizer.cut(text))
+    freq = {}
+    for token in tokens:
+        if len(token.strip()) < 2 or token.lower() in tfidf.stop_words:
+            continue
+        freq[token] = freq.get(token, 0.0) + 1.0
+    total = sum(freq.values())
+    for token in freq:
+        freq[token] *= tfidf.idf_freq.get(token, tfidf.median_idf) / total
+    keywords = tuple(sorted(freq, key=freq.__getitem__, reverse=True)[:MAX_KEYWORDS])
+    return TokenizedText(tokens, keywords)
+
+
+# 进程池工作进程中的TF-IDF实例
+_worker_tfidf: Optional[TFIDF] = None
+
+
+def _init_worker(cache_dir: Optional[str]) -> None:
+    global _worker_tfidf
+    if cache_dir:
+        jieba.dt.tmp_dir = cache_dir
+    jieba.initialize()
+    _worker_tfidf = TFIDF()
+
+
+def _analyze_in_worker(text: str) -> TokenizedText:
+    return _analyze(_worker_tfidf, text)
+
+
+class Tokenizer:
+    """
+    共享的分词服务
+    - 启动时预热：从缓存目录加载预构建的jieba前缀词典并加载IDF表，避免首次对话时才加载词典
+    - 每条文本只分词一次，分词序列和关键词一起缓存，长期记忆和短期记忆复用同一结果
+    - 批量分词可选使用进程池
+    """
+
+    def __init__(self, cache_dir: Optional[str] = TOKENIZER_CACHE_DIR, cache_size: int = 10000,
+                 processes: int = 0) -> None:
+        """
+        :param cache_dir: jieba词典缓存目录，None表示使用系统临时目录
+        :param processes: 批量分词使用的进程数，0表示不使用进程池
+        """
+        self.cache_dir = cache_dir
+        self.processes = processes
+        self._cache = LruTtlCache(max_size=cache_size)
+        self._tfidf: Optional[TFIDF] = None
+        self._init_lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def warmup(self, background: bool = True) -> None:
+        """预热分词器：加载jieba词典和IDF表"""
+        if background:
+            threading.Thread(target=self._get_tfidf, name="tokenizer-warmup", daemon=True).start()
+        else:
+            self._get_tfidf()
+
+    def _get_tfidf(self) -> TFIDF:
+        if self._tfidf is None:
+            with self._init_lock:
+                if self._tfidf is None:
+                    started = time.time()
+                    if self.cache_dir:
+                        try:
+                            os.makedirs(self.cache_dir, exist_ok=True)
+                            jieba.dt.tmp_dir = self.cache_dir
+                        except OSError as e:
+                            logger.warning(f"无法创建分词词典缓存目录，使用系统临时目录: {str(e)}")
+                    jieba.initialize()
+                    self._tfidf = TFIDF()
+                    logger.info(f"分词器预热完成，耗时 {time.time() - started:.2f}s")
+        return self._tfidf
+
+    def analyze(self, text: str) -> TokenizedText:
+        """分词并提取关键词，最近处理过的文本直接返回缓存结果"""
+        result = self._cache.get(text)
+        if result is None:
+            result = _analyze(self._get_tfidf(), text)
+            self._cache.put(text, result)
+        return result
+
+    def tokens(self, text: str) -> List[str]:
+        return list(self.analyze(text).tokens)
+
+    def keywords(self, text: str, top_k: int = MAX_KEYWORDS) -> List[str]:
+        """按TF-IDF权重降序返回前top_k个关键词（top_k不超过20）"""
+        return list(self.analyze(text).keywords[:top_k])
+
+    def analyze_many(self, texts: Sequence[str]) -> List[TokenizedText]:
+        """批量分词，未命中缓存的文本较多且配置了进程数时使用进程池"""
+        results: List[Optional[TokenizedText]] = [self._cache.get(text) for text in texts]
+        missing = [position for position, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        pending = list(dict.fromkeys(texts[position] for position in missing))
+        computed = None
+        if self.processes > 0 and len(pending) >= POOL_MIN_BATCH:
+            try:
+                computed = list(self._get_pool().map(_analyze_in_worker, pending, chunksize=POOL_CHUNK_SIZE))
+            except Exception as e:
+                logger.warning(f"进程池分词失败，改为在当前进程中分词: {str(e)}")
+        if computed is None:
+            tfidf = self._get_tfidf()
+            computed = [_analyze(tfidf, text) for text in pending]
+        analyzed = dict(zip(pending, computed))
+        for text, result in analyzed.items():
+            self._cache.put(text, result)
+        for position in missing:
+            results[position] = analyzed[texts[position]]
+        return results
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                                 initargs=(self.cache_dir,))
+            return self._pool
+
+    def configure(self, processes: Optional[int] = None) -> None:
+        """调整批量分词的进程数，已创建的进程池会被关闭"""
+        if processes is not None and processes != self.processes:
+            with self._pool_lock:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                self.processes = max(0, int(processes))
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats()
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Tokenizer:
+    """获取进程内共享的分词服务"""
+    return Tokenizer()
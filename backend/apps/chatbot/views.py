@@ -643,7 +643,10 @@ def check_memory_status(request):
     - faiss_index_exists: FAISS索引文件是否存在
     - faiss_index_info: FAISS索引信息
     - metadata_db_exists: 元数据库是否存在
-    - metadata_db_count: 元数据库记录数
+    - metadata_db_count: 元数据库记录数（读取维护的计数器）
+    - metadata_owner_counts: 每个角色的记忆条数
+    - cache_stats: 查询结果与元数据行缓存的命中/未命中/淘汰统计
+    - embedding_cache_stats: 文本向量缓存（内存/磁盘）统计
     """
     try:
         from .config import get_sys_config
@@ -665,12 +668,23 @@ def check_memory_status(request):
         # 检查记忆驱动是否初始化
         if hasattr(sys_config, 'memory_storage_driver') and sys_config.memory_storage_driver is not None:
             memory_status["memory_driver_initialized"] = True
+            summary_pipeline = getattr(sys_config.memory_storage_driver, 'summary_pipeline', None)
+            if summary_pipeline is not None:
+                memory_status["summary_stats"] = summary_pipeline.stats()
             
             # 如果驱动初始化，检查长期记忆存储是否初始化
             if hasattr(sys_config.memory_storage_driver, 'long_memory_storage') and sys_config.memory_storage_driver.long_memory_storage is not None:
                 # 获取配置信息
                 faiss_storage = sys_config.memory_storage_driver.long_memory_storage
                 
+                # 缓存统计
+                if hasattr(faiss_storage, 'cache_stats'):
+                    memory_status["cache_stats"] = faiss_storage.cache_stats()
+                if hasattr(faiss_storage, 'embedding'):
+                    memory_status["embedding_cache_stats"] = faiss_storage.embedding.cache_stats()
+                if hasattr(faiss_storage, 'retention_stats'):
+                    memory_status["retention_stats"] = faiss_storage.retention_stats()
+                
                 # 检查索引文件
                 memory_status["faiss_index_exists"] = os.path.exists(faiss_storage.index_path)
                 if memory_status["faiss_index_exists"]:
@@ -679,6 +693,9 @@ def check_memory_status(request):
                         "size": os.path.getsize(faiss_storage.index_path),
                         "dimensions": faiss_storage.dimension,
                         "vectors_count": faiss_storage.index.ntotal if hasattr(faiss_storage, 'index') else 0,
+                        "index_type": faiss_storage.index.kind if hasattr(faiss_storage, 'index') else None,
+                        "memory_mapped": faiss_storage.index.base_mmapped if hasattr(faiss_storage, 'index') else False,
+                        "consolidated_count": getattr(faiss_storage, 'consolidated_count', 0),
                         "last_modified": os.path.getmtime(faiss_storage.index_path)
                     }
                 
@@ -686,14 +703,9 @@ def check_memory_status(request):
                 memory_status["metadata_db_exists"] = os.path.exists(faiss_storage.metadata_db)
                 if memory_status["metadata_db_exists"]:
                     try:
-                        # 连接到数据库检查记录数
-                        import sqlite3
-                        conn = sqlite3.connect(faiss_storage.metadata_db)
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT COUNT(*) FROM memory_metadata")
-                        count = cursor.fetchone()[0]
-                        memory_status["metadata_db_count"] = count
-                        conn.close()
+                        # 读取元数据库维护的计数器，无需COUNT(*)全表扫描
+                        memory_status["metadata_db_count"] = faiss_storage.count()
+                        memory_status["metadata_owner_counts"] = faiss_storage.owner_counts()
                     except Exception as e:
                         memory_status["metadata_db_error"] = str(e)
         
@@ -750,7 +762,8 @@ def reinitialize_memory_service(request):
             try:
                 logger.info(f"关闭现有记忆模块，长期记忆状态: {had_long_memory}")
                 
-                # 清理资源
+                # 清理资源，待写入的对话先落盘
+                sys_config.memory_storage_driver.close()
                 sys_config.memory_storage_driver = None
             except Exception as e:
                 logger.error(f"关闭现有记忆模块失败: {str(e)}")
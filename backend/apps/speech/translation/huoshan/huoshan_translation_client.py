@@ -1,6 +1,7 @@
 import json
 import os
 from ..base_translation_client import BaseTranslationClient
+from ....chatbot.utils.http_utils import get_http_session
 from volcengine.ApiInfo import ApiInfo
 from volcengine.Credentials import Credentials
 from volcengine.ServiceInfo import ServiceInfo
@@ -34,6 +35,9 @@ class HuoShanTranslationClient(BaseTranslationClient):
             'translate': ApiInfo('POST', '/', self.query, {}, {})
         }
         self.service = Service(self.service_info, self.api_info)
+        # 使用共享会话的keep-alive连接池
+        if hasattr(self.service, "session"):
+            self.service.session = get_http_session()
 
     def translation(self, text: str, target_language: str) -> str:
         body = {
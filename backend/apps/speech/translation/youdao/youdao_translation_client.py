@@ -1,7 +1,7 @@
-import requests
 import os
 import json
 from ..utils.AuthV3Util import addAuthParams
+from ....chatbot.utils.http_utils import get_http_session
 
 # 您的应用ID
 APP_KEY = os.getenv("YOUDAO_APP_KEY")
@@ -19,6 +19,6 @@ class TranslationClient:
         data = {'q': q, 'from': lang_from, 'to': lang_to}
         addAuthParams(APP_KEY, APP_SECRET, data)
         header = {'Content-Type': 'application/x-www-form-urlencoded'}
-        res = requests.post('https://openapi.youdao.com/api', data, header)
+        res = get_http_session().post('https://openapi.youdao.com/api', data=data, headers=header)
         content = str(res.content, 'utf-8')
         return json.loads(content)
\ No newline at end of file
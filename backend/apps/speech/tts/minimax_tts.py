@@ -7,6 +7,8 @@ import uuid
 import binascii
 from urllib.parse import urljoin
 
+from ...chatbot.utils.http_utils import get_http_session
+
 logger = logging.getLogger(__name__)
 
 # Minimax TTS 声音列表
@@ -163,8 +165,8 @@ class MinimaxTTS:
             logger.info(f"发送流式TTS请求到 {url}")
             logger.debug(f"请求数据: {json.dumps(request_data, ensure_ascii=False)}")
             
-            # 设置超时时间并发送请求
-            response = requests.post(url, headers=headers, json=request_data, stream=True, timeout=30)
+            # 设置超时时间并发送请求，使用共享会话复用已建立的连接
+            response = get_http_session().post(url, headers=headers, json=request_data, stream=True, timeout=30)
             response.raise_for_status()
             
             logger.info(f"流式TTS请求成功，状态码: {response.status_code}")
@@ -213,6 +215,8 @@ class MinimaxTTS:
                     # 检查是否直接为MP3数据（以FF FB或FF F3开头）
                     if len(chunk) > 2 and chunk[0] == 0xFF and (chunk[1] == 0xFB or chunk[1] == 0xF3 or chunk[1] == 0xF2):
                         all_audio_data.extend(chunk)
+            # 读取完毕后将连接归还连接池
+            response.close()
             
             # 检查是否收集到数据
             if len(all_audio_data) == 0:
@@ -246,7 +250,7 @@ class MinimaxTTS:
             logger.info(f"发送非流式TTS请求到 {url}")
             logger.debug(f"请求数据: {json.dumps(request_data, ensure_ascii=False)}")
             
-            response = requests.post(url, headers=headers, json=request_data)
+            response = get_http_session().post(url, headers=headers, json=request_data)
             response.raise_for_status()
             
             # 检查响应类型
@@ -0,0 +1,18 @@
+import logging
+
+import pytest
+
+from apps.chatbot.memory.faiss.faiss_storage_impl import FAISSStorage
+
+
+@pytest.fixture
+def make_faiss_storage(tmp_path):
+    """在临时目录中创建FAISSStorage，默认关闭后台整理，测试中显式调用"""
+
+    def make(**config) -> FAISSStorage:
+        config.setdefault("data_dir", str(tmp_path / "memory"))
+        config.setdefault("consolidation_enabled", False)
+        return FAISSStorage(config)
+
+    logging.getLogger("apps.chatbot.memory").setLevel(logging.WARNING)
+    return make
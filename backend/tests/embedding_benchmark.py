@@ -0,0 +1,58 @@
+"""
+哈希嵌入微基准：对比逐元素循环的旧实现与NumPy向量化实现/批量接口
+运行方式（在backend目录下）：python -m tests.embedding_benchmark
+"""
+import hashlib
+import random
+import timeit
+
+import numpy as np
+
+from apps.chatbot.memory.embedding import Embedding
+
+
+def legacy_embedding(text: str, dimension: int = 768) -> np.ndarray:
+    """优化前的逐元素循环实现，作为基准与一致性校验的参照"""
+    if not text:
+        return np.zeros(dimension, dtype=np.float32)
+    vector = np.zeros(dimension, dtype=np.float32)
+    chunk_size = max(1, len(text) // 100)
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    for i, chunk in enumerate(chunks):
+        h = hashlib.sha256((chunk + str(i)).encode('utf-8')).digest()
+        for j in range(min(32, dimension // len(chunks))):
+            if i * 32 + j < dimension:
+                vector[i * 32 + j] = (h[j] / 128.0) - 1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return vector
+
+
+def main():
+    random.seed(0)
+    alphabet = "弹幕礼物晚安欢迎进入直播间主播你好谢谢喜欢abc123，。！？"
+    texts = ["".join(random.choice(alphabet) for _ in range(random.randint(2, 400))) for _ in range(1000)]
+    embedding = Embedding()
+
+    # 一致性校验：新实现必须与旧实现逐位相同，保证已有索引仍然有效
+    batch = embedding.get_embeddings(texts)
+    for text, row in zip(texts, batch):
+        expected = legacy_embedding(text)
+        assert expected.tobytes() == embedding.get_embedding_from_language_model(text).tobytes()
+        assert expected.tobytes() == row.tobytes()
+
+    number = 5
+    legacy = timeit.timeit(lambda: [legacy_embedding(t) for t in texts], number=number) / number
+    # 直接计时计算路径，避免向量缓存命中影响结果
+    single = timeit.timeit(lambda: [embedding._compute_embedding(t) for t in texts], number=number) / number
+    batched = timeit.timeit(lambda: embedding._compute_embeddings(texts), number=number) / number
+
+    print(f"文本数量: {len(texts)}")
+    print(f"旧版循环实现:   {legacy * 1000:.1f} ms")
+    print(f"向量化单条接口: {single * 1000:.1f} ms ({legacy / single:.1f}x)")
+    print(f"向量化批量接口: {batched * 1000:.1f} ms ({legacy / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import gc
+
+import numpy as np
+import pytest
+
+from apps.chatbot.memory.embedding_cache import EmbeddingCache
+
+
+def make_cache(path, **kwargs):
+    return EmbeddingCache(str(path), "test-model", dimension=8, disk_size=16, flush_interval=1, **kwargs)
+
+
+def reopen(cache, path):
+    cache.flush()
+    cache._lock_file.close()
+    del cache
+    gc.collect()
+    return make_cache(path)
+
+
+def test_disk_tier_survives_reopen(tmp_path):
+    cache = make_cache(tmp_path)
+    vector = np.arange(8, dtype=np.float32)
+    cache.put("你好", vector)
+
+    cache = reopen(cache, tmp_path)
+    assert np.array_equal(cache._disk_get(cache.make_key("你好")), vector)
+
+
+def test_row_with_unwritten_vector_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("你好", np.ones(8, dtype=np.float32))
+    cache.put("再见", np.full(8, 2, dtype=np.float32))
+    # 模拟崩溃：键已落盘，向量页没有落盘
+    cache._vectors[0] = 0
+    cache._vectors.flush()
+
+    cache = reopen(cache, tmp_path)
+    assert cache._disk_get(cache.make_key("你好")) is None
+    assert np.array_equal(cache._disk_get(cache.make_key("再见")), np.full(8, 2, dtype=np.float32))
+    assert cache.stats()["disk"]["size"] == 1
+
+
+def test_second_process_falls_back_to_memory_only(tmp_path):
+    owner = make_cache(tmp_path)
+    other = make_cache(tmp_path)
+
+    assert owner.stats()["disk"]["enabled"]
+    assert not other.stats()["disk"]["enabled"]
+    other.put("你好", np.ones(8, dtype=np.float32))
+    assert np.array_equal(other.get("你好"), np.ones(8, dtype=np.float32))
+    assert owner._disk_get(owner.make_key("你好")) is None
+
+
+def test_cached_vectors_cannot_be_modified_through_the_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    vector = np.ones(8, dtype=np.float32)
+    cache.put("你好", vector)
+    vector[0] = 5
+    cached = cache.get("你好")
+    assert cached[0] == 1
+
+    with pytest.raises(ValueError):
+        cached[0] = 7
+    assert cache.get("你好")[0] == 1
+
+    cache = reopen(cache, tmp_path)
+    # 磁盘命中后回填内存的向量同样只读
+    assert not cache.get("你好").flags.writeable
@@ -0,0 +1,158 @@
+import time
+
+import pytest
+
+from apps.chatbot.llms import load_balancer
+from apps.chatbot.llms.load_balancer import (CLOSED, HALF_OPEN, OPEN, EndpointConfig, LlmLoadBalancer,
+                                              NoAvailableEndpointError, load_endpoint_configs)
+
+COOLDOWN = 0.05
+
+
+class FakeInstance:
+    temperature = 0.7
+
+    def __init__(self, config):
+        self.url = config.url
+        self.model_name = config.model or "default"
+
+
+@pytest.fixture
+def make_balancer(monkeypatch):
+    monkeypatch.setattr(load_balancer, "OPEN_COOLDOWN", COOLDOWN)
+    monkeypatch.setattr(LlmLoadBalancer, "_create_instance", lambda self, config: FakeInstance(config))
+    return lambda *urls: LlmLoadBalancer("ollama", endpoints=list(urls))
+
+
+def fail(balancer):
+    with pytest.raises(IOError):
+        with balancer.acquire():
+            raise IOError("connection refused")
+
+
+def state(balancer, name):
+    return next(endpoint for endpoint in balancer.endpoints if endpoint.name == name).state
+
+
+def test_circuit_opens_then_half_open_probe_closes_it(make_balancer):
+    balancer = make_balancer("a")
+    for _ in range(load_balancer.FAILURE_THRESHOLD):
+        fail(balancer)
+
+    # 熔断：冷却期间立即失败，不排队等待
+    assert state(balancer, "a") == OPEN
+    with pytest.raises(NoAvailableEndpointError):
+        balancer.acquire()
+
+    # 冷却结束进入半开状态，只放行一个探测请求
+    time.sleep(COOLDOWN * 1.5)
+    probe = balancer.acquire()
+    assert state(balancer, "a") == HALF_OPEN
+    with pytest.raises(NoAvailableEndpointError):
+        balancer.acquire()
+
+    # 探测成功，恢复
+    with probe:
+        pass
+    assert state(balancer, "a") == CLOSED
+    with balancer.acquire():
+        pass
+
+
+def test_failed_probe_reopens_with_longer_cooldown(make_balancer):
+    balancer = make_balancer("a")
+    for _ in range(load_balancer.FAILURE_THRESHOLD):
+        fail(balancer)
+    time.sleep(COOLDOWN * 1.5)
+
+    fail(balancer)
+
+    endpoint = balancer.endpoints[0]
+    assert endpoint.state == OPEN
+    assert endpoint.cooldown == pytest.approx(COOLDOWN * 2)
+    time.sleep(COOLDOWN * 1.5)
+    # 翻倍后的冷却时间未到，仍然熔断
+    with pytest.raises(NoAvailableEndpointError):
+        balancer.acquire()
+
+
+def test_open_endpoint_is_skipped_and_faster_endpoint_preferred(make_balancer):
+    balancer = make_balancer("fast", "slow", "dead")
+    used = {"fast": 0, "slow": 0, "dead": 0}
+    for _ in range(60):
+        try:
+            with balancer.acquire() as lease:
+                used[lease.instance.url] += 1
+                if lease.instance.url == "dead":
+                    raise IOError("connection refused")
+                if lease.instance.url == "slow":
+                    time.sleep(0.005)
+        except IOError:
+            pass
+
+    assert used["dead"] == load_balancer.FAILURE_THRESHOLD
+    assert state(balancer, "dead") == OPEN
+    assert used["fast"] > used["slow"] * 3
+
+
+def test_cancelled_stream_is_not_counted_as_failure(make_balancer):
+    balancer = make_balancer("a")
+    for _ in range(load_balancer.FAILURE_THRESHOLD):
+        with pytest.raises(GeneratorExit):
+            with balancer.acquire():
+                raise GeneratorExit()
+
+    assert state(balancer, "a") == CLOSED
+    assert balancer.endpoints[0].failed_requests == 0
+
+
+def test_endpoint_configs_from_env(monkeypatch):
+    monkeypatch.setenv("ZHIPUAI_ENDPOINTS", '[{"model": "glm-4", "api_key_env": "KEY_A"}, '
+                                            '{"url": "http://b/v4", "model": "glm-4-flash", "api_key_env": "KEY_B"}]')
+    assert load_endpoint_configs("zhipuai") == [
+        EndpointConfig(model="glm-4", api_key_env="KEY_A"),
+        EndpointConfig(url="http://b/v4", model="glm-4-flash", api_key_env="KEY_B")
+    ]
+
+    monkeypatch.delenv("ZHIPUAI_ENDPOINTS")
+    monkeypatch.setenv("ZHIPUAI_BASE_URL", "http://a/v4, http://b/v4")
+    assert load_endpoint_configs("zhipuai") == [EndpointConfig(url="http://a/v4"), EndpointConfig(url="http://b/v4")]
+
+
+def test_each_endpoint_has_its_own_model_and_rate_limiter(make_balancer):
+    balancer = make_balancer(EndpointConfig(url="a", model="m1"), EndpointConfig(url="b", model="m2"))
+    first, second = balancer.endpoints
+    assert (first.name, first.model_name) == ("a/m1", "m1")
+    assert (second.name, second.model_name) == ("b/m2", "m2")
+    assert first.rate_limiter is not second.rate_limiter
+
+    with balancer.acquire(second) as lease:
+        assert lease.endpoint is second
+        assert lease.rate_limiter is second.rate_limiter
+
+
+def test_preferred_endpoint_falls_back_only_to_the_same_model(make_balancer):
+    balancer = make_balancer(EndpointConfig(url="a", model="m1"), EndpointConfig(url="b", model="m1"),
+                             EndpointConfig(url="c", model="m2"))
+    a, b, c = balancer.endpoints
+    for _ in range(load_balancer.FAILURE_THRESHOLD):
+        fail_on(balancer, a)
+
+    for _ in range(5):
+        with balancer.acquire(a) as lease:
+            assert lease.endpoint is b
+
+    for _ in range(load_balancer.FAILURE_THRESHOLD):
+        fail_on(balancer, b)
+    # 模型不同的端点不能替代，否则回答缓存的键与实际使用的模型不一致
+    with pytest.raises(NoAvailableEndpointError):
+        balancer.acquire(a)
+    with balancer.acquire() as lease:
+        assert lease.endpoint is c
+
+
+def fail_on(balancer, endpoint):
+    with pytest.raises(IOError):
+        with balancer.acquire(endpoint) as lease:
+            assert lease.endpoint is endpoint
+            raise IOError("connection refused")
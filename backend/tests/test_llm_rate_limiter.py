@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from apps.chatbot.llms.rate_limiter import RateLimitTimeoutError, TokenBucketLimiter
+
+
+def wait_for_queue(limiter, waiting, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while limiter.stats()["waiting"] < waiting:
+        assert time.monotonic() < deadline
+        time.sleep(0.002)
+
+
+def test_waiters_are_granted_in_arrival_order():
+    limiter = TokenBucketLimiter("fifo", requests_per_second=0, max_concurrent=1)
+    held = limiter.acquire()
+    granted = []
+
+    def work(i):
+        with limiter.acquire(timeout=5):
+            granted.append(i)
+
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=work, args=(i,))
+        thread.start()
+        threads.append(thread)
+        wait_for_queue(limiter, i + 1)
+    held.release()
+    for thread in threads:
+        thread.join()
+
+    assert granted == [0, 1, 2, 3, 4]
+
+
+def test_sync_and_async_callers_share_the_concurrency_limit():
+    limiter = TokenBucketLimiter("mixed", requests_per_second=0, max_concurrent=2)
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def enter():
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+
+    def leave():
+        nonlocal active
+        with lock:
+            active -= 1
+
+    def sync_call():
+        with limiter.acquire(timeout=5):
+            enter()
+            time.sleep(0.03)
+            leave()
+
+    async def async_call():
+        with await limiter.aacquire(timeout=5):
+            enter()
+            await asyncio.sleep(0.03)
+            leave()
+
+    async def main():
+        threads = [threading.Thread(target=sync_call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        await asyncio.gather(*(async_call() for _ in range(3)))
+        for thread in threads:
+            thread.join()
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_requests_per_second_spaces_out_requests():
+    limiter = TokenBucketLimiter("rps", requests_per_second=20, max_concurrent=0)
+    started = time.monotonic()
+    for _ in range(30):
+        limiter.acquire().release()
+    # 容量20的桶用完后按每秒20个补充，剩余10个约需0.5s
+    assert 0.4 < time.monotonic() - started < 0.9
+    assert limiter.stats()["throttled"] >= 9
+
+
+def test_timeout_leaves_queue_and_wakes_next_waiter():
+    limiter = TokenBucketLimiter("timeout", requests_per_second=0, max_concurrent=1)
+    held = limiter.acquire()
+    with pytest.raises(RateLimitTimeoutError):
+        limiter.acquire(timeout=0.05)
+    assert limiter.stats()["waiting"] == 0
+    assert limiter.stats()["timeouts"] == 1
+
+    # 排在超时请求之后的请求在名额释放后立即取得
+    result = []
+    thread = threading.Thread(target=lambda: result.append(limiter.acquire(timeout=2)))
+    thread.start()
+    wait_for_queue(limiter, 1)
+    held.release()
+    thread.join()
+    assert result and result[0].wait_time < 1.0
+
+
+def test_cancelled_async_waiter_leaves_queue():
+    limiter = TokenBucketLimiter("cancel", requests_per_second=0, max_concurrent=1)
+    held = limiter.acquire()
+
+    async def main():
+        task = asyncio.create_task(limiter.aacquire(timeout=5))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert limiter.stats()["waiting"] == 0
+    held.release()
+    with limiter.acquire(timeout=0.1):
+        pass
+
+
+def test_answer_tokens_are_charged_after_release():
+    limiter = TokenBucketLimiter("tpm", requests_per_second=0, max_concurrent=0, tokens_per_minute=600)
+    with limiter.acquire(tokens=590) as slot:
+        slot.add_tokens(10)
+    started = time.monotonic()
+    # 桶已用完，5个token按每秒10个补充约需0.5s
+    limiter.acquire(tokens=5).release()
+    assert 0.35 < time.monotonic() - started < 0.9
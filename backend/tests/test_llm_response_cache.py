@@ -0,0 +1,94 @@
+import threading
+import time
+
+from apps.chatbot.llms.response_cache import DiskResponseCache, LlmResponseCache, response_cache_key
+
+
+def run_concurrently(count, target):
+    barrier = threading.Barrier(count)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(target())
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_call_once():
+    cache = LlmResponseCache(max_size=10, path="")
+    calls = []
+
+    def call():
+        calls.append(1)
+        time.sleep(0.1)
+        return '{"intent": "chat"}'
+
+    results = run_concurrently(5, lambda: cache.get_or_call("intent", "k", call))
+
+    assert len(calls) == 1
+    assert results == ['{"intent": "chat"}'] * 5
+    stats = cache.stats()["sites"]["intent"]
+    assert stats["misses"] == 1 and stats["shared"] == 4
+
+
+def test_failed_call_is_not_shared_or_cached():
+    cache = LlmResponseCache(max_size=10, path="")
+    calls = []
+
+    def call():
+        calls.append(1)
+        time.sleep(0.05)
+        return None
+
+    results = run_concurrently(3, lambda: cache.get_or_call("intent", "k", call))
+
+    # 失败的结果不分享给等待中的调用，各自重新请求
+    assert results == [None] * 3
+    assert len(calls) == 3
+    assert cache.get("intent", "k") is None
+    assert cache.get_or_call("intent", "k", lambda: "") == ""
+    assert cache.get("intent", "k") is None
+
+
+def test_entries_expire_per_site(tmp_path):
+    cache = LlmResponseCache(max_size=10, path=str(tmp_path / "llm.db"), ttls={"topic": 0.1, "intent": 60})
+    cache.get_or_call("topic", "t", lambda: "话题")
+    cache.get_or_call("intent", "i", lambda: "意图")
+    time.sleep(0.15)
+
+    assert cache.get("topic", "t") is None
+    assert cache.get("intent", "i") == "意图"
+    # 磁盘中的记录同样按调用点的过期时间失效
+    restarted = LlmResponseCache(max_size=10, path=str(tmp_path / "llm.db"))
+    assert restarted.get("topic", "t") is None
+    assert restarted.get("intent", "i") == "意图"
+    assert restarted.stats()["sites"]["intent"]["disk_hits"] == 1
+
+
+def test_key_covers_model_temperature_and_prompt():
+    key = response_cache_key("gpt-4o-mini", 0.7, "提示词", "问题")
+    assert key == response_cache_key("gpt-4o-mini", 0.7, "提示词", "问题")
+    assert key != response_cache_key("gpt-4o-mini", 0.2, "提示词", "问题")
+    assert key != response_cache_key("qwen2", 0.7, "提示词", "问题")
+    assert key != response_cache_key("gpt-4o-mini", 0.7, "提示词2", "问题")
+
+
+def test_disk_cache_purges_expired_and_oldest_rows_while_writing(tmp_path):
+    disk = DiskResponseCache(str(tmp_path / "llm.db"), max_size=20)
+    assert disk.purge_every == 2
+    disk.put("expired", "topic", "旧话题", ttl=-1)
+    for i in range(30):
+        disk.put(f"k{i}", "intent", f"意图{i}", ttl=60)
+
+    count = disk._conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+    assert count <= 20 + disk.purge_every
+    assert disk._conn.execute("SELECT 1 FROM llm_response_cache WHERE key = 'expired'").fetchone() is None
+    # 超出容量时淘汰最早写入的条目
+    assert disk.get("k0") is None
+    assert disk.get("k29") == "意图29"
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+
+from apps.chatbot.llms.base import ERROR_REPLY
+from apps.chatbot.llms.event_loop import DriverEventLoop, iterate_blocking
+from apps.chatbot.llms.llm_model_strategy import LlmModelDriver
+
+
+def make_driver(tokens_by_query):
+    driver = LlmModelDriver()
+    driver.event_loop = DriverEventLoop(name="test-llm-event-loop")
+
+    async def astream(prompt, type, role_name, you_name, query, history):
+        for token in tokens_by_query[query]:
+            await asyncio.sleep(0.01)
+            yield token
+
+    driver.astream = astream
+    return driver
+
+
+def test_callbacks_run_on_calling_thread_not_event_loop():
+    driver = make_driver({"q": ["你", "好"]})
+    threads = []
+    deltas = []
+    answers = []
+
+    def realtime_callback(role_name, you_name, content, end_bool):
+        threads.append(threading.current_thread())
+        deltas.append((content, end_bool))
+
+    def conversation_end_callback(role_name, answer, you_name, query):
+        threads.append(threading.current_thread())
+        answers.append(answer)
+
+    driver.chatStream("p", "openai", "爱莉", "alan", "q", [], realtime_callback, conversation_end_callback)
+
+    assert deltas == [("你", False), ("好", False), ("", True)]
+    assert len(answers) == 1
+    assert all(thread is threading.current_thread() for thread in threads)
+
+
+def test_blocking_end_callback_does_not_stall_other_streams():
+    driver = make_driver({"slow": ["a"], "fast": ["b"] * 20})
+    finished = {}
+
+    def run(query, end_delay):
+        started = time.monotonic()
+
+        def conversation_end_callback(role_name, answer, you_name, query):
+            time.sleep(end_delay)
+
+        driver.chatStream("p", "openai", "爱莉", "alan", query, [], None, conversation_end_callback)
+        finished[query] = time.monotonic() - started
+
+    slow = threading.Thread(target=run, args=("slow", 1.0))
+    slow.start()
+    time.sleep(0.05)
+    run("fast", 0)
+    slow.join()
+
+    # 20个token每个约10ms，慢回调阻塞1秒期间另一流式对话仍正常推进
+    assert finished["fast"] < 0.8
+    assert finished["slow"] >= 1.0
+
+
+def test_achat_stream_runs_callbacks_off_the_caller_loop():
+    driver = make_driver({"q": ["x", "y"]})
+    threads = []
+
+    def realtime_callback(role_name, you_name, content, end_bool):
+        threads.append(threading.current_thread())
+
+    async def main():
+        await driver.achatStream("p", "openai", "爱莉", "alan", "q", [], realtime_callback, lambda *args: None)
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(main())
+    assert len(threads) == 3
+    assert all(thread is not loop_thread for thread in threads)
+
+
+def test_iterate_blocking_closes_response_on_early_stop():
+    class FakeResponse:
+        def __init__(self):
+            self.closed = False
+
+        def __iter__(self):
+            return iter(range(100))
+
+        def close(self):
+            self.closed = True
+
+    response = FakeResponse()
+
+    async def consume():
+        chunks = iterate_blocking(lambda: response)
+        async for item in chunks:
+            if item == 2:
+                break
+        await chunks.aclose()
+
+    asyncio.run(consume())
+    assert response.closed
+
+
+def test_iterate_stops_driver_side_stream_when_consumer_stops():
+    event_loop = DriverEventLoop(name="test-llm-iterate")
+    closed = threading.Event()
+
+    async def tokens():
+        try:
+            for i in range(1000):
+                await asyncio.sleep(0.005)
+                yield i
+        finally:
+            closed.set()
+
+    for item in event_loop.iterate(tokens()):
+        if item == 3:
+            break
+
+    assert closed.wait(1.0)
+
+
+def test_stream_error_reports_error_reply_on_calling_thread():
+    driver = make_driver({})
+
+    async def astream(prompt, type, role_name, you_name, query, history):
+        yield "半"
+        raise RuntimeError("connection reset")
+
+    driver.astream = astream
+    deltas = []
+    driver.chatStream("p", "openai", "爱莉", "alan", "q", [],
+                      lambda role_name, you_name, content, end_bool: deltas.append((content, end_bool)), None)
+
+    assert deltas == [("半", False), (ERROR_REPLY, True)]
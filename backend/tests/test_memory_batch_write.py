@@ -0,0 +1,47 @@
+import gc
+
+
+
+def test_save_many_writes_one_batch(make_faiss_storage):
+    storage = make_faiss_storage()
+    memories = [{"text": f"第{i}个观众的礼物是{gift}", "sender": f"viewer{i}", "owner": "爱莉"}
+                for i, gift in enumerate(["小花", "火箭", "蛋糕", "星星"])]
+    memories.append({"text": "", "sender": "viewer9", "owner": "爱莉"})
+
+    assert storage.save_many(memories) == 4
+
+    ids = [row[0] for row in storage.db.execute("SELECT id FROM memory_metadata")]
+    assert len(set(ids)) == 4
+    assert storage.index.ntotal == 4
+    assert storage.count("爱莉") == 4
+    assert storage.search("火箭", limit=1, sender="viewer1", owner="爱莉") == ["第1个观众的礼物是火箭"]
+
+
+def test_failed_index_write_rolls_back_metadata(make_faiss_storage, monkeypatch):
+    storage = make_faiss_storage()
+    storage.save("已有的记忆", "alan", "爱莉")
+
+    def broken_append(ids, vectors):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(storage.vector_log, "append_add", broken_append)
+    memories = [{"text": f"记忆{i}", "sender": "alan", "owner": "爱莉"} for i in range(3)]
+
+    assert storage.save_many(memories) == 0
+    assert storage.count("爱莉") == 1
+    assert storage.index.ntotal == 1
+    assert len(storage.keyword_index) == 1
+
+
+def test_batch_is_recovered_from_vector_log_after_restart(make_faiss_storage, tmp_path):
+    data_dir = str(tmp_path / "memory")
+    storage = make_faiss_storage(data_dir=data_dir)
+    assert storage.save_many([{"text": f"重启前保存的第{i}条记忆", "sender": "alan", "owner": "爱莉"}
+                              for i in range(3)]) == 3
+    storage.__del__()
+    del storage
+    gc.collect()
+
+    restarted = make_faiss_storage(data_dir=data_dir)
+    assert restarted.index.ntotal == 3
+    assert restarted.search("重启前保存的第2条记忆", limit=1, owner="爱莉") == ["重启前保存的第2条记忆"]
@@ -0,0 +1,32 @@
+def test_same_text_from_one_sender_is_merged(make_faiss_storage):
+    storage = make_faiss_storage()
+    for _ in range(3):
+        storage.save("欢迎来到直播间", "alan", "爱莉")
+
+    assert storage.consolidate("爱莉") == 2
+    assert storage.count("爱莉") == 1
+    row = tuple(storage.db.execute("SELECT sender, occurrences FROM memory_metadata").fetchone())
+    assert row == ("alan", 3)
+
+
+def test_same_text_from_different_senders_is_not_merged(make_faiss_storage):
+    storage = make_faiss_storage()
+    storage.save("欢迎来到直播间", "alan", "爱莉")
+    storage.save("欢迎来到直播间", "bob", "爱莉")
+    storage.save("欢迎来到直播间", "bob", "爱莉")
+
+    assert storage.consolidate("爱莉") == 1
+    rows = [tuple(row) for row in storage.db.execute(
+        "SELECT sender, occurrences FROM memory_metadata ORDER BY sender").fetchall()]
+    assert rows == [("alan", 1), ("bob", 2)]
+    # 发送者范围内的检索仍能找到各自的记忆
+    assert storage.search("欢迎来到直播间", limit=1, sender="alan", owner="爱莉") == ["欢迎来到直播间"]
+
+
+def test_same_text_under_different_owners_is_not_merged(make_faiss_storage):
+    storage = make_faiss_storage()
+    storage.save("欢迎来到直播间", "alan", "爱莉")
+    storage.save("欢迎来到直播间", "alan", "小月")
+
+    assert storage.consolidate() == 0
+    assert storage.owner_counts() == {"爱莉": 1, "小月": 1}
@@ -0,0 +1,51 @@
+def texts(storage, owner):
+    return {row[0] for row in storage.db.execute("SELECT text FROM memory_metadata WHERE owner = ?", (owner,))}
+
+
+def test_evicts_lowest_scoring_memories_over_owner_limit(make_faiss_storage):
+    storage = make_faiss_storage(max_memories_per_owner=4, retention_interval=3600)
+    for i in range(4):
+        storage.save(f"普通的第{i}条记忆", "alan", "爱莉", importance_score=1)
+    storage.save("重要的约定：下周一起看烟花", "alan", "爱莉", importance_score=9)
+    storage.save("常被提起的宠物名字叫团子", "alan", "爱莉", importance_score=1)
+    storage.save("另一个角色的普通记忆", "alan", "小月", importance_score=1)
+    for _ in range(3):
+        storage.query_cache.clear()
+        assert storage.search("宠物名字团子", limit=1, owner="爱莉") == ["常被提起的宠物名字叫团子"]
+
+    assert storage.retention.run_once() == 2
+
+    kept = texts(storage, "爱莉")
+    assert storage.count("爱莉") == 4
+    assert {"重要的约定：下周一起看烟花", "常被提起的宠物名字叫团子"} <= kept
+    # 其他所有者未超出上限，不受影响
+    assert texts(storage, "小月") == {"另一个角色的普通记忆"}
+    # 被淘汰的记忆也从向量索引和关键词索引中删除
+    assert len(storage.scopes.ids(owner="爱莉")) == 4
+    assert storage.retention_stats()["evicted_total"] == 2
+
+
+def test_eviction_is_spread_over_rounds_by_batch_size(make_faiss_storage):
+    storage = make_faiss_storage(max_memories_per_owner=2, eviction_batch_size=2, retention_interval=3600)
+    for i in range(7):
+        storage.save(f"第{i}条记忆", "alan", "爱莉")
+
+    assert storage.retention.run_once() == 2
+    assert storage.count("爱莉") == 5
+    assert storage.retention.run_once() == 2
+    assert storage.retention.run_once() == 1
+    assert storage.retention.run_once() == 0
+    assert storage.count("爱莉") == 2
+
+
+def test_access_counts_are_written_back(make_faiss_storage):
+    storage = make_faiss_storage(max_memories_per_owner=0, retention_interval=3600)
+    storage.save("宠物名字叫团子", "alan", "爱莉")
+    storage.search("团子", limit=1, owner="爱莉")
+    storage.search("团子", limit=1, owner="爱莉")
+
+    assert storage.retention.run_once() == 0
+    access_count, last_access = storage.db.execute(
+        "SELECT access_count, last_access FROM memory_metadata").fetchone()
+    assert access_count == 2
+    assert last_access is not None
@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+
+import pytest
+
+from apps.chatbot.memory.faiss import faiss_storage_impl, metadata_store
+from apps.chatbot.memory.faiss.metadata_store import SCHEMA_MIGRATIONS, ThreadSafeSQLite, migrate_schema
+
+
+def columns(db):
+    return {row[1] for row in db.execute("PRAGMA table_info(memory_metadata)").fetchall()}
+
+
+def user_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_failed_migration_rolls_back_schema_and_version(tmp_path, monkeypatch):
+    db = ThreadSafeSQLite(str(tmp_path / "metadata.db"))
+    migrate_schema(db)
+
+    def broken(db):
+        db.execute("ALTER TABLE memory_metadata ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(metadata_store, "SCHEMA_MIGRATIONS", SCHEMA_MIGRATIONS + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        migrate_schema(db)
+
+    assert "pinned" not in columns(db)
+    assert user_version(db) == len(SCHEMA_MIGRATIONS)
+
+
+def test_migration_resumes_after_partially_added_columns(tmp_path):
+    db = ThreadSafeSQLite(str(tmp_path / "metadata.db"))
+    for migration in SCHEMA_MIGRATIONS[:4]:
+        migration(db)
+    # 旧版本迁移到一半：第一个ALTER已生效，版本号没有更新
+    db.execute("ALTER TABLE memory_metadata ADD COLUMN access_count INTEGER NOT NULL DEFAULT 0")
+    db.execute("PRAGMA user_version = 4")
+    db.commit()
+
+    assert migrate_schema(db) == len(SCHEMA_MIGRATIONS)
+    assert {"access_count", "last_access"} <= columns(db)
+    assert user_version(db) == len(SCHEMA_MIGRATIONS)
+
+
+def test_reclaim_runs_once_on_checkpointer_thread(make_faiss_storage, monkeypatch):
+    monkeypatch.setattr(faiss_storage_impl, "RECLAIM_THRESHOLD", 4)
+    storage = make_faiss_storage()
+    reclaimed = []
+    done = threading.Event()
+
+    def reclaim_space():
+        reclaimed.append(threading.current_thread().name)
+        done.set()
+
+    storage._reclaim_space = reclaim_space
+    for i in range(6):
+        storage.save(f"第{i}条记忆", "alan", "爱莉")
+    ids = [row[0] for row in storage.db.execute("SELECT id FROM memory_metadata ORDER BY id").fetchall()]
+
+    # 整理线程和保留线程并发删除
+    workers = [threading.Thread(target=storage._delete_memories, args=(ids[i::2],)) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert done.wait(5)
+    assert reclaimed == ["faiss-checkpointer"]
+    assert storage._removed_since_reclaim == 0
+    assert storage.count() == 0
@@ -0,0 +1,34 @@
+from apps.chatbot.memory.faiss.keyword_index import normalize_by_max, weighted_score_fusion
+
+HOBBIES = ["看电影", "打篮球", "唱歌", "旅行", "画画", "跑步", "游泳", "下棋", "钓鱼", "爬山",
+           "读书", "写字", "做饭", "摄影", "滑雪", "骑车", "跳舞", "弹琴", "养猫", "养狗"]
+
+
+def test_weighted_score_fusion_keeps_score_gaps():
+    # 关键词一路中1远高于其余候选，向量一路是区分度很低的噪声
+    keyword = normalize_by_max({1: 3.93, 2: 0.035, 3: 0.035})
+    vector = {2: 0.31, 3: 0.30, 4: 0.29, 1: 0.12}
+    fused = weighted_score_fusion([(vector, 0.3), (keyword, 0.7)])
+
+    assert max(fused, key=fused.get) == 1
+    assert fused[1] > 0.7
+    assert all(0.0 <= score <= 1.0 for score in fused.values())
+
+
+def test_weighted_score_fusion_ignores_empty_channels():
+    vector = {1: 0.8, 2: 0.4}
+    assert weighted_score_fusion([(vector, 0.3), ({}, 0.7)]) == vector
+
+
+def test_full_keyword_match_ranks_above_half_matches(make_faiss_storage):
+    storage = make_faiss_storage()
+    for hobby in HOBBIES:
+        storage.save(f"我喜欢{hobby}", "alan", "爱莉")
+    storage.save("我喜欢吃苹果和香蕉", "alan", "爱莉")
+    for hobby in HOBBIES:
+        storage.save(f"他也喜欢{hobby}", "alan", "爱莉")
+
+    results = storage.search("喜欢苹果", limit=3, owner="爱莉")
+
+    # 同时命中“喜欢”“苹果”的记忆BM25远高于只命中“喜欢”的记忆，不能被哈希向量的噪声挤出前3
+    assert results[0] == "我喜欢吃苹果和香蕉"
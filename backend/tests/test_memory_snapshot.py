@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+
+import numpy as np
+
+from apps.chatbot.memory.snapshot import SnapshotWriter, export_snapshot, import_snapshot
+
+
+def test_export_import_round_trip(make_faiss_storage, tmp_path):
+    source = make_faiss_storage(data_dir=str(tmp_path / "source"))
+    for i in range(5):
+        source.save(f"第{i}条已合并进索引文件的记忆", "alan", "爱莉")
+    source.checkpoint()
+    for i in range(3):
+        source.save(f"第{i}条仍在增量索引中的记忆", "bob", "爱莉")
+
+    manifest = export_snapshot(str(tmp_path / "snapshot"), faiss_storage=source)
+    assert manifest["long_memory"]["rows"] == 8
+    # 导出的临时副本已删除
+    assert not [name for name in os.listdir(tmp_path / "snapshot") if name.endswith(".tmp")]
+
+    target = make_faiss_storage(data_dir=str(tmp_path / "target"))
+    assert import_snapshot(str(tmp_path / "snapshot"), faiss_storage=target) == {"long_memory": 8}
+    assert target.owner_counts() == {"爱莉": 8}
+    assert target.search("第1条仍在增量索引中的记忆", limit=1, sender="bob", owner="爱莉") == \
+        ["第1条仍在增量索引中的记忆"]
+
+
+def test_table_is_written_per_column(tmp_path):
+    writer = SnapshotWriter(str(tmp_path))
+    writer.write_table("t", ("id", "text"), [(1, "你好"), (2, None)])
+    writer.finish()
+
+    with gzip.open(tmp_path / "t.text.jsonl.gz", "rt", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == ["你好", None]
+    with open(tmp_path / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert set(manifest["files"]) == {"t.id.jsonl.gz", "t.text.jsonl.gz"}
+
+
+def test_rows_are_streamed_without_holding_checkpoint_lock(make_faiss_storage, tmp_path):
+    storage = make_faiss_storage()
+    for i in range(4):
+        storage.save(f"记忆{i}", "alan", "爱莉")
+    storage.checkpoint()
+    writer = SnapshotWriter(str(tmp_path / "snapshot"))
+    write_table = writer.write_table
+    during_export = []
+
+    def write_table_with_writes(name, columns, rows):
+        # 写出行期间检查点和新的写入都不受阻塞，快照仍是开始时的时间点
+        assert not storage.checkpoint_lock.locked()
+        storage.save("导出期间保存的记忆", "alan", "爱莉")
+        assert storage.checkpoint()
+        during_export.append(name)
+        return write_table(name, columns, rows)
+
+    writer.write_table = write_table_with_writes
+    info = storage.export_snapshot(writer)
+    writer.finish(long_memory=info)
+
+    assert during_export == ["memory_metadata"]
+    assert info["rows"] == 4
+    vectors = np.load(tmp_path / "snapshot" / "vectors.npy")
+    assert vectors.shape == (4, storage.dimension)
+    assert np.all(np.linalg.norm(vectors, axis=1) > 0.99)
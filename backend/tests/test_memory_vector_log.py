@@ -0,0 +1,106 @@
+import numpy as np
+
+from apps.chatbot.memory.faiss import persistence
+from apps.chatbot.memory.faiss.persistence import FSYNC_ALWAYS, VectorLog
+
+DIMENSION = 4
+
+
+def count_fsyncs(monkeypatch, log):
+    """记录对该日志当前段文件的fsync（其他测试遗留的后台线程也可能调用os.fsync）"""
+    calls = []
+    real_fsync = persistence.os.fsync
+
+    def fsync(fd):
+        if not log._file.closed and fd == log._file.fileno():
+            calls.append(fd)
+        real_fsync(fd)
+
+    monkeypatch.setattr(persistence.os, "fsync", fsync)
+    return calls
+
+
+def append(log, start, count=1):
+    ids = np.arange(start, start + count, dtype=np.int64)
+    log.append_add(ids, np.zeros((count, DIMENSION), dtype=np.float32))
+
+
+def test_group_commit_fsyncs_per_group_and_on_rotate(tmp_path, monkeypatch):
+    log = VectorLog(str(tmp_path / "wal"), DIMENSION, group_records=4, group_interval=60)
+    calls = count_fsyncs(monkeypatch, log)
+    for i in range(3):
+        append(log, i)
+    assert calls == []
+
+    append(log, 3)
+    assert len(calls) == 1
+
+    append(log, 4)
+    log.rotate()
+    assert len(calls) == 2
+    log.close()
+
+
+def test_group_commit_fsyncs_after_interval(tmp_path, monkeypatch):
+    log = VectorLog(str(tmp_path / "wal"), DIMENSION, group_records=100, group_interval=0.01)
+    calls = count_fsyncs(monkeypatch, log)
+    append(log, 0)
+    for _ in range(100):
+        if calls:
+            break
+        log._closed.wait(0.01)
+    assert len(calls) == 1
+    log.close()
+
+
+def test_always_fsyncs_every_append(tmp_path, monkeypatch):
+    log = VectorLog(str(tmp_path / "wal"), DIMENSION, fsync=FSYNC_ALWAYS)
+    calls = count_fsyncs(monkeypatch, log)
+    for i in range(3):
+        append(log, i)
+    assert len(calls) == 3
+    log.close()
+
+
+def test_pending_records_kept_until_checkpoint_succeeds(tmp_path):
+    log = VectorLog(str(tmp_path / "wal"), DIMENSION)
+    append(log, 0, count=3)
+    log.rotate()
+    append(log, 3, count=2)
+    # 检查点失败：封存段的记录仍计为未合并
+    assert log.pending_records == 5
+
+    log.rotate()
+    log.mark_checkpointed()
+    assert log.pending_records == 0
+    assert log.pending_bytes == 0
+    log.close()
+
+
+def test_failed_checkpoint_keeps_pending_records(make_faiss_storage, monkeypatch):
+    storage = make_faiss_storage()
+    storage.save_many([{"text": f"记忆{i}", "sender": "alan", "owner": "爱莉"} for i in range(3)])
+
+    def broken_merge(path, snapshot):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(storage.index, "build_merged", broken_merge)
+    assert storage.checkpoint(rebuild=False) is False
+    assert storage.vector_log.pending_records == 3
+
+    monkeypatch.undo()
+    assert storage.checkpoint(rebuild=False) is True
+    assert storage.vector_log.pending_records == 0
+
+
+def test_replay_skips_ids_already_in_index_file(make_faiss_storage, tmp_path, monkeypatch):
+    data_dir = str(tmp_path / "memory")
+    storage = make_faiss_storage(data_dir=data_dir)
+    storage.save_many([{"text": f"记忆{i}", "sender": "alan", "owner": "爱莉"} for i in range(3)])
+    # 检查点写完索引文件后、删除日志段前崩溃
+    monkeypatch.setattr(storage.vector_log, "purge", lambda upto_seq: None)
+    assert storage.checkpoint(rebuild=False) is True
+    storage.vector_log.close()
+
+    restarted = make_faiss_storage(data_dir=data_dir)
+    assert restarted.index.ntotal == 3
@@ -0,0 +1,94 @@
+import json
+import time
+
+import pytest
+
+from apps.chatbot.memory import short_term_memory
+from apps.chatbot.memory.short_term_memory import ShortTermMemory, ShortTermWriteError
+
+
+class FlakyStorage:
+    """按批原子写入的假存储，前failures次写入失败（与LocalStorage.save_many一样返回0）"""
+
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.rows = []
+        self.calls = 0
+
+    def save_many(self, memories):
+        self.calls += 1
+        if self.failures > 0:
+            self.failures -= 1
+            return 0
+        self.rows.extend(memories)
+        return len(memories)
+
+    def recent(self, owner, sender, limit):
+        return [row["text"] for row in self.rows if row["owner"] == owner and row["sender"] == sender][-limit:]
+
+    def clear(self, owner):
+        self.rows = [row for row in self.rows if row["owner"] != owner]
+        return True
+
+
+def record(owner, sender, i):
+    entry = {"human": f"q{i}", "ai": f"a{i}"}
+    return {"owner": owner, "sender": sender, "entry": entry,
+            "memory": {"text": json.dumps(entry), "sender": sender, "owner": owner}}
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(short_term_memory, "RETRY_BACKOFF", 0.05)
+    monkeypatch.setattr(short_term_memory, "MAX_RETRY_BACKOFF", 0.1)
+
+
+def test_failed_write_keeps_pending_records():
+    storage = FlakyStorage(failures=1)
+    memory = ShortTermMemory(storage)
+    memory.stop()
+    # 停止后台线程，由测试直接调用flush
+    memory._thread.join(2)
+    with memory._lock:
+        memory._pending.extend(record("alan", "爱莉", i) for i in range(3))
+
+    with pytest.raises(ShortTermWriteError):
+        memory.flush()
+    assert memory.pending_count() == 3
+    assert storage.rows == []
+
+    assert memory.flush() == 3
+    assert memory.pending_count() == 0
+    assert [json.loads(row["text"])["human"] for row in storage.rows] == ["q0", "q1", "q2"]
+
+
+def test_background_writer_retries_with_backoff(fast_backoff):
+    storage = FlakyStorage(failures=2)
+    memory = ShortTermMemory(storage)
+    try:
+        memory.append_many([record("alan", "爱莉", i) for i in range(5)])
+        deadline = time.monotonic() + 3
+        while memory.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+        assert memory.pending_count() == 0
+        assert storage.calls >= 3
+        # 失败的批次没有重复写入，也没有丢失
+        assert len(storage.rows) == 5
+        assert [entry["human"] for entry in memory.recent("alan", "爱莉", 10)] == [f"q{i}" for i in range(5)]
+    finally:
+        memory.stop()
+
+
+def test_records_without_text_are_dropped():
+    storage = FlakyStorage()
+    memory = ShortTermMemory(storage)
+    memory.stop()
+    memory._thread.join(2)
+    empty = record("alan", "爱莉", 0)
+    empty["memory"]["text"] = ""
+    with memory._lock:
+        memory._pending.extend([empty, record("alan", "爱莉", 1)])
+
+    assert memory.flush() == 1
+    assert memory.pending_count() == 0
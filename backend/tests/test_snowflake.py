@@ -0,0 +1,87 @@
+import itertools
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from apps.chatbot.utils import snowflake_utils
+from apps.chatbot.utils.snowflake_utils import SEQUENCE_MASK, SnowFlake, WorkerIdConflictError, allocate_worker_id
+
+# 在另一个进程中占用机器编号，读到一行输出后说明锁已持有，关闭标准输入时退出
+HOLD_WORKER_ID = """
+import sys
+from apps.chatbot.utils.snowflake_utils import allocate_worker_id
+print(allocate_worker_id(int(sys.argv[1]), lock_dir=sys.argv[2]), flush=True)
+sys.stdin.read()
+"""
+
+
+def test_sequence_overflow_moves_to_next_millisecond(monkeypatch):
+    # 前SEQUENCE_MASK + 3次取时间都在同一毫秒内，之后进入下一毫秒
+    clock = itertools.chain([1_700_000_000_000] * (SEQUENCE_MASK + 3), itertools.repeat(1_700_000_000_001))
+    snow_flake = SnowFlake(6, 6)
+    monkeypatch.setattr(snow_flake, "_timestamp", lambda: next(clock))
+
+    ids = [snow_flake.task() for _ in range(SEQUENCE_MASK + 3)]
+
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert snow_flake.last_timestamp == 1_700_000_000_001
+
+
+def test_concurrent_tasks_do_not_repeat():
+    snow_flake = SnowFlake(6, 6)
+    results = [[] for _ in range(4)]
+
+    def run(out):
+        out.extend(snow_flake.task() for _ in range(5000))
+
+    threads = [threading.Thread(target=run, args=(out,)) for out in results]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [i for out in results for i in out]
+    assert len(set(ids)) == len(ids)
+
+
+@pytest.fixture
+def hold_worker_id(tmp_path):
+    processes = []
+
+    def hold(worker_id):
+        process = subprocess.Popen([sys.executable, "-c", HOLD_WORKER_ID, str(worker_id), str(tmp_path)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        processes.append(process)
+        return int(process.stdout.readline())
+
+    yield hold
+    for process in processes:
+        process.communicate(timeout=10)
+
+
+def test_configured_worker_id_held_by_another_process_refuses_to_start(tmp_path, hold_worker_id):
+    assert hold_worker_id(3) == 3
+
+    with pytest.raises(WorkerIdConflictError):
+        allocate_worker_id(3, lock_dir=str(tmp_path))
+    assert allocate_worker_id(4, lock_dir=str(tmp_path)) == 4
+
+
+def test_automatic_worker_id_skips_ids_held_by_other_processes(tmp_path, hold_worker_id):
+    assert hold_worker_id(-1) == 0
+
+    worker_id = allocate_worker_id(lock_dir=str(tmp_path))
+    assert worker_id == 1
+    # 同一进程只分配一次
+    assert allocate_worker_id(lock_dir=str(tmp_path)) == worker_id
+
+
+def test_worker_id_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv(snowflake_utils.WORKER_ID_ENV, "7")
+    assert allocate_worker_id(lock_dir=str(tmp_path)) == 7
+    assert allocate_worker_id(9, lock_dir=str(tmp_path)) == 9
@@ -0,0 +1,99 @@
+import json
+import threading
+
+import pytest
+
+from apps.chatbot.memory.summary_pipeline import SummaryPipeline
+
+
+class FlakyStore:
+    """按批原子写入的假长期记忆，前failures次写入失败（与FAISSStorage.save_many一样返回0）"""
+
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.rows = []
+
+    def __call__(self, memories):
+        if self.failures > 0:
+            self.failures -= 1
+            return 0
+        self.rows.extend(memories)
+        return len(memories)
+
+
+def memory(owner, i):
+    return {"text": f"{owner}说第{i}句", "sender": "alan", "owner": owner, "importance_score": 1}
+
+
+def summarize_all(query):
+    count = len(query.splitlines()) - 1
+    return json.dumps([{"id": i + 1, "summary": f"摘要{i + 1}", "importance": 5} for i in range(count)])
+
+
+@pytest.fixture
+def pipelines():
+    created = []
+
+    def make(**kwargs):
+        # 不满一批且远未超时，只有测试中的flush(force=True)会处理这些对话
+        kwargs.setdefault("max_wait", 3600)
+        pipeline = SummaryPipeline(**kwargs)
+        created.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in created:
+        pipeline.stop(timeout=5)
+
+
+def test_stop_stores_pending_memories_as_raw_text(pipelines):
+    store = FlakyStore()
+    pipeline = pipelines(summarize=summarize_all, store=store, batch_size=8)
+    pipeline.submit([memory("爱莉", i) for i in range(3)])
+
+    pipeline.stop(timeout=5)
+
+    assert [row["text"] for row in store.rows] == [f"爱莉说第{i}句" for i in range(3)]
+    assert pipeline.stats()["fallbacks"] == 3
+
+
+def test_saturated_workers_store_raw_memories_immediately(pipelines):
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocked(query):
+        started.set()
+        release.wait(5)
+        return summarize_all(query)
+
+    store = FlakyStore()
+    pipeline = pipelines(summarize=blocked, store=store, deadline=0.05, workers=1)
+    pipeline.submit([memory("爱莉", i) for i in range(2)])
+    # 第一批超时后调用仍在运行，占用唯一的摘要名额
+    assert pipeline.flush(force=True) == 2
+    assert started.is_set()
+    assert pipeline.stats()["inflight"] == 1
+
+    pipeline.submit([memory("琪亚娜", i) for i in range(2)])
+    assert pipeline.flush(force=True) == 2
+    stats = pipeline.stats()
+    assert stats["llm_calls"] == 1
+    assert stats["saturated"] == 1
+    assert [row["text"] for row in store.rows[2:]] == ["琪亚娜说第0句", "琪亚娜说第1句"]
+
+    release.set()
+
+
+def test_failed_store_is_retried_on_next_flush(pipelines):
+    store = FlakyStore(failures=1)
+    pipeline = pipelines(summarize=summarize_all, store=store)
+    pipeline.submit([memory("爱莉", i) for i in range(2)])
+
+    assert pipeline.flush(force=True) == 0
+    stats = pipeline.stats()
+    assert stats["store_failures"] == 1
+    assert stats["failed"] == 2
+
+    assert pipeline.flush(force=True) == 2
+    assert [row["text"] for row in store.rows] == ["摘要1", "摘要2"]
+    assert pipeline.stats()["failed"] == 0